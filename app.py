@@ -6,20 +6,26 @@ import logging
 import threading
 import base64
 import asyncio
-import aiohttp
 import json
-from urllib.parse import urlparse
+import itertools
+import collections
+import secrets
+import bisect
+from urllib.parse import quote, urlparse, parse_qs
 
-# --- Logging Setup ---
-log_format = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-logging.basicConfig(level=logging.INFO, format=log_format, stream=sys.stdout)
-logger = logging.getLogger(__name__)
-
-# --- HARDCODED Configuration ---
-SECRET_KEY = 'super_secret_flask_key_12345_hardcoded'
-ACCESS_PASSWORD = 'mypassword123'  # Change this to your desired password
-REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')  # Will use Render's Redis if available
-ANTHROPIC_API_KEY = 'sk-ant-REDACTED'  # Your API key
+# Configuration, logging, viewer assets and relay settings are shared with async_app.py
+from server_common import (
+    logger, log_sampled, DroppingQueueHandler, SECRET_KEY, REDIS_URL, ANTHROPIC_API_KEY, ACCESS_PASSWORD,
+    CLIENT_REDIS_KEY, CLIENT_BULK_REDIS_KEY, MONITORS_KEY, AI_ENABLED_KEY, AI_ANSWER_KEY,
+    analyze_screenshot_with_claude, parse_ai_answer, check_auth, build_viewer_bundle, ASSET_CACHE_CONTROL, PAGE_CACHE_CONTROL,
+    BULK_NAMESPACE, VIEWERS_ROOM, RESUME_GRACE, SIMULCAST_MAX_IN_FLIGHT, SIMULCAST_UPGRADE_DELAY, SIMULCAST_RATE_WINDOW, SIMULCAST_KEEPUP_RATIO,
+    FRAME_SOCKET_PC_PATH, FRAME_SOCKET_VIEW_PATH, FRAME_SOCKET_PLAYBACK_PATH, FRAME_SOCKET_QUEUE_FRAMES,
+    INPUT_LATENCY_BUCKETS_MS, INPUT_COALESCE_INTERVAL, HTTP_TRANSFER_CHUNK_SIZE, HTTP_TRANSFER_QUEUE_CHUNKS, HTTP_TRANSFER_TIMEOUT,
+    monitor_room, ewma, pack_frame, unpack_frame_header, starts_picture, ends_picture, coalesce_moves, clipboard_record, parse_watch_message,
+    SESSION_RECORDING_DIR, SESSION_RECORDING_QUEUE, SESSION_KEYFRAME_INTERVAL, RECORD_FRAME, RECORD_INPUT, RECORD_CLIPBOARD,
+    new_recording_id, recording_path, is_keyframe, write_recording_header, write_recording_batch, read_record,
+    read_recording_header, read_recording_index, seek_offset, playback_event, playback_info, parse_playback_params, parse_seek_command, list_recordings,
+)
 
 # --- Critical Redis Setup BEFORE any imports that might monkey patch ---
 if not REDIS_URL:
@@ -67,11 +73,15 @@ except redis.exceptions.ConnectionError as e:
 
 # NOW it's safe to monkey patch after Redis connection is established
 import eventlet
+import eventlet.queue
+import eventlet.semaphore
+import eventlet.websocket
+import eventlet.tpool
 eventlet.monkey_patch()
 
 # Import Flask after monkey patching
-from flask import Flask, request, session, redirect, url_for, render_template_string
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, jsonify, request, session, redirect, url_for, render_template_string
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_socketio import disconnect as server_disconnect_client
 
 # --- App Setup ---
@@ -81,356 +91,61 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB upload limit
 socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", ping_timeout=90, ping_interval=30,
                     max_http_buffer_size=20 * 1024 * 1024, logger=False, engineio_logger=False)
 
-# --- Redis Key Management ---
-CLIENT_REDIS_KEY = f"remote_client_sid:{ACCESS_PASSWORD}"
-AI_ENABLED_KEY = f"ai_enabled:{ACCESS_PASSWORD}"
-AI_ANSWER_KEY = f"ai_answer:{ACCESS_PASSWORD}"
-
-# --- Claude AI Configuration ---
-CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
-CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
-
-SYSTEM_PROMPT = """You are an AI assistant that analyzes screenshots to help answer questions. 
-
-CRITICAL INSTRUCTIONS:
-1. Look at the screenshot carefully
-2. Identify any questions, problems, or tasks shown
-3. Provide ONLY the direct answer - no explanations, no reasoning, no additional text
-4. Format your response as: answer=[your answer here]
-5. If it's a multiple choice question, give the letter/option (e.g., answer=B)
-6. If it's a math problem, give the number (e.g., answer=42)
-7. If it's a short answer, give the exact answer (e.g., answer=photosynthesis)
-8. If it's an essay question or requires a long response, write the full response after the equals sign
-
-Examples:
-- For "What is 2+2?" respond: answer=4
-- For "Which is correct? A) Dog B) Cat" respond: answer=A
-- For "Explain photosynthesis" respond: answer=Photosynthesis is the process by which plants convert sunlight into energy...
-
-Be precise and direct. Only provide what is asked for."""
-
-# --- AI Helper Functions ---
-async def analyze_screenshot_with_claude(image_base64):
-    """Send screenshot to Claude API for analysis"""
-    if not ANTHROPIC_API_KEY:
-        logger.error("ANTHROPIC_API_KEY not set")
-        return None
-    
-    # Use hostname for HTTPS requests to avoid SSL issues
-    api_url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "content-type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-    
-    payload = {
-        "model": CLAUDE_MODEL,
-        "max_tokens": 2000,
-        "system": SYSTEM_PROMPT,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Please analyze this screenshot and provide the answer to any question or problem you see. Follow the format: answer=[your answer]"
-                    },
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": image_base64
-                        }
-                    }
-                ]
-            }
-        ]
-    }
-    
-    try:
-        # Create a longer timeout and better error handling
-        timeout = aiohttp.ClientTimeout(total=60, connect=30)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(api_url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    content = result.get('content', [])
-                    if content and len(content) > 0:
-                        return content[0].get('text', '')
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Claude API error {response.status}: {error_text}")
-                    return None
-    except asyncio.TimeoutError:
-        logger.error("Claude API request timed out")
-        return None
-    except Exception as e:
-        logger.error(f"Error calling Claude API: {e}")
-        return None
-
-def parse_ai_answer(ai_response):
-    """Parse AI response to extract answer and determine if it's clickable or essay"""
-    if not ai_response:
-        return None, None, None
-    
-    # Look for answer= pattern
-    if "answer=" in ai_response.lower():
-        answer_start = ai_response.lower().find("answer=") + 7
-        answer = ai_response[answer_start:].strip()
-        
-        # Determine if it's a clickable answer (single letter/number) or essay
-        if len(answer) <= 5 and (answer.isalnum() or answer in ['A', 'B', 'C', 'D', 'E', 'True', 'False']):
-            return answer, "clickable", ai_response
-        else:
-            return answer, "essay", ai_response
-    
-    return None, None, ai_response
-
 # --- Redis Helper Functions with Error Handling ---
 def safe_redis_get(key, default=None):
     try:
         return redis_client.get(key)
     except Exception as e:
-        logger.error(f"Redis GET error for key {key}: {e}")
+        log_sampled(('redis', 'GET'), logging.ERROR, "Redis GET error for key %s: %s", key, e)
         return default
 
 def safe_redis_set(key, value, ex=None):
     try:
         return redis_client.set(key, value, ex=ex)
     except Exception as e:
-        logger.error(f"Redis SET error for key {key}: {e}")
+        log_sampled(('redis', 'SET'), logging.ERROR, "Redis SET error for key %s: %s", key, e)
         return False
 
 def safe_redis_delete(key):
     try:
         return redis_client.delete(key)
     except Exception as e:
-        logger.error(f"Redis DELETE error for key {key}: {e}")
+        log_sampled(('redis', 'DELETE'), logging.ERROR, "Redis DELETE error for key %s: %s", key, e)
         return False
 
 def safe_redis_exists(key):
     try:
         return redis_client.exists(key)
     except Exception as e:
-        logger.error(f"Redis EXISTS error for key {key}: {e}")
+        log_sampled(('redis', 'EXISTS'), logging.ERROR, "Redis EXISTS error for key %s: %s", key, e)
         return False
 
-# --- Authentication ---
-def check_auth(password):
-    return password == ACCESS_PASSWORD
-
-# --- HTML Templates ---
-LOGIN_HTML = """
-<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Remote Control - Login</title><script src="https://cdn.tailwindcss.com"></script><link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet"><style> body { font-family: 'Inter', sans-serif; } </style></head><body class="bg-gray-100 flex items-center justify-center h-screen"><div class="bg-white p-8 rounded-lg shadow-md w-full max-w-sm"><h1 class="text-2xl font-semibold text-center text-gray-700 mb-6">Remote Access Login</h1>{% if error %}<div class="bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded relative mb-4" role="alert"><span class="block sm:inline">{{ error }}</span></div>{% endif %}<form method="POST" action="{{ url_for('index') }}"><div class="mb-4"><label for="password" class="block text-gray-700 text-sm font-medium mb-2">Password</label><input type="password" id="password" name="password" required class="w-full px-4 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent" placeholder="Enter access password"></div><button type="submit" class="w-full bg-blue-600 hover:bg-blue-700 text-white font-semibold py-2 px-4 rounded-md transition duration-200 ease-in-out">Login</button></form><div class="mt-4 text-center text-sm text-gray-600">Password: mypassword123</div></div></body></html>
-"""
-
-INTERFACE_HTML = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI-Enhanced Remote Desktop</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.4/socket.io.min.js"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        body { font-family: 'Inter', sans-serif; }
-        #main-content { display: flex; flex-direction: column; height: calc(100vh - 3.5rem); }
-        #screen-view-area { flex-grow: 1; background-color: #000; overflow: hidden; position: relative; transition: height 0.3s ease-in-out; }
-        #text-input-area { height: 0; overflow: hidden; background-color: #f9fafb; padding:0; transition: height 0.3s ease-in-out; }
-        body.text-input-mode #screen-view-area { height: 50%; } body.text-input-mode #text-input-area { height: 50%; padding: 1rem; }
-        #screen-view-area img { max-width: 100%; max-height: 100%; height: auto; width: auto; display: block; cursor: crosshair; object-fit: contain; }
-        .status-dot { height: 10px; width: 10px; border-radius: 50%; display: inline-block; margin-right: 5px; }
-        .status-connected { background-color: #4ade80; } .status-disconnected { background-color: #f87171; } .status-connecting { background-color: #fbbf24; }
-        .control-button { padding: 0.5rem 1rem; background-color: #2563eb; color: white; border: none; border-radius: 0.375rem; cursor: pointer; transition: background-color 0.2s; margin-right: 0.5rem; }
-        .control-button:hover { background-color: #1d4ed8; } .control-button.active { background-color: #16a34a; } .control-button.active:hover { background-color: #15803d; }
-        .ai-button { background-color: #7c3aed; } .ai-button:hover { background-color: #6d28d9; } .ai-button.active { background-color: #059669; }
-        #injection-text { width: 100%; flex-grow: 1; padding: 0.75rem; border: 1px solid #d1d5db; border-radius: 0.375rem; font-family: monospace; resize: none; }
-        input[type=range] { -webkit-appearance: none; background: transparent; cursor: pointer; }
-        input[type=range]::-webkit-slider-runnable-track { height: 4px; background: #60a5fa; border-radius: 2px; }
-        input[type=range]::-webkit-slider-thumb { -webkit-appearance: none; appearance: none; margin-top: -6px; background-color: #1d4ed8; height: 16px; width: 16px; border-radius: 50%; }
-        #file-progress-container { position: fixed; bottom: 1rem; left: 50%; transform: translateX(-50%); background-color: rgba(0,0,0,0.7); color: white; padding: 0.5rem 1rem; border-radius: 8px; z-index: 100; display: none; }
-        #file-progress-bar { width: 200px; height: 10px; background-color: #555; border-radius: 5px; overflow: hidden; }
-        #file-progress { width: 0%; height: 100%; background-color: #4ade80; transition: width 0.2s; }
-        #ai-status { position: fixed; top: 4rem; right: 1rem; background-color: rgba(0,0,0,0.8); color: white; padding: 0.5rem 1rem; border-radius: 8px; z-index: 100; display: none; }
-        .ai-thinking { background-color: #7c3aed; animation: pulse 2s infinite; }
-        @keyframes pulse { 0%, 100% { opacity: 1; } 50% { opacity: 0.5; } }
-        .instructions { background-color: #eff6ff; border: 1px solid #3b82f6; border-radius: 0.5rem; padding: 0.75rem; margin: 0.5rem; font-size: 0.875rem; }
-    </style>
-</head>
-<body class="bg-gray-200 flex flex-col h-screen" tabindex="0">
-    <header class="bg-gray-800 text-white p-3 flex justify-between items-center shadow-md flex-shrink-0 h-14">
-        <h1 class="text-lg font-semibold">🤖 AI Remote Desktop</h1>
-        <div class="flex items-center space-x-4">
-            <div class="flex items-center space-x-2 text-xs">
-                <span title="Image Quality">Q:</span> <input type="range" id="quality-slider" min="10" max="95" value="75" class="w-20">
-                <span title="Frames Per Second">FPS:</span> <input type="range" id="fps-slider" min="1" max="30" value="5" class="w-20">
-            </div>
-            <button id="ai-toggle-button" class="control-button ai-button text-xs" title="Toggle AI Assistant (F4 to analyze screen)">🤖 AI Off</button>
-            <button id="upload-file-button" class="control-button text-xs">Upload File</button>
-            <input type="file" id="file-input" style="display: none;">
-            <button id="toggle-text-mode-button" class="control-button text-xs">Text Input</button>
-            <div id="connection-status" class="flex items-center text-xs">
-                <span id="status-dot" class="status-dot status-connecting"></span>
-                <span id="status-text">Connecting...</span>
-                <span id="latency-text" class="ml-2 text-gray-400">(---ms)</span>
-            </div>
-            <a href="{{ url_for('logout') }}" class="bg-red-600 hover:bg-red-700 text-white text-xs font-medium py-1 px-2 rounded-md">Logout</a>
-        </div>
-    </header>
-    
-    <div class="instructions">
-        📖 <strong>Instructions:</strong> 
-        1️⃣ Click 🤖 AI button to enable AI assistant | 
-        2️⃣ On client: Press <strong>F4</strong> to analyze screenshot | 
-        3️⃣ AI auto-clicks answers or stores essays | 
-        4️⃣ Press <strong>F2</strong> to type stored text
-    </div>
-    
-    <main id="main-content" class="p-2">
-        <div id="screen-view-area">
-            <img id="screen-image" src="data:image/gif;base64,R0lGODlhAQABAAD/ACwAAAAAAQABAAACADs=" alt="Remote Screen">
-        </div>
-        <div id="text-input-area" class="flex flex-col">
-            <textarea id="injection-text" placeholder="🤖 AI answers appear here automatically. Manual text also works. Press F2 on client to type this text."></textarea>
-            <div class="mt-2 flex justify-end">
-                <p id="injection-status" class="text-xs text-green-600 mr-auto self-center"></p>
-                <button id="send-injection-text-button" class="control-button text-sm">Save Text</button>
-            </div>
-        </div>
-    </main>
-    <div id="file-progress-container">
-        <span id="file-name-progress"></span>
-        <div id="file-progress-bar"><div id="file-progress"></div></div>
-        <span id="file-percent-progress">0%</span>
-    </div>
-    <div id="ai-status">🤖 AI is thinking...</div>
-    <script>
-    document.addEventListener('DOMContentLoaded', () => {
-        const socket = io(window.location.origin, { path: '/socket.io/' });
-        const screenImage = document.getElementById('screen-image');
-        const statusDot = document.getElementById('status-dot');
-        const statusText = document.getElementById('status-text');
-        const latencyText = document.getElementById('latency-text');
-        const toggleTextModeButton = document.getElementById('toggle-text-mode-button');
-        const qualitySlider = document.getElementById('quality-slider');
-        const fpsSlider = document.getElementById('fps-slider');
-        const uploadButton = document.getElementById('upload-file-button');
-        const fileInput = document.getElementById('file-input');
-        const aiToggleButton = document.getElementById('ai-toggle-button');
-        const aiStatus = document.getElementById('ai-status');
-        const injectionText = document.getElementById('injection-text');
-        
-        let remoteScreenWidth = null;
-        let remoteScreenHeight = null;
-        let currentImageUrl = null;
-        let aiEnabled = false;
-        
-        document.body.focus();
-        document.addEventListener('click', (e) => { if (document.getElementById('text-input-area').contains(e.target)) return; document.body.focus(); });
-        
-        function updateStatus(status, message) { statusText.textContent = message; statusDot.className = `status-dot ${status}`; }
-        function cleanupState() { remoteScreenWidth = null; remoteScreenHeight = null; screenImage.src = 'data:image/gif;base64,R0lGODlhAQABAAD/ACwAAAAAAQABAAACADs='; }
-        
-        function showAiStatus() {
-            aiStatus.style.display = 'block';
-            aiStatus.className = 'ai-thinking';
-        }
-        
-        function hideAiStatus() {
-            aiStatus.style.display = 'none';
-            aiStatus.className = '';
-        }
-        
-        // AI Toggle
-        aiToggleButton.addEventListener('click', () => {
-            aiEnabled = !aiEnabled;
-            aiToggleButton.textContent = aiEnabled ? '🤖 AI On' : '🤖 AI Off';
-            aiToggleButton.className = aiEnabled ? 'control-button ai-button text-xs active' : 'control-button ai-button text-xs';
-            socket.emit('toggle_ai_mode', { enabled: aiEnabled });
-        });
-        
-        socket.on('connect', () => { updateStatus('status-connecting', 'Server connected, waiting for PC...'); socket.emit('check_client_status'); });
-        socket.on('disconnect', () => { updateStatus('status-disconnected', 'Server disconnected'); cleanupState(); });
-        socket.on('connect_error', () => { updateStatus('status-disconnected', 'Connection Error'); cleanupState(); });
-        socket.on('client_connected', () => { updateStatus('status-connected', 'Remote PC Connected'); document.body.focus(); });
-        socket.on('client_disconnected', () => { updateStatus('status-disconnected', 'Remote PC Disconnected'); cleanupState(); });
-        socket.on('command_error', (data) => console.error(`Command Error: ${data.message}`));
-        
-        socket.on('ai_analysis_started', () => {
-            showAiStatus();
-        });
-        
-        socket.on('ai_analysis_complete', (data) => {
-            hideAiStatus();
-            if (data.answer) {
-                if (data.answer_type === 'essay') {
-                    injectionText.value = data.answer;
-                    document.body.classList.add('text-input-mode');
-                    document.getElementById('injection-status').textContent = '🤖 AI essay answer loaded! Press F2 on client to type.';
-                } else {
-                    document.getElementById('injection-status').textContent = `🤖 AI found answer: ${data.answer} (will auto-click)`;
-                }
-                socket.emit('set_injection_text', { text_to_inject: injectionText.value });
-            } else {
-                document.getElementById('injection-status').textContent = '🤖 AI could not find an answer in the screenshot.';
-            }
-            setTimeout(() => { document.getElementById('injection-status').textContent = ''; }, 5000);
-        });
-        
-        socket.on('ai_analysis_error', () => {
-            hideAiStatus();
-            document.getElementById('injection-status').textContent = '❌ AI analysis failed. Check API key.';
-            setTimeout(() => { document.getElementById('injection-status').textContent = ''; }, 3000);
-        });
-        
-        socket.on('screen_frame_bytes', (imageDataBytes) => {
-            const blob = new Blob([imageDataBytes], { type: 'image/jpeg' });
-            const newImageUrl = URL.createObjectURL(blob);
-            if (remoteScreenWidth === null) {
-                const tempImg = new Image();
-                tempImg.onload = () => { remoteScreenWidth = tempImg.naturalWidth; remoteScreenHeight = tempImg.naturalHeight; URL.revokeObjectURL(tempImg.src); };
-                tempImg.src = newImageUrl;
-            }
-            if (currentImageUrl) URL.revokeObjectURL(currentImageUrl);
-            currentImageUrl = newImageUrl;
-            screenImage.src = newImageUrl;
-        });
-        
-        setInterval(() => { const start = Date.now(); socket.emit('ping_from_browser', () => { const latency = Date.now() - start; latencyText.textContent = `(${latency}ms)`; }); }, 2000);
-        
-        screenImage.addEventListener('mousemove', (event) => { if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'move', x: remoteX, y: remoteY }); });
-        screenImage.addEventListener('click', (event) => { if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'click', button: 'left', x: remoteX, y: remoteY }); document.body.focus(); });
-        screenImage.addEventListener('contextmenu', (event) => { event.preventDefault(); if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'click', button: 'right', x: remoteX, y: remoteY }); document.body.focus(); });
-        screenImage.addEventListener('wheel', (event) => { event.preventDefault(); const dY = event.deltaY > 0 ? 1 : (event.deltaY < 0 ? -1 : 0); if (dY) socket.emit('control_command', { action: 'scroll', dy: dY }); });
-        
-        document.body.addEventListener('keydown', (event) => { if (document.activeElement.tagName === 'TEXTAREA') return; const keysToPrevent = ['Tab', 'Enter', 'Escape', 'Backspace', 'Delete', 'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', ' ']; if (keysToPrevent.includes(event.key) || (event.key.length === 1 && !event.ctrlKey && !event.altKey && !event.metaKey)) { event.preventDefault(); } socket.emit('control_command', { action: 'keydown', key: event.key, code: event.code }); });
-        document.body.addEventListener('keyup', (event) => { if (document.activeElement.tagName === 'TEXTAREA') return; socket.emit('control_command', { action: 'keyup', key: event.key, code: event.code }); });
-        
-        toggleTextModeButton.addEventListener('click', () => { document.body.classList.toggle('text-input-mode'); });
-        document.getElementById('send-injection-text-button').addEventListener('click', () => { const text = document.getElementById('injection-text').value; socket.emit('set_injection_text', { text_to_inject: text }); });
-        
-        socket.on('text_injection_set_ack', (data) => { const statusEl = document.getElementById('injection-status'); statusEl.textContent = data.status === 'success' ? 'Text saved for client!' : `Error: ${data.message || 'Failed to save.'}`; setTimeout(() => { statusEl.textContent = ''; }, 3000); });
-        
-        function sendSettingsUpdate() { socket.emit('update_client_settings', { quality: parseInt(qualitySlider.value, 10), fps: parseInt(fpsSlider.value, 10) }); }
-        qualitySlider.addEventListener('change', sendSettingsUpdate);
-        fpsSlider.addEventListener('change', sendSettingsUpdate);
-        
-        socket.on('update_browser_clipboard', (data) => { if (navigator.clipboard && data.text) { navigator.clipboard.writeText(data.text).catch(err => console.error('Failed to write to browser clipboard:', err)); } });
-        document.addEventListener('paste', (event) => { if (document.activeElement === document.body) { const text = event.clipboardData.getData('text'); if (text) socket.emit('clipboard_from_browser', { text: text }); } });
-        
-        uploadButton.addEventListener('click', () => fileInput.click());
-        fileInput.addEventListener('change', (event) => { const file = event.target.files[0]; if (file) uploadFile(file); fileInput.value = ''; });
-        
-        function uploadFile(file) { const CHUNK_SIZE = 1024 * 1024; let offset = 0; const progressContainer = document.getElementById('file-progress-container'); const progressText = document.getElementById('file-name-progress'); const progressBar = document.getElementById('file-progress'); const progressPercent = document.getElementById('file-percent-progress'); progressText.textContent = `Uploading: ${file.name}`; progressContainer.style.display = 'block'; function readChunk() { const slice = file.slice(offset, offset + CHUNK_SIZE); const reader = new FileReader(); reader.onload = (e) => { if (e.target.error) { console.error('File read error:', e.target.error); progressContainer.style.display = 'none'; return; } socket.emit('file_chunk', { name: file.name, data: e.target.result, offset: offset }, (ack) => { if (ack.status !== 'ok') { console.error('File chunk upload failed:', ack.message); progressContainer.style.display = 'none'; return; } offset += e.target.result.byteLength; const percentComplete = Math.round((offset / file.size) * 100); progressBar.style.width = `${percentComplete}%`; progressPercent.textContent = `${percentComplete}%`; if (offset < file.size) { readChunk(); } else { socket.emit('file_upload_complete', { name: file.name, size: file.size }); setTimeout(() => { progressContainer.style.display = 'none'; }, 2000); } }); }; reader.readAsArrayBuffer(slice); } readChunk(); }
-    });
-    </script>
-</body>
-</html>
-"""
+# --- Static Viewer Assets ---
+# Pages, CSS and JS are rendered, minified and compressed once per process instead of per request
+# (see build_viewer_bundle). Assets get content-hashed URLs and are cached for a year; pages are
+# revalidated through their ETag.
+static_assets = {}
+built_pages = {}
+
+def build_viewer_assets():
+    if built_pages:
+        return built_pages
+    with app.test_request_context():
+        pages, assets = build_viewer_bundle(render_template_string, lambda filename: url_for('asset', filename=filename))
+    static_assets.update(assets)
+    built_pages.update(pages)
+    return built_pages
+
+def send_prebuilt(entry, cache_control):
+    accepted = request.accept_encodings
+    encoding = next((name for name in ('br', 'gzip') if name in entry['variants'] and accepted[name]), 'identity')
+    response = Response(entry['variants'][encoding], mimetype=entry['mimetype'])
+    response.set_etag(f"{entry['digest']}-{encoding}")
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
 
 # --- Health Check Background Task ---
 def redis_health_check():
@@ -453,22 +168,58 @@ def index():
         if check_auth(password):
             session['authenticated'] = True
             return redirect(url_for('interface'))
-        return render_template_string(LOGIN_HTML, error="Invalid password")
+        return send_prebuilt(build_viewer_assets()['login_error'], PAGE_CACHE_CONTROL)
     if session.get('authenticated'):
         return redirect(url_for('interface'))
-    return render_template_string(LOGIN_HTML)
+    return send_prebuilt(build_viewer_assets()['login'], PAGE_CACHE_CONTROL)
 
 @app.route('/interface')
 def interface():
     if not session.get('authenticated'):
         return redirect(url_for('index'))
-    return render_template_string(INTERFACE_HTML)
+    return send_prebuilt(build_viewer_assets()['interface'], PAGE_CACHE_CONTROL)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    entry = static_assets.get(filename)
+    if not entry:
+        return "Not Found", 404
+    return send_prebuilt(entry, ASSET_CACHE_CONTROL)
 
 @app.route('/logout')
 def logout():
     session.pop('authenticated', None)
     return redirect(url_for('index'))
 
+# --- Session Resume ---
+# The PC registers with the resume token it got last time. Within RESUME_GRACE of a drop the server
+# keeps its session (monitor list, viewer watches, recording) and viewers are never told it left.
+# The resumed PC gets the sequence number of the last frame relayed per monitor, so its capture
+# threads keep sending deltas and only resend a keyframe where a frame was lost in the drop.
+last_frame_seq = {}  # Monitor -> sequence number of the last frame relayed from the PC
+pending_teardown = None  # Timer that ends a dropped PC session once RESUME_GRACE passes
+client_resume_token = None  # Held in memory like the session it resumes, so a restarted server starts a new session
+
+def note_frame_relayed(meta):
+    if meta.get('seq') is not None:
+        last_frame_seq[meta.get('monitor')] = meta['seq']
+
+def cancel_pending_teardown():
+    global pending_teardown
+    if pending_teardown is not None:
+        pending_teardown.cancel()
+        pending_teardown = None
+
+def end_client_session():
+    global pending_teardown, client_resume_token
+    pending_teardown = None
+    client_resume_token = None
+    logger.warning("Remote PC did not resume in time, ending its session.")
+    safe_redis_delete(MONITORS_KEY)
+    last_frame_seq.clear()
+    socketio.emit('client_disconnected')
+    stop_session_recording()
+
 # --- SocketIO Events ---
 @socketio.on('connect')
 def handle_connect():
@@ -480,17 +231,23 @@ def handle_disconnect():
 
 @socketio.on('disconnect', namespace='/')
 def handle_client_disconnect():
+    global pending_teardown
+    leave_fallback_lane(request.sid)
+    clear_viewer_rois(request.sid)
     client_pc_sid = safe_redis_get(CLIENT_REDIS_KEY)
     if request.sid == client_pc_sid:
-        logger.warning(f"Remote PC (SID: {client_pc_sid}) disconnected. Clearing Redis key.")
+        logger.warning(f"Remote PC (SID: {client_pc_sid}) disconnected. Holding its session {RESUME_GRACE}s for a resume.")
         safe_redis_delete(CLIENT_REDIS_KEY)
-        emit('client_disconnected', broadcast=True, include_self=False)
+        cancel_pending_teardown()
+        pending_teardown = eventlet.spawn_after(RESUME_GRACE, end_client_session)
 
 @socketio.on('register_client')
 def handle_register_client(data):
+    global client_resume_token
     client_token = data.get('token')
     sid = request.sid
     if client_token == ACCESS_PASSWORD:
+        resumed = bool(data.get('resume_token')) and data.get('resume_token') == client_resume_token
         old_sid = safe_redis_get(CLIENT_REDIS_KEY)
         if old_sid and old_sid != sid:
             logger.warning(f"New client auth, disconnecting old client (SID: {old_sid})")
@@ -500,9 +257,21 @@ def handle_register_client(data):
                 pass
         
         if safe_redis_set(CLIENT_REDIS_KEY, sid):
+            cancel_pending_teardown()
+            if resumed:
+                logger.info(f"Remote PC resumed its session (SID: {sid}).")
+                emit('registration_success', {'resume_token': client_resume_token, 'resumed': True,
+                                              'last_seq': {str(monitor_index): seq for monitor_index, seq in last_frame_seq.items()}}, room=sid)
+                # Viewers may have come, gone or switched monitors while the PC was away
+                update_watched_monitors()
+                forward_to_client('viewer_presence', {'watching': bool(viewer_monitor_watches)})
+                return
+            client_resume_token = secrets.token_urlsafe(16)
+            last_frame_seq.clear()
             logger.info(f"Remote PC registered (SID: {sid}). State saved to Redis.")
+            start_session_recording()
             emit('client_connected', broadcast=True, include_self=False)
-            emit('registration_success', room=sid)
+            emit('registration_success', {'resume_token': client_resume_token, 'resumed': False}, room=sid)
         else:
             logger.error(f"Failed to save client SID to Redis for {sid}")
             emit('registration_fail', {'message': 'Server error.'}, room=sid)
@@ -517,6 +286,9 @@ def check_client_status():
     try:
         if safe_redis_exists(CLIENT_REDIS_KEY):
             emit('client_connected')
+            monitors = safe_redis_get(MONITORS_KEY)
+            if monitors:
+                emit('monitor_list', json.loads(monitors))
     except Exception as e:
         logger.error(f"Error checking client status: {e}")
 
@@ -524,11 +296,615 @@ def check_client_status():
 def handle_ping():
     pass
 
+# Socket.IO handles each event in its own greenthread. Frames take this lock before anything else so
+# they are relayed in the order the PC sent them, which keeps the slices of a picture together.
+frame_relay_lock = eventlet.semaphore.Semaphore()
+
 @socketio.on('screen_data_bytes')
-def handle_screen_data_bytes(data):
-    current_client_sid = safe_redis_get(CLIENT_REDIS_KEY)
-    if current_client_sid == request.sid:
-        emit('screen_frame_bytes', data, broadcast=True, include_self=False)
+def handle_screen_data_bytes(data, meta=None):
+    with frame_relay_lock:
+        if safe_redis_get(CLIENT_REDIS_KEY) == request.sid:
+            broadcast_frame(data, meta)
+
+def broadcast_frame(data, meta=None, frame_sockets=True):
+    # Frames that follow applied input carry their input IDs for latency measurement;
+    # frames tagged with a monitor only go to viewers watching that monitor
+    if frame_sockets and frame_socket_viewers:
+        relay_to_frame_sockets(meta or {}, pack_frame(data, meta))
+    if frame_sockets and meta:
+        note_frame_relayed(meta)
+    if frame_sockets and session_recorder:
+        session_recorder.record_frame(meta or {}, data)
+    if meta and meta.get('layer') is not None:
+        send_layered_frame(data, meta)
+        return
+    room = monitor_room(meta['monitor']) if meta and meta.get('monitor') is not None else VIEWERS_ROOM
+    socketio.emit('screen_frame_bytes', (data, meta) if meta else data, to=room, namespace=BULK_NAMESPACE)
+    if fallback_viewers:
+        socketio.emit('screen_frame_bytes', (data, meta) if meta else data, to=room)
+
+# --- Priority Lanes ---
+# Bulk data (screen frames, clipboard payloads, legacy file chunks) travels on a second
+# Socket.IO connection in the /bulk namespace, so it never queues ahead of input and
+# control events on the default connection. The PC acknowledges-before-sending on this
+# lane, which keeps at most a couple of frames queued on its uplink at any time.
+# A viewer whose /bulk connection cannot be established asks for the fallback lane: it then
+# joins the same rooms on the default connection and gets frames and clipboard there.
+fallback_viewers = set()  # Default-namespace SIDs of viewers without a working bulk lane
+
+def viewer_namespace(sid):
+    return '/' if sid in fallback_viewers else BULK_NAMESPACE
+
+def send_clipboard_to_viewers(data):
+    socketio.emit('update_browser_clipboard', data, to=VIEWERS_ROOM, namespace=BULK_NAMESPACE)
+    if fallback_viewers:
+        socketio.emit('update_browser_clipboard', data, to=VIEWERS_ROOM)
+
+def leave_fallback_lane(sid):
+    if sid not in fallback_viewers:
+        return
+    fallback_viewers.discard(sid)
+    viewer_layers.pop(sid, None)
+    for monitor_index in viewer_monitor_watches.get(sid, set()):
+        leave_room(monitor_room(monitor_index), sid=sid, namespace='/')
+    leave_room(VIEWERS_ROOM, sid=sid, namespace='/')
+    remove_viewer(sid)
+
+@socketio.on('use_fallback_lane')
+def handle_use_fallback_lane(data):
+    if not session.get('authenticated'):
+        return
+    if data.get('enabled'):
+        logger.info(f"Viewer {request.sid} has no bulk lane, sending its frames on the default connection.")
+        fallback_viewers.add(request.sid)
+        join_room(VIEWERS_ROOM)
+    else:
+        leave_fallback_lane(request.sid)
+
+@socketio.on('connect', namespace=BULK_NAMESPACE)
+def handle_bulk_connect():
+    if session.get('authenticated'):
+        join_room(VIEWERS_ROOM)
+        # The viewer follows up with watch_monitors, which requests keyframes for the monitors it shows
+
+@socketio.on('disconnect', namespace=BULK_NAMESPACE)
+def handle_bulk_disconnect():
+    viewer_layers.pop(request.sid, None)
+    remove_viewer(request.sid)
+    if safe_redis_get(CLIENT_BULK_REDIS_KEY) == request.sid:
+        logger.warning(f"Remote PC bulk lane (SID: {request.sid}) disconnected.")
+        safe_redis_delete(CLIENT_BULK_REDIS_KEY)
+
+@socketio.on('register_bulk_client', namespace=BULK_NAMESPACE)
+def handle_register_bulk_client(data):
+    if data.get('token') != ACCESS_PASSWORD:
+        logger.warning(f"Bulk lane registration failed for SID {request.sid}. Incorrect password.")
+        server_disconnect_client(request.sid, namespace=BULK_NAMESPACE)
+        return
+    if safe_redis_set(CLIENT_BULK_REDIS_KEY, request.sid):
+        logger.info(f"Remote PC bulk lane registered (SID: {request.sid}).")
+        emit('bulk_registration_success')
+
+@socketio.on('screen_data_bytes', namespace=BULK_NAMESPACE)
+def handle_bulk_screen_data_bytes(data, meta=None):
+    with frame_relay_lock:
+        if safe_redis_get(CLIENT_BULK_REDIS_KEY) == request.sid:
+            broadcast_frame(data, meta)
+    # The return value acknowledges the frame so the PC can send the next one
+    return True
+
+@socketio.on('clipboard_from_client', namespace=BULK_NAMESPACE)
+def handle_bulk_clipboard_from_client(data):
+    if safe_redis_get(CLIENT_BULK_REDIS_KEY) == request.sid:
+        record_clipboard_event('from_pc', data)
+        send_clipboard_to_viewers(data)
+
+# --- Multi-Monitor Streams ---
+# The PC captures only the monitors at least one viewer is watching and tags every frame
+# with its monitor index. Each monitor has its own room on the bulk lane, so a viewer
+# only receives the pictures it displays. When the last viewer leaves, the PC stops
+# capturing altogether until the next one arrives.
+viewer_monitor_watches = {}  # Bulk viewer SID -> set of watched monitor indices
+viewer_lane_owners = {}  # Bulk SID, fast-path key or fallback SID -> the viewer's main connection SID
+monitor_rois = {}  # Monitor -> {main connection SID: zoomed region}, least recently set first
+
+def default_monitor_index():
+    monitors = safe_redis_get(MONITORS_KEY)
+    return json.loads(monitors).get('default') if monitors else None
+
+def update_watched_monitors():
+    watched = set().union(*viewer_monitor_watches.values()) if viewer_monitor_watches else set()
+    forward_to_client('set_watched_monitors', {'monitors': sorted(watched)})
+
+def update_viewer_presence(was_watching):
+    watching = bool(viewer_monitor_watches)
+    if watching != was_watching:
+        logger.info("First viewer arrived, resuming capture." if watching else "Last viewer left, pausing capture.")
+        forward_to_client('viewer_presence', {'watching': watching})
+
+@socketio.on('monitor_list')
+def handle_monitor_list(data):
+    if safe_redis_get(CLIENT_REDIS_KEY) != request.sid:
+        return
+    safe_redis_set(MONITORS_KEY, json.dumps(data))
+    if session_recorder:
+        session_recorder.set_monitors(data)
+    logger.info(f"Remote PC reported {len(data.get('monitors', []))} monitor(s).")
+    emit('monitor_list', data, broadcast=True, include_self=False)
+    emit('viewer_presence', {'watching': bool(viewer_monitor_watches)})
+    update_watched_monitors()
+    for monitor_index in monitor_rois:
+        forward_to_client('set_roi', {'monitor': monitor_index, 'roi': current_roi(monitor_index)})
+    # A newly registered PC encodes every layer until told otherwise
+    wanted_layers.clear()
+    update_wanted_layers()
+
+def set_viewer_monitors(viewer_key, monitors, owner=None):
+    """Record which monitors a viewer shows; returns (previous, requested) sets"""
+    requested = {i for i in monitors if isinstance(i, int)}
+    if not requested and default_monitor_index() is not None:
+        requested = {default_monitor_index()}
+    was_watching = bool(viewer_monitor_watches)
+    previous = viewer_monitor_watches.get(viewer_key, set())
+    for monitor_index in requested - previous:
+        forward_to_client('request_keyframe', {'monitor': monitor_index})
+    viewer_monitor_watches[viewer_key] = requested
+    if owner:
+        viewer_lane_owners[viewer_key] = owner
+        clear_viewer_rois(owner, keep=requested)
+    update_watched_monitors()
+    update_viewer_presence(was_watching)
+    return previous, requested
+
+def remove_viewer(viewer_key):
+    owner = viewer_lane_owners.pop(viewer_key, None)
+    if owner and owner not in viewer_lane_owners.values():
+        clear_viewer_rois(owner)
+    if viewer_monitor_watches.pop(viewer_key, None) is not None:
+        update_watched_monitors()
+        update_viewer_presence(was_watching=True)
+
+# A zoomed region belongs to the viewer that set it. The PC streams the most recently set region
+# among the viewers still zoomed into a monitor, and the full screen again once none is.
+def current_roi(monitor_index):
+    rois = monitor_rois.get(monitor_index)
+    return next(reversed(rois.values())) if rois else None
+
+def set_viewer_roi(owner, monitor_index, roi):
+    before = current_roi(monitor_index)
+    rois = monitor_rois.setdefault(monitor_index, {})
+    rois.pop(owner, None)
+    if roi:
+        rois[owner] = roi
+    elif not rois:
+        monitor_rois.pop(monitor_index)
+    after = current_roi(monitor_index)
+    if after != before:
+        forward_to_client('set_roi', {'monitor': monitor_index, 'roi': after})
+
+def clear_viewer_rois(owner, keep=()):
+    for monitor_index in [m for m, rois in monitor_rois.items() if owner in rois and m not in keep]:
+        set_viewer_roi(owner, monitor_index, None)
+
+@socketio.on('watch_monitors')  # Viewers on the fallback lane
+@socketio.on('watch_monitors', namespace=BULK_NAMESPACE)
+def handle_watch_monitors(data):
+    if not session.get('authenticated'):
+        return
+    if data.get('monitors') is None:
+        # The viewer receives frames on the binary fast path instead
+        for monitor_index in viewer_monitor_watches.get(request.sid, set()):
+            leave_room(monitor_room(monitor_index))
+        remove_viewer(request.sid)
+        return
+    previous, requested = set_viewer_monitors(request.sid, data['monitors'], owner=data.get('viewer') or request.sid)
+    for monitor_index in previous - requested:
+        leave_room(monitor_room(monitor_index))
+    for monitor_index in requested - previous:
+        join_room(monitor_room(monitor_index))
+
+# --- Simulcast ---
+# The PC encodes every full JPEG frame in several layers (meta.layer, 0 = best). Each viewer
+# receives one layer, chosen from how fast it acknowledges delivered frames: a viewer with too
+# many frames in flight is skipped and moved down a layer, and tries the better layer again once
+# it keeps up with its own. Every layered JPEG frame is a keyframe, so switching is seamless. The
+# PC is told which layers viewers are on or moving to and encodes only those.
+viewer_layers = {}  # Bulk viewer SID -> {'layer', 'target', 'in_flight', 'open', 'acked', 'downgraded_at'}
+layer_frame_bytes = {}  # (monitor, layer) -> average frame size in bytes
+monitor_frame_timing = {}  # Monitor -> (last frame seq, its arrival, average frame interval)
+wanted_layers = {}  # Monitor -> layers the PC was last told to encode
+
+def send_layered_frame(data, meta):
+    monitor_index, layer = meta.get('monitor'), meta['layer']
+    picture = (meta.get('seq'), layer)
+    now = time.time()
+    layer_frame_bytes[(monitor_index, layer)] = ewma(layer_frame_bytes.get((monitor_index, layer)), len(data))
+    last_seq, last_arrival, interval = monitor_frame_timing.get(monitor_index, (None, None, None))
+    if meta.get('seq') != last_seq:
+        # Timed on whichever layer of a frame arrives first, as the PC only encodes wanted layers
+        monitor_frame_timing[monitor_index] = (meta.get('seq'), now, interval if last_arrival is None else ewma(interval, now - last_arrival))
+    for sid, monitors in list(viewer_monitor_watches.items()):
+        if sid in frame_socket_viewers or (monitor_index is not None and monitor_index not in monitors):
+            continue
+        state = viewer_layers.setdefault(sid, {'layer': 0, 'target': 0, 'in_flight': 0, 'open': {}, 'acked': collections.deque(), 'downgraded_at': 0})
+        if not starts_picture(meta):
+            # The rest of an admitted picture always follows its first slice, so it is never torn
+            if state['open'].get(monitor_index) != picture:
+                continue
+        else:
+            if state['open'].pop(monitor_index, None):
+                # The PC abandoned the last picture mid-way, so its final ack will never come
+                state['in_flight'] = max(0, state['in_flight'] - 1)
+            if state['layer'] != layer:
+                # Switch only on a keyframe of the layer the viewer should move to
+                if state['target'] != layer or not is_keyframe(meta):
+                    continue
+                state['layer'] = layer
+            if state['in_flight'] >= SIMULCAST_MAX_IN_FLIGHT:
+                state['target'] = min(layer + 1, meta.get('layers', 1) - 1)
+                state['downgraded_at'] = now
+                continue
+            # Counted once per picture and released by the ack of its last message
+            state['in_flight'] += 1
+            state['open'][monitor_index] = picture
+        last = ends_picture(meta)
+        if last:
+            del state['open'][monitor_index]
+        socketio.emit('screen_frame_bytes', (data, meta), to=sid, namespace=viewer_namespace(sid),
+                      callback=lambda *args, sid=sid, size=len(data), last=last: handle_viewer_frame_ack(sid, monitor_index, size, last))
+    update_wanted_layers()
+
+def handle_viewer_frame_ack(sid, monitor_index, size, last=True):
+    state = viewer_layers.get(sid)
+    if state is None:
+        return
+    now = time.time()
+    if last:
+        state['in_flight'] = max(0, state['in_flight'] - 1)
+    acked = state['acked']
+    acked.append((now, size))
+    while acked[0][0] < now - SIMULCAST_RATE_WINDOW:
+        acked.popleft()
+    better = state['target'] - 1
+    interval = monitor_frame_timing.get(monitor_index, (None, None, None))[2]
+    layer_bytes = layer_frame_bytes.get((monitor_index, state['layer']))
+    if better < 0 or state['in_flight'] or not interval or not layer_bytes or now - state['downgraded_at'] < SIMULCAST_UPGRADE_DELAY:
+        return
+    # Bytes acknowledged over the window, not one frame's round trip, which is mostly latency.
+    # A viewer taking its whole layer with nothing left in flight tries the better one; if it
+    # cannot keep up there, frames back up and it is moved down again.
+    if sum(size for _, size in acked) / SIMULCAST_RATE_WINDOW >= layer_bytes / interval * SIMULCAST_KEEPUP_RATIO:
+        state['target'] = better
+
+def layers_wanted(monitor_index):
+    """Layers some viewer of a monitor is on or moving to (layer 0 for the recording)"""
+    layers = {0} if session_recorder else set()
+    for key, monitors in viewer_monitor_watches.items():
+        if monitor_index in monitors:
+            state = frame_socket_viewers.get(key) or viewer_layers.get(key)
+            layers.update((state['layer'], state['target']) if state else (0,))
+    return sorted(layers)
+
+def update_wanted_layers():
+    """Tell the PC which layers to encode, so no CPU goes into layers no viewer receives"""
+    for monitor_index in set().union(*viewer_monitor_watches.values()) if viewer_monitor_watches else ():
+        layers = layers_wanted(monitor_index)
+        if layers and layers != wanted_layers.get(monitor_index):
+            wanted_layers[monitor_index] = layers
+            forward_to_client('set_wanted_layers', {'monitor': monitor_index, 'layers': layers})
+
+# --- Session Recording ---
+# Each remote PC session is recorded to SESSION_RECORDING_DIR in the format described in
+# server_common.py. The relay path only queues records; a writer greenthread hands batches
+# to a tpool thread.
+session_recorder = None
+
+class SessionRecorder:
+    """Buffered, append-only recording of one remote PC session"""
+    def __init__(self):
+        self.id = new_recording_id()
+        self.started_at = time.time()
+        self.header = {'id': self.id, 'started_at': self.started_at, 'ended_at': None, 'monitors': None}
+        self.queue = eventlet.queue.LightQueue(maxsize=SESSION_RECORDING_QUEUE)
+        self.dropped = 0
+        self.last_keyframe = {}  # Monitor -> seconds of its last keyframe (or keyframe request)
+        self.last_indexed = {}  # Monitor -> seconds of its last index entry
+        os.makedirs(SESSION_RECORDING_DIR, exist_ok=True)
+        self.data_file = open(recording_path(self.id, 'rec'), 'ab')
+        self.index_file = open(recording_path(self.id, 'idx'), 'ab')
+        write_recording_header(self.header)
+        self.writer = eventlet.spawn(self.write_loop)
+
+    def record(self, kind, meta, payload=b''):
+        try:
+            self.queue.put_nowait((kind, time.time() - self.started_at, meta, payload))
+        except eventlet.queue.Full:
+            self.dropped += 1
+            log_sampled('recording_dropped', logging.WARNING, "Session recording %s is behind, dropping records", self.id)
+
+    def record_frame(self, meta, payload):
+        if meta.get('layer'):
+            return
+        now = time.time() - self.started_at
+        monitor_index = meta.get('monitor')
+        if is_keyframe(meta):
+            self.last_keyframe[monitor_index] = now
+        elif meta.get('codec') and now - self.last_keyframe.setdefault(monitor_index, now) > SESSION_KEYFRAME_INTERVAL:
+            # Long runs of video deltas would make seeking replay many frames; ask for a fresh keyframe
+            self.last_keyframe[monitor_index] = now
+            forward_to_client('request_keyframe', {'monitor': monitor_index})
+        self.record(RECORD_FRAME, meta, payload)
+
+    def write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            closing = batch[-1] is None
+            eventlet.tpool.execute(write_recording_batch, self.data_file, self.index_file, self.last_indexed, batch[:-1] if closing else batch)
+            if closing:
+                return
+
+    def set_monitors(self, monitors):
+        self.header['monitors'] = monitors
+        eventlet.tpool.execute(write_recording_header, self.header)
+
+    def stop(self):
+        self.queue.put(None)
+        self.writer.wait()
+        self.data_file.close()
+        self.index_file.close()
+        self.header['ended_at'] = time.time()
+        eventlet.tpool.execute(write_recording_header, self.header)
+        logger.info(f"⏹️ Session recording {self.id} finished ({self.dropped} records dropped)")
+
+def start_session_recording():
+    global session_recorder
+    if not SESSION_RECORDING_DIR:
+        return
+    stop_session_recording()
+    session_recorder = SessionRecorder()
+    monitors = safe_redis_get(MONITORS_KEY)
+    if monitors:
+        session_recorder.set_monitors(json.loads(monitors))
+    logger.info(f"⏺️ Recording session {session_recorder.id} to {SESSION_RECORDING_DIR}")
+
+def stop_session_recording():
+    global session_recorder
+    recorder, session_recorder = session_recorder, None
+    if recorder:
+        recorder.stop()
+
+def record_session_event(kind, meta, payload=b''):
+    if session_recorder:
+        session_recorder.record(kind, meta, payload)
+
+def record_clipboard_event(direction, data):
+    """Clipboard text stays in the meta; chunked binary clipboard data is stored as the payload"""
+    if session_recorder and isinstance(data, dict):
+        session_recorder.record(RECORD_CLIPBOARD, *clipboard_record(direction, data))
+
+def stream_recording(ws, recording_id, index, position, speed):
+    """Send records from position on at the recorded pace; frames before position (back to the keyframe) go at once"""
+    started = time.time()
+    reported = None
+    with open(recording_path(recording_id, 'rec'), 'rb') as f:
+        f.seek(seek_offset(index, position))
+        while True:
+            record = eventlet.tpool.execute(read_record, f)
+            if record is None:
+                break
+            kind, timestamp, body = record
+            if timestamp < position:
+                if kind != RECORD_FRAME:
+                    continue
+            else:
+                delay = (timestamp - position) / speed - (time.time() - started)
+                if delay > 0:
+                    eventlet.sleep(delay)
+                if reported is None or timestamp - reported >= 1:
+                    reported = timestamp
+                    ws.send(json.dumps({'type': 'position', 't': timestamp}))
+            if kind == RECORD_FRAME:
+                ws.send(body)
+            else:
+                ws.send(playback_event(kind, timestamp, body))
+    ws.send(json.dumps({'type': 'end'}))
+
+def frame_socket_playback(ws):
+    params = parse_playback_params({key: values[0] for key, values in parse_qs(ws.environ.get('QUERY_STRING', '')).items()})
+    if not params:
+        ws.send(json.dumps({'type': 'error', 'message': 'Recording not found.'}))
+        return
+    recording_id, position, speed = params
+    index = read_recording_index(recording_id)
+    ws.send(playback_info(recording_id, read_recording_header(recording_id), index))
+    streamer = eventlet.spawn(stream_recording, ws, recording_id, index, position, speed)
+    try:
+        while True:
+            message = ws.wait()
+            if message is None:
+                break
+            if not isinstance(message, str):
+                continue
+            seek = parse_seek_command(message)
+            if seek is None:
+                continue
+            streamer.kill()
+            # A live session keeps growing, so re-read its index before seeking
+            index = read_recording_index(recording_id)
+            streamer = eventlet.spawn(stream_recording, ws, recording_id, index, seek, speed)
+    finally:
+        streamer.kill()
+
+@app.route('/recordings')
+def recordings():
+    if not session.get('authenticated'):
+        return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    return jsonify({'recordings': list_recordings(lambda recording_id: url_for('interface', playback=recording_id))})
+
+# --- Binary Frame Fast Path ---
+# Optional plain WebSocket endpoints that carry screen frames only, framed as
+# [4-byte big-endian header length][JSON meta][payload]. Frames from the PC are relayed to
+# fast-path viewers as the exact bytes received; only the small header is parsed for routing.
+# Login and the PC token still gate access, and Socket.IO keeps carrying control and input.
+frame_socket_viewers = {}  # Viewer key -> {'ws', 'queue', 'pictures', 'open', 'layer', 'target', 'downgraded_at', 'awaiting_key'}
+frame_socket_ids = itertools.count(1)
+
+def has_socketio_viewers():
+    return any(key not in frame_socket_viewers for key in viewer_monitor_watches)
+
+def relay_to_frame_sockets(meta, message):
+    monitor_index, layer = meta.get('monitor'), meta.get('layer')
+    picture = (meta.get('seq'), layer)
+    for key, viewer in list(frame_socket_viewers.items()):
+        if monitor_index is not None and monitor_index not in viewer_monitor_watches.get(key, ()):
+            continue
+        if not starts_picture(meta):
+            # The rest of an admitted picture always follows its first slice, so it is never torn
+            if viewer['open'].get(monitor_index) == picture:
+                viewer['queue'].put_nowait((meta, message))
+                if ends_picture(meta):
+                    del viewer['open'][monitor_index]
+            continue
+        # Anything still open was abandoned by the PC mid-picture
+        viewer['open'].pop(monitor_index, None)
+        if layer is not None and viewer['layer'] != layer:
+            # Same layer rules as the Socket.IO path: switch only on a keyframe of the target layer
+            if viewer['target'] != layer or not is_keyframe(meta):
+                continue
+            viewer['layer'] = layer
+        if meta.get('codec') and viewer['awaiting_key']:
+            if not meta.get('key'):
+                continue
+            viewer['awaiting_key'] = False
+        if viewer['pictures'] >= FRAME_SOCKET_QUEUE_FRAMES:
+            if layer is not None:
+                viewer['target'] = min(layer + 1, meta.get('layers', 1) - 1)
+                viewer['downgraded_at'] = time.time()
+            elif meta.get('codec'):
+                # A skipped video packet breaks the decode chain until the next keyframe
+                viewer['awaiting_key'] = True
+                forward_to_client('request_keyframe', {'monitor': monitor_index})
+            continue
+        viewer['pictures'] += 1
+        viewer['queue'].put_nowait((meta, message))
+        if not ends_picture(meta):
+            viewer['open'][monitor_index] = picture
+        if layer and viewer['pictures'] <= 1 and time.time() - viewer['downgraded_at'] > SIMULCAST_UPGRADE_DELAY:
+            viewer['target'] = layer - 1
+    if layer is not None:
+        update_wanted_layers()
+
+def frame_socket_sender(viewer):
+    while True:
+        meta, message = viewer['queue'].get()
+        if starts_picture(meta):
+            viewer['pictures'] -= 1
+        viewer['ws'].send(message)
+
+def frame_socket_pc(ws):
+    logger.info("Remote PC connected to the binary frame fast path.")
+    while True:
+        message = ws.wait()
+        if message is None:
+            break
+        if isinstance(message, str) or len(message) < 4:
+            continue
+        meta, payload_offset = unpack_frame_header(message)
+        relay_to_frame_sockets(meta, message)
+        note_frame_relayed(meta)
+        if session_recorder:
+            session_recorder.record_frame(meta, memoryview(message)[payload_offset:])
+        if has_socketio_viewers():
+            broadcast_frame(message[payload_offset:], meta, frame_sockets=False)
+    logger.warning("Remote PC left the binary frame fast path.")
+
+def frame_socket_view(ws):
+    viewer_key = f"ws:{next(frame_socket_ids)}"
+    viewer = {'ws': ws, 'queue': eventlet.queue.Queue(), 'pictures': 0, 'open': {}, 'layer': 0, 'target': 0, 'downgraded_at': 0, 'awaiting_key': True}
+    frame_socket_viewers[viewer_key] = viewer
+    sender = eventlet.spawn(frame_socket_sender, viewer)
+    try:
+        while True:
+            message = ws.wait()
+            if message is None:
+                break
+            if isinstance(message, str):
+                watch = parse_watch_message(message)
+                if watch is None:
+                    continue
+                monitors, owner = watch
+                set_viewer_monitors(viewer_key, monitors, owner=owner)
+    finally:
+        sender.kill()
+        frame_socket_viewers.pop(viewer_key, None)
+        remove_viewer(viewer_key)
+
+class FrameSocketMiddleware:
+    """Serves the fast-path WebSocket endpoints in front of the Flask and Socket.IO app"""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.pc_socket = eventlet.websocket.WebSocketWSGI(frame_socket_pc)
+        self.view_socket = eventlet.websocket.WebSocketWSGI(frame_socket_view)
+        self.playback_socket = eventlet.websocket.WebSocketWSGI(frame_socket_playback)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        if path == FRAME_SOCKET_PC_PATH:
+            if environ.get('HTTP_X_ACCESS_TOKEN') != ACCESS_PASSWORD:
+                start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+                return [b'Forbidden']
+            return self.pc_socket(environ, start_response)
+        if path in (FRAME_SOCKET_VIEW_PATH, FRAME_SOCKET_PLAYBACK_PATH):
+            with app.request_context(environ):
+                authenticated = session.get('authenticated')
+            if not authenticated:
+                start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+                return [b'Forbidden']
+            return (self.view_socket if path == FRAME_SOCKET_VIEW_PATH else self.playback_socket)(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = FrameSocketMiddleware(app.wsgi_app)
+
+# --- Metrics ---
+input_latency_counts = [0] * (len(INPUT_LATENCY_BUCKETS_MS) + 1)
+
+def observe_input_latency(latency_ms):
+    input_latency_counts[bisect.bisect_left(INPUT_LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+@socketio.on('input_latency_report')
+def handle_input_latency_report(data):
+    if not session.get('authenticated'):
+        return
+    for latency_ms in data.get('samples', [])[:200]:
+        if isinstance(latency_ms, (int, float)) and latency_ms >= 0:
+            observe_input_latency(latency_ms)
+
+latest_capture_stats = {}  # Last capture pipeline timing report from the PC
+
+@socketio.on('capture_stats')
+def handle_capture_stats(data):
+    if safe_redis_get(CLIENT_REDIS_KEY) != request.sid:
+        return
+    latest_capture_stats.clear()
+    latest_capture_stats.update(data, received_at=time.time())
+    emit('capture_stats', data, broadcast=True, include_self=False)
+
+@app.route('/metrics')
+def metrics():
+    if not session.get('authenticated'):
+        return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    return jsonify({
+        'input_latency_ms': {
+            'buckets': INPUT_LATENCY_BUCKETS_MS + ['+Inf'],
+            'counts': input_latency_counts,
+            'total': sum(input_latency_counts)
+        },
+        'capture_pipeline': latest_capture_stats,
+        'log_records_dropped': DroppingQueueHandler.dropped,
+        'session_recording': {'id': session_recorder.id, 'records_dropped': session_recorder.dropped} if session_recorder else None
+    })
 
 # --- AI-Related Events ---
 @socketio.on('toggle_ai_mode')
@@ -616,23 +992,69 @@ def process_ai_screenshot(screenshot_base64):
         except Exception as emit_error:
             logger.error(f"Error emitting error message: {emit_error}")
 
-def forward_to_client(event, data):
-    client_pc_sid = safe_redis_get(CLIENT_REDIS_KEY)
+def forward_to_client(event, data, bulk=False):
+    namespace = '/'
+    client_pc_sid = None
+    if bulk:
+        client_pc_sid = safe_redis_get(CLIENT_BULK_REDIS_KEY)
+        namespace = BULK_NAMESPACE if client_pc_sid else '/'
+    client_pc_sid = client_pc_sid or safe_redis_get(CLIENT_REDIS_KEY)
     if client_pc_sid:
         try:
-            socketio.emit(event, data, room=client_pc_sid)
+            socketio.emit(event, data, room=client_pc_sid, namespace=namespace)
             return True
         except Exception as e:
-            logger.error(f"Error forwarding {event} to client {client_pc_sid}: {e}")
+            log_sampled(('forward', event), logging.ERROR, "Error forwarding %s to client %s: %s", event, client_pc_sid, e)
             return False
     return False
 
+# --- Input Coalescing ---
+# Control commands are held for one short tick so that a burst is delivered to the
+# PC as a single ordered batch, with runs of mouse moves collapsed to the last one.
+pending_input = {'commands': [], 'input_ids': [], 'origins': set(), 'scheduled': False}
+
+def flush_pending_input():
+    socketio.sleep(INPUT_COALESCE_INTERVAL)
+    commands, input_ids, origins = pending_input['commands'], pending_input['input_ids'], pending_input['origins']
+    pending_input.update(commands=[], input_ids=[], origins=set(), scheduled=False)
+    batch = coalesce_moves(commands)
+    record_session_event(RECORD_INPUT, {'batch': batch, 'input_ids': input_ids})
+    if not forward_to_client('command', {'batch': batch, 'input_ids': input_ids}):
+        for sid in origins:
+            socketio.emit('command_error', {'message': 'Remote PC not connected.'}, room=sid)
+
 @socketio.on('control_command')
 def handle_control_command(data):
     if not session.get('authenticated'): 
         return
-    if not forward_to_client('command', data):
-        emit('command_error', {'message': 'Remote PC not connected.'})
+    batch = data.get('batch')
+    commands = batch if isinstance(batch, list) else [data]
+    pending_input['commands'].extend(c for c in commands if isinstance(c, dict))
+    pending_input['origins'].add(request.sid)
+    if data.get('input_id'):
+        pending_input['input_ids'].append(str(data['input_id']))
+    if not pending_input['scheduled']:
+        pending_input['scheduled'] = True
+        socketio.start_background_task(flush_pending_input)
+
+@socketio.on('request_keyframe')
+def handle_request_keyframe(data=None):
+    if not session.get('authenticated'):
+        return
+    forward_to_client('request_keyframe', {'monitor': (data or {}).get('monitor')})
+
+@socketio.on('set_roi')
+def handle_set_roi(data):
+    if not session.get('authenticated'):
+        return
+    set_viewer_roi(request.sid, data.get('monitor'), data.get('roi'))
+
+@socketio.on('video_unsupported')
+def handle_video_unsupported(data):
+    if not session.get('authenticated'):
+        return
+    log_sampled('video_unsupported', logging.WARNING, "Viewer cannot decode %s, switching remote PC back to JPEG", data.get('codec'))
+    forward_to_client('receive_settings_update', {'codec': 'jpeg'})
 
 @socketio.on('set_injection_text')
 def handle_set_injection_text(data):
@@ -647,26 +1069,29 @@ def handle_set_injection_text(data):
 def handle_update_settings(data):
     if not session.get('authenticated'): 
         return
-    logger.info(f"Forwarding settings update to client: {data}")
+    log_sampled('settings', logging.INFO, "Forwarding settings update to client: %s", data)
     forward_to_client('receive_settings_update', data)
 
 @socketio.on('clipboard_from_browser')
+@socketio.on('clipboard_from_browser', namespace=BULK_NAMESPACE)  # Chunked images and long text
 def handle_clipboard_from_browser(data):
-    if not session.get('authenticated'): 
+    if not session.get('authenticated') or not isinstance(data, dict):
         return
-    forward_to_client('set_clipboard', data)
+    record_clipboard_event('to_pc', data)
+    forward_to_client('set_clipboard', data, bulk=True)
 
 @socketio.on('clipboard_from_client')
 def handle_clipboard_from_client(data):
     current_client_sid = safe_redis_get(CLIENT_REDIS_KEY)
     if current_client_sid == request.sid:
-        emit('update_browser_clipboard', data, broadcast=True, include_self=False)
+        record_clipboard_event('from_pc', data)
+        send_clipboard_to_viewers(data)
 
 @socketio.on('file_chunk')
 def handle_file_chunk(data, callback):
     if not session.get('authenticated'): 
         return
-    if forward_to_client('receive_file_chunk', data):
+    if forward_to_client('receive_file_chunk', data, bulk=True):
         if callback: 
             callback({'status': 'ok'})
     else:
@@ -677,13 +1102,169 @@ def handle_file_chunk(data, callback):
 def handle_file_upload_complete(data):
     if not session.get('authenticated'): 
         return
-    forward_to_client('file_transfer_complete', data)
+    forward_to_client('file_transfer_complete', data, bulk=True)
+
+@socketio.on('http_transfer_failed')
+def handle_http_transfer_failed(data):
+    current_client_sid = safe_redis_get(CLIENT_REDIS_KEY)
+    if current_client_sid != request.sid:
+        return
+    entry = http_transfers.get(data.get('id'))
+    if entry:
+        logger.warning(f"Remote PC could not serve transfer {data.get('id')}: {data.get('message')}")
+        try:
+            entry['queue'].put(IOError(data.get('message', 'Transfer failed')), timeout=1)
+        except eventlet.queue.Full:
+            pass
+
+# --- Streaming HTTP File Transfer ---
+# Bulk file data is piped between browser and PC over plain HTTP requests so it
+# never shares the Socket.IO connection with interactive traffic. Each transfer
+# relays fixed-size chunks through a bounded queue, so server memory per transfer
+# stays at HTTP_TRANSFER_CHUNK_SIZE * HTTP_TRANSFER_QUEUE_CHUNKS regardless of file size.
+http_transfers = {}
+
+def create_http_transfer(name):
+    transfer_id = secrets.token_urlsafe(16)
+    http_transfers[transfer_id] = {
+        'name': name,
+        'size': None,
+        'queue': eventlet.queue.Queue(maxsize=HTTP_TRANSFER_QUEUE_CHUNKS),
+        'finished': threading.Event()
+    }
+    return transfer_id
+
+def check_pc_token():
+    return request.headers.get('X-Access-Token') == ACCESS_PASSWORD
+
+def iter_request_body():
+    """Read the raw request body in fixed-size chunks, bypassing Flask's buffering and MAX_CONTENT_LENGTH"""
+    stream = request.environ['wsgi.input']
+    remaining = request.content_length
+    while remaining is None or remaining > 0:
+        size = HTTP_TRANSFER_CHUNK_SIZE if remaining is None else min(HTTP_TRANSFER_CHUNK_SIZE, remaining)
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+def relay_request_body(entry):
+    """Push the request body into a transfer queue, blocking while the reader is behind"""
+    relayed = 0
+    for chunk in iter_request_body():
+        entry['queue'].put(chunk, timeout=HTTP_TRANSFER_TIMEOUT)
+        relayed += len(chunk)
+    entry['queue'].put(None, timeout=HTTP_TRANSFER_TIMEOUT)
+    entry['finished'].wait(HTTP_TRANSFER_TIMEOUT)
+    return relayed
+
+def iter_transfer_queue(entry, first_chunk=None):
+    """Drain a transfer queue until the end-of-stream marker (None) or an error marker"""
+    try:
+        chunk = first_chunk if first_chunk is not None else entry['queue'].get(timeout=HTTP_TRANSFER_TIMEOUT)
+        while chunk is not None and not isinstance(chunk, Exception):
+            yield chunk
+            chunk = entry['queue'].get(timeout=HTTP_TRANSFER_TIMEOUT)
+    except eventlet.queue.Empty:
+        logger.warning(f"Transfer of {entry['name']} stalled, closing stream")
+    finally:
+        entry['finished'].set()
+
+def attachment_headers(entry):
+    headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(entry['name'])}"}
+    if entry['size'] is not None:
+        headers['Content-Length'] = str(entry['size'])
+    return headers
+
+@app.route('/transfer/upload', methods=['PUT'])
+def transfer_upload():
+    """Browser -> PC: stream the request body to the PC as it pulls it"""
+    if not session.get('authenticated'):
+        return jsonify({'status': 'error', 'message': 'Not authenticated'}), 401
+    name = os.path.basename(request.args.get('name', '').replace('\\', '/'))
+    if not name:
+        return jsonify({'status': 'error', 'message': 'Missing file name'}), 400
+    transfer_id = create_http_transfer(name)
+    entry = http_transfers[transfer_id]
+    entry['size'] = request.content_length
+    try:
+        if not forward_to_client('http_transfer_offer', {'id': transfer_id, 'name': name, 'size': entry['size']}):
+            return jsonify({'status': 'error', 'message': 'Remote PC not connected.'}), 503
+        relayed = relay_request_body(entry)
+        logger.info(f"Streamed upload {name} to remote PC ({relayed} bytes)")
+        return jsonify({'status': 'ok', 'size': relayed})
+    except eventlet.queue.Full:
+        logger.warning(f"Upload of {name} timed out waiting for the remote PC")
+        return jsonify({'status': 'error', 'message': 'Remote PC stopped receiving.'}), 504
+    finally:
+        http_transfers.pop(transfer_id, None)
+
+@app.route('/transfer/pull/<transfer_id>')
+def transfer_pull(transfer_id):
+    """PC side of an upload: receives the bytes the browser is sending"""
+    if not check_pc_token():
+        return "Unauthorized", 401
+    entry = http_transfers.get(transfer_id)
+    if not entry:
+        return "Unknown transfer", 404
+    return Response(iter_transfer_queue(entry), mimetype='application/octet-stream', headers=attachment_headers(entry))
+
+@app.route('/transfer/download')
+def transfer_download():
+    """PC -> Browser: ask the PC to push a file and stream it back as it arrives"""
+    if not session.get('authenticated'):
+        return redirect(url_for('index'))
+    path = request.args.get('path', '')
+    name = os.path.basename(path.replace('\\', '/'))
+    if not name:
+        return "Missing file path", 400
+    transfer_id = create_http_transfer(name)
+    entry = http_transfers[transfer_id]
+    if not forward_to_client('http_transfer_request', {'id': transfer_id, 'path': path}):
+        http_transfers.pop(transfer_id, None)
+        return "Remote PC not connected.", 503
+    try:
+        first_chunk = entry['queue'].get(timeout=HTTP_TRANSFER_TIMEOUT)
+    except eventlet.queue.Empty:
+        http_transfers.pop(transfer_id, None)
+        return "Remote PC did not respond.", 504
+    if isinstance(first_chunk, Exception):
+        http_transfers.pop(transfer_id, None)
+        return f"Remote PC could not read file: {first_chunk}", 404
+    if first_chunk is None:
+        entry['finished'].set()
+        return Response(b'', mimetype='application/octet-stream', headers=attachment_headers(entry))
+    # The push request drops the entry once the streamed body below has drained it
+    return Response(iter_transfer_queue(entry, first_chunk), mimetype='application/octet-stream', headers=attachment_headers(entry))
+
+@app.route('/transfer/push/<transfer_id>', methods=['POST'])
+def transfer_push(transfer_id):
+    """PC side of a download: sends the bytes the browser is waiting for"""
+    if not check_pc_token():
+        return "Unauthorized", 401
+    entry = http_transfers.get(transfer_id)
+    if not entry:
+        return "Unknown transfer", 404
+    entry['size'] = request.content_length
+    try:
+        relayed = relay_request_body(entry)
+        logger.info(f"Streamed download {entry['name']} to browser ({relayed} bytes)")
+        return jsonify({'status': 'ok', 'size': relayed})
+    except eventlet.queue.Full:
+        logger.warning(f"Download of {entry['name']} timed out waiting for the browser")
+        return jsonify({'status': 'error', 'message': 'Browser stopped receiving.'}), 504
+    finally:
+        http_transfers.pop(transfer_id, None)
 
 @app.errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {e}")
     return "Internal Server Error", 500
 
+build_viewer_assets()
+
 if __name__ == '__main__':
     logger.info("--- 🤖 AI-Enhanced Remote Server Starting ---")
     port = int(os.environ.get('PORT', 5000))
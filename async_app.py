@@ -0,0 +1,1236 @@
+"""asyncio server mode: the same routes, Socket.IO events and fast-path WebSockets as app.py,
+on python-socketio's AsyncServer with aiohttp and redis.asyncio instead of Flask-SocketIO on eventlet.
+No monkey patching, and AI requests run on the server's own event loop.
+
+    python async_app.py    # listens on $PORT (default 5000)
+"""
+import os
+import time
+import logging
+import json
+import itertools
+import collections
+import secrets
+import bisect
+import hmac
+import hashlib
+import inspect
+import asyncio
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+
+import jinja2
+import socketio
+import redis.asyncio as aioredis
+from aiohttp import web, WSMsgType
+
+from server_common import (
+    logger, log_sampled, DroppingQueueHandler, SECRET_KEY, REDIS_URL, ANTHROPIC_API_KEY, ACCESS_PASSWORD,
+    CLIENT_REDIS_KEY, CLIENT_BULK_REDIS_KEY, MONITORS_KEY, AI_ENABLED_KEY, AI_ANSWER_KEY,
+    analyze_screenshot_with_claude, parse_ai_answer, check_auth, build_viewer_bundle, ASSET_CACHE_CONTROL, PAGE_CACHE_CONTROL,
+    BULK_NAMESPACE, VIEWERS_ROOM, RESUME_GRACE, SIMULCAST_MAX_IN_FLIGHT, SIMULCAST_UPGRADE_DELAY, SIMULCAST_RATE_WINDOW, SIMULCAST_KEEPUP_RATIO,
+    FRAME_SOCKET_PC_PATH, FRAME_SOCKET_VIEW_PATH, FRAME_SOCKET_PLAYBACK_PATH, FRAME_SOCKET_QUEUE_FRAMES,
+    INPUT_LATENCY_BUCKETS_MS, INPUT_COALESCE_INTERVAL, HTTP_TRANSFER_CHUNK_SIZE, HTTP_TRANSFER_QUEUE_CHUNKS, HTTP_TRANSFER_TIMEOUT,
+    monitor_room, ewma, pack_frame, unpack_frame_header, starts_picture, ends_picture, coalesce_moves, clipboard_record, parse_watch_message,
+    SESSION_RECORDING_DIR, SESSION_RECORDING_QUEUE, SESSION_KEYFRAME_INTERVAL, RECORD_FRAME, RECORD_INPUT, RECORD_CLIPBOARD,
+    new_recording_id, recording_path, is_keyframe, write_recording_header, write_recording_batch, read_record,
+    read_recording_header, read_recording_index, seek_offset, playback_event, playback_info, parse_playback_params, parse_seek_command, list_recordings,
+)
+
+# --- App Setup ---
+AUTH_COOKIE = 'remote_auth'
+MAX_MESSAGE_SIZE = 20 * 1024 * 1024  # Same cap as max_http_buffer_size in app.py
+app = web.Application()
+sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*', ping_timeout=90, ping_interval=30,
+                           max_http_buffer_size=MAX_MESSAGE_SIZE, logger=False, engineio_logger=False)
+sio.attach(app)
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True, socket_connect_timeout=10, socket_timeout=10,
+                                 retry_on_timeout=True, health_check_interval=30)
+
+# --- Redis Helper Functions with Error Handling ---
+async def safe_redis_get(key, default=None):
+    try:
+        return await redis_client.get(key)
+    except Exception as e:
+        log_sampled(('redis', 'GET'), logging.ERROR, "Redis GET error for key %s: %s", key, e)
+        return default
+
+async def safe_redis_set(key, value, ex=None):
+    try:
+        return await redis_client.set(key, value, ex=ex)
+    except Exception as e:
+        log_sampled(('redis', 'SET'), logging.ERROR, "Redis SET error for key %s: %s", key, e)
+        return False
+
+async def safe_redis_delete(key):
+    try:
+        return await redis_client.delete(key)
+    except Exception as e:
+        log_sampled(('redis', 'DELETE'), logging.ERROR, "Redis DELETE error for key %s: %s", key, e)
+        return False
+
+async def safe_redis_exists(key):
+    try:
+        return await redis_client.exists(key)
+    except Exception as e:
+        log_sampled(('redis', 'EXISTS'), logging.ERROR, "Redis EXISTS error for key %s: %s", key, e)
+        return False
+
+# --- Authentication ---
+# Without Flask's signed session, a login sets a cookie holding an HMAC of SECRET_KEY. Socket.IO
+# connections are checked once on connect and remembered by SID (SIDs are per namespace).
+authenticated_sids = set()
+
+def auth_token():
+    return hmac.new(SECRET_KEY.encode(), b'authenticated', hashlib.sha256).hexdigest()
+
+def cookie_authenticated(cookie_header):
+    cookie = SimpleCookie(cookie_header or '').get(AUTH_COOKIE)
+    return cookie is not None and hmac.compare_digest(cookie.value, auth_token())
+
+def request_authenticated(request):
+    return cookie_authenticated(request.headers.get('Cookie'))
+
+# --- Static Viewer Assets ---
+# The page templates are the Jinja templates app.py renders; url_for maps the same endpoint names.
+ROUTE_PATHS = {'index': '/', 'interface': '/interface', 'logout': '/logout', 'asset': '/assets/{filename}'}
+static_assets = {}
+built_pages = {}
+
+def url_for(endpoint, **values):
+    path = ROUTE_PATHS[endpoint]
+    for name in list(values):
+        if '{' + name + '}' in path:
+            path = path.replace('{' + name + '}', quote(str(values.pop(name))))
+    return f"{path}?{urlencode(values)}" if values else path
+
+def render_page(template, **context):
+    return jinja2.Template(template).render(url_for=url_for, **context)
+
+def build_viewer_assets():
+    if built_pages:
+        return built_pages
+    pages, assets = build_viewer_bundle(render_page, lambda filename: url_for('asset', filename=filename))
+    static_assets.update(assets)
+    built_pages.update(pages)
+    return built_pages
+
+def send_prebuilt(request, entry, cache_control):
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = next((name for name in ('br', 'gzip') if name in entry['variants'] and name in accepted), 'identity')
+    etag = f"\"{entry['digest']}-{encoding}\""
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=entry['variants'][encoding], content_type=entry['mimetype'], headers=headers)
+
+# --- Health Check Background Task ---
+async def redis_health_check():
+    while True:
+        try:
+            await redis_client.ping()
+            await asyncio.sleep(30)
+        except Exception as e:
+            logger.error(f"Redis health check failed: {e}")
+            await asyncio.sleep(5)
+
+# --- Routes ---
+routes = web.RouteTableDef()
+
+@routes.get('/')
+async def index(request):
+    if request_authenticated(request):
+        raise web.HTTPFound(url_for('interface'))
+    return send_prebuilt(request, build_viewer_assets()['login'], PAGE_CACHE_CONTROL)
+
+@routes.post('/')
+async def login(request):
+    form = await request.post()
+    if check_auth(form.get('password')):
+        response = web.HTTPFound(url_for('interface'))
+        response.set_cookie(AUTH_COOKIE, auth_token(), httponly=True, samesite='Lax')
+        raise response
+    return send_prebuilt(request, build_viewer_assets()['login_error'], PAGE_CACHE_CONTROL)
+
+@routes.get('/interface')
+async def interface(request):
+    if not request_authenticated(request):
+        raise web.HTTPFound(url_for('index'))
+    return send_prebuilt(request, build_viewer_assets()['interface'], PAGE_CACHE_CONTROL)
+
+@routes.get('/assets/{filename}')
+async def asset(request):
+    entry = static_assets.get(request.match_info['filename'])
+    if not entry:
+        return web.Response(status=404, text="Not Found")
+    return send_prebuilt(request, entry, ASSET_CACHE_CONTROL)
+
+@routes.get('/logout')
+async def logout(request):
+    response = web.HTTPFound(url_for('index'))
+    response.del_cookie(AUTH_COOKIE)
+    raise response
+
+def not_authenticated():
+    return web.json_response({'status': 'error', 'message': 'Not authenticated'}, status=401)
+
+# --- Session Resume ---
+# Same as app.py: a dropped PC keeps its session for RESUME_GRACE, and a resumed registration
+# gets the last frame sequence number relayed per monitor.
+last_frame_seq = {}  # Monitor -> sequence number of the last frame relayed from the PC
+pending_teardown = None  # Timer that ends a dropped PC session once RESUME_GRACE passes
+client_resume_token = None  # Held in memory like the session it resumes, so a restarted server starts a new session
+
+def note_frame_relayed(meta):
+    if meta.get('seq') is not None:
+        last_frame_seq[meta.get('monitor')] = meta['seq']
+
+def cancel_pending_teardown():
+    global pending_teardown
+    if pending_teardown is not None:
+        pending_teardown.cancel()
+        pending_teardown = None
+
+async def end_client_session():
+    global pending_teardown, client_resume_token
+    pending_teardown = None
+    client_resume_token = None
+    logger.warning("Remote PC did not resume in time, ending its session.")
+    await safe_redis_delete(MONITORS_KEY)
+    last_frame_seq.clear()
+    await sio.emit('client_disconnected')
+    await stop_session_recording()
+
+# --- SocketIO Events ---
+async def enter_room(sid, room, namespace='/'):
+    # Room membership calls are coroutines on AsyncServer from python-socketio 5.10 on
+    result = sio.enter_room(sid, room, namespace=namespace)
+    if inspect.isawaitable(result):
+        await result
+
+async def leave_room(sid, room, namespace='/'):
+    result = sio.leave_room(sid, room, namespace=namespace)
+    if inspect.isawaitable(result):
+        await result
+
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    if cookie_authenticated(environ.get('HTTP_COOKIE')):
+        authenticated_sids.add(sid)
+    logger.info(f"Browser connected: SID={sid}")
+
+@sio.on('disconnect')
+async def handle_disconnect(sid):
+    global pending_teardown
+    logger.info(f"A client disconnected: SID={sid}")
+    authenticated_sids.discard(sid)
+    await leave_fallback_lane(sid)
+    await clear_viewer_rois(sid)
+    client_pc_sid = await safe_redis_get(CLIENT_REDIS_KEY)
+    if sid == client_pc_sid:
+        logger.warning(f"Remote PC (SID: {client_pc_sid}) disconnected. Holding its session {RESUME_GRACE}s for a resume.")
+        await safe_redis_delete(CLIENT_REDIS_KEY)
+        cancel_pending_teardown()
+        pending_teardown = asyncio.get_running_loop().call_later(RESUME_GRACE, sio.start_background_task, end_client_session)
+
+@sio.on('register_client')
+async def handle_register_client(sid, data):
+    global client_resume_token
+    client_token = data.get('token')
+    if client_token == ACCESS_PASSWORD:
+        resumed = bool(data.get('resume_token')) and data.get('resume_token') == client_resume_token
+        old_sid = await safe_redis_get(CLIENT_REDIS_KEY)
+        if old_sid and old_sid != sid:
+            logger.warning(f"New client auth, disconnecting old client (SID: {old_sid})")
+            try:
+                await sio.disconnect(old_sid)
+            except Exception:
+                pass
+
+        if await safe_redis_set(CLIENT_REDIS_KEY, sid):
+            cancel_pending_teardown()
+            if resumed:
+                logger.info(f"Remote PC resumed its session (SID: {sid}).")
+                await sio.emit('registration_success', {'resume_token': client_resume_token, 'resumed': True,
+                                                        'last_seq': {str(monitor_index): seq for monitor_index, seq in last_frame_seq.items()}}, to=sid)
+                # Viewers may have come, gone or switched monitors while the PC was away
+                await update_watched_monitors()
+                await forward_to_client('viewer_presence', {'watching': bool(viewer_monitor_watches)})
+                return
+            client_resume_token = secrets.token_urlsafe(16)
+            last_frame_seq.clear()
+            logger.info(f"Remote PC registered (SID: {sid}). State saved to Redis.")
+            await start_session_recording()
+            await sio.emit('client_connected', skip_sid=sid)
+            await sio.emit('registration_success', {'resume_token': client_resume_token, 'resumed': False}, to=sid)
+        else:
+            logger.error(f"Failed to save client SID to Redis for {sid}")
+            await sio.emit('registration_fail', {'message': 'Server error.'}, to=sid)
+            await sio.disconnect(sid)
+    else:
+        logger.warning(f"Client registration failed for SID {sid}. Incorrect password.")
+        await sio.emit('registration_fail', {'message': 'Auth failed.'}, to=sid)
+        await sio.disconnect(sid)
+
+@sio.on('check_client_status')
+async def check_client_status(sid, data=None):
+    try:
+        if await safe_redis_exists(CLIENT_REDIS_KEY):
+            await sio.emit('client_connected', to=sid)
+            monitors = await safe_redis_get(MONITORS_KEY)
+            if monitors:
+                await sio.emit('monitor_list', json.loads(monitors), to=sid)
+    except Exception as e:
+        logger.error(f"Error checking client status: {e}")
+
+@sio.on('ping_from_browser')
+async def handle_ping(sid, data=None):
+    pass
+
+# Socket.IO handles each event in its own task. Frames take this lock before anything else so they
+# are relayed in the order the PC sent them, which keeps the slices of a picture together.
+frame_relay_lock = asyncio.Lock()
+
+@sio.on('screen_data_bytes')
+async def handle_screen_data_bytes(sid, data, meta=None):
+    async with frame_relay_lock:
+        if await safe_redis_get(CLIENT_REDIS_KEY) == sid:
+            await broadcast_frame(data, meta)
+
+async def broadcast_frame(data, meta=None, frame_sockets=True):
+    # Frames that follow applied input carry their input IDs for latency measurement;
+    # frames tagged with a monitor only go to viewers watching that monitor
+    if frame_sockets and frame_socket_viewers:
+        await relay_to_frame_sockets(meta or {}, pack_frame(data, meta))
+    if frame_sockets and meta:
+        note_frame_relayed(meta)
+    if frame_sockets and session_recorder:
+        await session_recorder.record_frame(meta or {}, data)
+    if meta and meta.get('layer') is not None:
+        await send_layered_frame(data, meta)
+        return
+    room = monitor_room(meta['monitor']) if meta and meta.get('monitor') is not None else VIEWERS_ROOM
+    await sio.emit('screen_frame_bytes', (data, meta) if meta else data, to=room, namespace=BULK_NAMESPACE)
+    if fallback_viewers:
+        await sio.emit('screen_frame_bytes', (data, meta) if meta else data, to=room)
+
+# --- Priority Lanes ---
+# Bulk data travels on the /bulk namespace, with the same fallback lane for viewers as app.py.
+fallback_viewers = set()  # Default-namespace SIDs of viewers without a working bulk lane
+
+def viewer_namespace(sid):
+    return '/' if sid in fallback_viewers else BULK_NAMESPACE
+
+async def send_clipboard_to_viewers(data):
+    await sio.emit('update_browser_clipboard', data, to=VIEWERS_ROOM, namespace=BULK_NAMESPACE)
+    if fallback_viewers:
+        await sio.emit('update_browser_clipboard', data, to=VIEWERS_ROOM)
+
+async def leave_fallback_lane(sid):
+    if sid not in fallback_viewers:
+        return
+    fallback_viewers.discard(sid)
+    viewer_layers.pop(sid, None)
+    for monitor_index in viewer_monitor_watches.get(sid, set()):
+        await leave_room(sid, monitor_room(monitor_index))
+    await leave_room(sid, VIEWERS_ROOM)
+    await remove_viewer(sid)
+
+@sio.on('use_fallback_lane')
+async def handle_use_fallback_lane(sid, data):
+    if sid not in authenticated_sids:
+        return
+    if data.get('enabled'):
+        logger.info(f"Viewer {sid} has no bulk lane, sending its frames on the default connection.")
+        fallback_viewers.add(sid)
+        await enter_room(sid, VIEWERS_ROOM)
+    else:
+        await leave_fallback_lane(sid)
+
+@sio.on('connect', namespace=BULK_NAMESPACE)
+async def handle_bulk_connect(sid, environ):
+    if cookie_authenticated(environ.get('HTTP_COOKIE')):
+        authenticated_sids.add(sid)
+        await enter_room(sid, VIEWERS_ROOM, namespace=BULK_NAMESPACE)
+        # The viewer follows up with watch_monitors, which requests keyframes for the monitors it shows
+
+@sio.on('disconnect', namespace=BULK_NAMESPACE)
+async def handle_bulk_disconnect(sid):
+    authenticated_sids.discard(sid)
+    viewer_layers.pop(sid, None)
+    await remove_viewer(sid)
+    if await safe_redis_get(CLIENT_BULK_REDIS_KEY) == sid:
+        logger.warning(f"Remote PC bulk lane (SID: {sid}) disconnected.")
+        await safe_redis_delete(CLIENT_BULK_REDIS_KEY)
+
+@sio.on('register_bulk_client', namespace=BULK_NAMESPACE)
+async def handle_register_bulk_client(sid, data):
+    if data.get('token') != ACCESS_PASSWORD:
+        logger.warning(f"Bulk lane registration failed for SID {sid}. Incorrect password.")
+        await sio.disconnect(sid, namespace=BULK_NAMESPACE)
+        return
+    if await safe_redis_set(CLIENT_BULK_REDIS_KEY, sid):
+        logger.info(f"Remote PC bulk lane registered (SID: {sid}).")
+        await sio.emit('bulk_registration_success', to=sid, namespace=BULK_NAMESPACE)
+
+@sio.on('screen_data_bytes', namespace=BULK_NAMESPACE)
+async def handle_bulk_screen_data_bytes(sid, data, meta=None):
+    async with frame_relay_lock:
+        if await safe_redis_get(CLIENT_BULK_REDIS_KEY) == sid:
+            await broadcast_frame(data, meta)
+    # The return value acknowledges the frame so the PC can send the next one
+    return True
+
+@sio.on('clipboard_from_client', namespace=BULK_NAMESPACE)
+async def handle_bulk_clipboard_from_client(sid, data):
+    if await safe_redis_get(CLIENT_BULK_REDIS_KEY) == sid:
+        record_clipboard_event('from_pc', data)
+        await send_clipboard_to_viewers(data)
+
+# --- Multi-Monitor Streams ---
+viewer_monitor_watches = {}  # Bulk viewer SID (or fast-path key) -> set of watched monitor indices
+viewer_lane_owners = {}  # Bulk SID, fast-path key or fallback SID -> the viewer's main connection SID
+monitor_rois = {}  # Monitor -> {main connection SID: zoomed region}, least recently set first
+
+async def default_monitor_index():
+    monitors = await safe_redis_get(MONITORS_KEY)
+    return json.loads(monitors).get('default') if monitors else None
+
+async def update_watched_monitors():
+    watched = set().union(*viewer_monitor_watches.values()) if viewer_monitor_watches else set()
+    await forward_to_client('set_watched_monitors', {'monitors': sorted(watched)})
+
+async def update_viewer_presence(was_watching):
+    watching = bool(viewer_monitor_watches)
+    if watching != was_watching:
+        logger.info("First viewer arrived, resuming capture." if watching else "Last viewer left, pausing capture.")
+        await forward_to_client('viewer_presence', {'watching': watching})
+
+@sio.on('monitor_list')
+async def handle_monitor_list(sid, data):
+    if await safe_redis_get(CLIENT_REDIS_KEY) != sid:
+        return
+    await safe_redis_set(MONITORS_KEY, json.dumps(data))
+    if session_recorder:
+        await session_recorder.set_monitors(data)
+    logger.info(f"Remote PC reported {len(data.get('monitors', []))} monitor(s).")
+    await sio.emit('monitor_list', data, skip_sid=sid)
+    await sio.emit('viewer_presence', {'watching': bool(viewer_monitor_watches)}, to=sid)
+    await update_watched_monitors()
+    for monitor_index in monitor_rois:
+        await forward_to_client('set_roi', {'monitor': monitor_index, 'roi': current_roi(monitor_index)})
+    # A newly registered PC encodes every layer until told otherwise
+    wanted_layers.clear()
+    await update_wanted_layers()
+
+async def set_viewer_monitors(viewer_key, monitors, owner=None):
+    """Record which monitors a viewer shows; returns (previous, requested) sets"""
+    requested = {i for i in monitors if isinstance(i, int)}
+    if not requested:
+        default = await default_monitor_index()
+        if default is not None:
+            requested = {default}
+    was_watching = bool(viewer_monitor_watches)
+    previous = viewer_monitor_watches.get(viewer_key, set())
+    for monitor_index in requested - previous:
+        await forward_to_client('request_keyframe', {'monitor': monitor_index})
+    viewer_monitor_watches[viewer_key] = requested
+    if owner:
+        viewer_lane_owners[viewer_key] = owner
+        await clear_viewer_rois(owner, keep=requested)
+    await update_watched_monitors()
+    await update_viewer_presence(was_watching)
+    return previous, requested
+
+async def remove_viewer(viewer_key):
+    owner = viewer_lane_owners.pop(viewer_key, None)
+    if owner and owner not in viewer_lane_owners.values():
+        await clear_viewer_rois(owner)
+    if viewer_monitor_watches.pop(viewer_key, None) is not None:
+        await update_watched_monitors()
+        await update_viewer_presence(was_watching=True)
+
+# Zoomed regions are owned per viewer, as in app.py
+def current_roi(monitor_index):
+    rois = monitor_rois.get(monitor_index)
+    return next(reversed(rois.values())) if rois else None
+
+async def set_viewer_roi(owner, monitor_index, roi):
+    before = current_roi(monitor_index)
+    rois = monitor_rois.setdefault(monitor_index, {})
+    rois.pop(owner, None)
+    if roi:
+        rois[owner] = roi
+    elif not rois:
+        monitor_rois.pop(monitor_index)
+    after = current_roi(monitor_index)
+    if after != before:
+        await forward_to_client('set_roi', {'monitor': monitor_index, 'roi': after})
+
+async def clear_viewer_rois(owner, keep=()):
+    for monitor_index in [m for m, rois in monitor_rois.items() if owner in rois and m not in keep]:
+        await set_viewer_roi(owner, monitor_index, None)
+
+async def watch_monitors(sid, data, namespace):
+    if sid not in authenticated_sids:
+        return
+    if data.get('monitors') is None:
+        # The viewer receives frames on the binary fast path instead
+        for monitor_index in viewer_monitor_watches.get(sid, set()):
+            await leave_room(sid, monitor_room(monitor_index), namespace=namespace)
+        await remove_viewer(sid)
+        return
+    previous, requested = await set_viewer_monitors(sid, data['monitors'], owner=data.get('viewer') or sid)
+    for monitor_index in previous - requested:
+        await leave_room(sid, monitor_room(monitor_index), namespace=namespace)
+    for monitor_index in requested - previous:
+        await enter_room(sid, monitor_room(monitor_index), namespace=namespace)
+
+@sio.on('watch_monitors', namespace=BULK_NAMESPACE)
+async def handle_watch_monitors(sid, data):
+    await watch_monitors(sid, data, BULK_NAMESPACE)
+
+@sio.on('watch_monitors')
+async def handle_fallback_watch_monitors(sid, data):
+    await watch_monitors(sid, data, '/')
+
+# --- Simulcast ---
+# Same layer selection as app.py, driven by Socket.IO acknowledgement callbacks.
+viewer_layers = {}  # Bulk viewer SID -> {'layer', 'target', 'in_flight', 'open', 'acked', 'downgraded_at'}
+layer_frame_bytes = {}  # (monitor, layer) -> average frame size in bytes
+monitor_frame_timing = {}  # Monitor -> (last frame seq, its arrival, average frame interval)
+wanted_layers = {}  # Monitor -> layers the PC was last told to encode
+
+async def send_layered_frame(data, meta):
+    monitor_index, layer = meta.get('monitor'), meta['layer']
+    picture = (meta.get('seq'), layer)
+    now = time.time()
+    layer_frame_bytes[(monitor_index, layer)] = ewma(layer_frame_bytes.get((monitor_index, layer)), len(data))
+    last_seq, last_arrival, interval = monitor_frame_timing.get(monitor_index, (None, None, None))
+    if meta.get('seq') != last_seq:
+        # Timed on whichever layer of a frame arrives first, as the PC only encodes wanted layers
+        monitor_frame_timing[monitor_index] = (meta.get('seq'), now, interval if last_arrival is None else ewma(interval, now - last_arrival))
+    for sid, monitors in list(viewer_monitor_watches.items()):
+        if sid in frame_socket_viewers or (monitor_index is not None and monitor_index not in monitors):
+            continue
+        state = viewer_layers.setdefault(sid, {'layer': 0, 'target': 0, 'in_flight': 0, 'open': {}, 'acked': collections.deque(), 'downgraded_at': 0})
+        if not starts_picture(meta):
+            # The rest of an admitted picture always follows its first slice, so it is never torn
+            if state['open'].get(monitor_index) != picture:
+                continue
+        else:
+            if state['open'].pop(monitor_index, None):
+                # The PC abandoned the last picture mid-way, so its final ack will never come
+                state['in_flight'] = max(0, state['in_flight'] - 1)
+            if state['layer'] != layer:
+                # Switch only on a keyframe of the layer the viewer should move to
+                if state['target'] != layer or not is_keyframe(meta):
+                    continue
+                state['layer'] = layer
+            if state['in_flight'] >= SIMULCAST_MAX_IN_FLIGHT:
+                state['target'] = min(layer + 1, meta.get('layers', 1) - 1)
+                state['downgraded_at'] = now
+                continue
+            # Counted once per picture and released by the ack of its last message
+            state['in_flight'] += 1
+            state['open'][monitor_index] = picture
+        last = ends_picture(meta)
+        if last:
+            del state['open'][monitor_index]
+        await sio.emit('screen_frame_bytes', (data, meta), to=sid, namespace=viewer_namespace(sid),
+                       callback=lambda *args, sid=sid, size=len(data), last=last: handle_viewer_frame_ack(sid, monitor_index, size, last))
+    await update_wanted_layers()
+
+def handle_viewer_frame_ack(sid, monitor_index, size, last=True):
+    state = viewer_layers.get(sid)
+    if state is None:
+        return
+    now = time.time()
+    if last:
+        state['in_flight'] = max(0, state['in_flight'] - 1)
+    acked = state['acked']
+    acked.append((now, size))
+    while acked[0][0] < now - SIMULCAST_RATE_WINDOW:
+        acked.popleft()
+    better = state['target'] - 1
+    interval = monitor_frame_timing.get(monitor_index, (None, None, None))[2]
+    layer_bytes = layer_frame_bytes.get((monitor_index, state['layer']))
+    if better < 0 or state['in_flight'] or not interval or not layer_bytes or now - state['downgraded_at'] < SIMULCAST_UPGRADE_DELAY:
+        return
+    # Bytes acknowledged over the window, not one frame's round trip, which is mostly latency.
+    # A viewer taking its whole layer with nothing left in flight tries the better one; if it
+    # cannot keep up there, frames back up and it is moved down again.
+    if sum(size for _, size in acked) / SIMULCAST_RATE_WINDOW >= layer_bytes / interval * SIMULCAST_KEEPUP_RATIO:
+        state['target'] = better
+
+def layers_wanted(monitor_index):
+    """Layers some viewer of a monitor is on or moving to (layer 0 for the recording)"""
+    layers = {0} if session_recorder else set()
+    for key, monitors in viewer_monitor_watches.items():
+        if monitor_index in monitors:
+            state = frame_socket_viewers.get(key) or viewer_layers.get(key)
+            layers.update((state['layer'], state['target']) if state else (0,))
+    return sorted(layers)
+
+async def update_wanted_layers():
+    """Tell the PC which layers to encode, so no CPU goes into layers no viewer receives"""
+    for monitor_index in set().union(*viewer_monitor_watches.values()) if viewer_monitor_watches else ():
+        layers = layers_wanted(monitor_index)
+        if layers and layers != wanted_layers.get(monitor_index):
+            wanted_layers[monitor_index] = layers
+            await forward_to_client('set_wanted_layers', {'monitor': monitor_index, 'layers': layers})
+
+# --- Session Recording ---
+# Same files as app.py. The relay path only queues records; a writer task hands batches to a
+# worker thread with asyncio.to_thread.
+session_recorder = None
+
+class SessionRecorder:
+    """Buffered, append-only recording of one remote PC session"""
+    def __init__(self):
+        self.id = new_recording_id()
+        self.started_at = time.time()
+        self.header = {'id': self.id, 'started_at': self.started_at, 'ended_at': None, 'monitors': None}
+        self.queue = asyncio.Queue(maxsize=SESSION_RECORDING_QUEUE)
+        self.dropped = 0
+        self.last_keyframe = {}  # Monitor -> seconds of its last keyframe (or keyframe request)
+        self.last_indexed = {}  # Monitor -> seconds of its last index entry
+
+    def open_files(self):
+        os.makedirs(SESSION_RECORDING_DIR, exist_ok=True)
+        self.data_file = open(recording_path(self.id, 'rec'), 'ab')
+        self.index_file = open(recording_path(self.id, 'idx'), 'ab')
+        write_recording_header(self.header)
+
+    async def start(self):
+        """Open the recording files off the event loop, then start the writer"""
+        await asyncio.to_thread(self.open_files)
+        self.writer = asyncio.create_task(self.write_loop())
+
+    def record(self, kind, meta, payload=b''):
+        try:
+            self.queue.put_nowait((kind, time.time() - self.started_at, meta, payload))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log_sampled('recording_dropped', logging.WARNING, "Session recording %s is behind, dropping records", self.id)
+
+    async def record_frame(self, meta, payload):
+        if meta.get('layer'):
+            return
+        now = time.time() - self.started_at
+        monitor_index = meta.get('monitor')
+        if is_keyframe(meta):
+            self.last_keyframe[monitor_index] = now
+        elif meta.get('codec') and now - self.last_keyframe.setdefault(monitor_index, now) > SESSION_KEYFRAME_INTERVAL:
+            # Long runs of video deltas would make seeking replay many frames; ask for a fresh keyframe
+            self.last_keyframe[monitor_index] = now
+            await forward_to_client('request_keyframe', {'monitor': monitor_index})
+        self.record(RECORD_FRAME, meta, bytes(payload))
+
+    async def write_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            closing = batch[-1] is None
+            await asyncio.to_thread(write_recording_batch, self.data_file, self.index_file, self.last_indexed, batch[:-1] if closing else batch)
+            if closing:
+                return
+
+    async def set_monitors(self, monitors):
+        self.header['monitors'] = monitors
+        await asyncio.to_thread(write_recording_header, self.header)
+
+    async def stop(self):
+        await self.queue.put(None)
+        await self.writer
+        self.data_file.close()
+        self.index_file.close()
+        self.header['ended_at'] = time.time()
+        await asyncio.to_thread(write_recording_header, self.header)
+        logger.info(f"⏹️ Session recording {self.id} finished ({self.dropped} records dropped)")
+
+async def start_session_recording():
+    global session_recorder
+    if not SESSION_RECORDING_DIR:
+        return
+    await stop_session_recording()
+    recorder = SessionRecorder()
+    await recorder.start()
+    session_recorder = recorder
+    monitors = await safe_redis_get(MONITORS_KEY)
+    if monitors:
+        await session_recorder.set_monitors(json.loads(monitors))
+    logger.info(f"⏺️ Recording session {session_recorder.id} to {SESSION_RECORDING_DIR}")
+
+async def stop_session_recording():
+    global session_recorder
+    recorder, session_recorder = session_recorder, None
+    if recorder:
+        await recorder.stop()
+
+def record_session_event(kind, meta, payload=b''):
+    if session_recorder:
+        session_recorder.record(kind, meta, payload)
+
+def record_clipboard_event(direction, data):
+    """Clipboard text stays in the meta; chunked binary clipboard data is stored as the payload"""
+    if session_recorder and isinstance(data, dict):
+        session_recorder.record(RECORD_CLIPBOARD, *clipboard_record(direction, data))
+
+async def stream_recording(ws, recording_id, index, position, speed):
+    """Send records from position on at the recorded pace; frames before position (back to the keyframe) go at once"""
+    started = time.time()
+    reported = None
+    with await asyncio.to_thread(open, recording_path(recording_id, 'rec'), 'rb') as f:
+        f.seek(seek_offset(index, position))
+        while True:
+            record = await asyncio.to_thread(read_record, f)
+            if record is None:
+                break
+            kind, timestamp, body = record
+            if timestamp < position:
+                if kind != RECORD_FRAME:
+                    continue
+            else:
+                delay = (timestamp - position) / speed - (time.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if reported is None or timestamp - reported >= 1:
+                    reported = timestamp
+                    await ws.send_str(json.dumps({'type': 'position', 't': timestamp}))
+            if kind == RECORD_FRAME:
+                await ws.send_bytes(body)
+            else:
+                await ws.send_str(playback_event(kind, timestamp, body))
+    await ws.send_str(json.dumps({'type': 'end'}))
+
+@routes.get(FRAME_SOCKET_PLAYBACK_PATH)
+async def frame_socket_playback(request):
+    if not request_authenticated(request):
+        return web.Response(status=403, text='Forbidden')
+    ws = web.WebSocketResponse(max_msg_size=MAX_MESSAGE_SIZE)
+    await ws.prepare(request)
+    params = parse_playback_params(dict(request.query))
+    if not params:
+        await ws.send_str(json.dumps({'type': 'error', 'message': 'Recording not found.'}))
+        await ws.close()
+        return ws
+    recording_id, position, speed = params
+    index = await asyncio.to_thread(read_recording_index, recording_id)
+    await ws.send_str(playback_info(recording_id, await asyncio.to_thread(read_recording_header, recording_id), index))
+    streamer = asyncio.create_task(stream_recording(ws, recording_id, index, position, speed))
+    try:
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            seek = parse_seek_command(message.data)
+            if seek is None:
+                continue
+            streamer.cancel()
+            # A live session keeps growing, so re-read its index before seeking
+            index = await asyncio.to_thread(read_recording_index, recording_id)
+            streamer = asyncio.create_task(stream_recording(ws, recording_id, index, seek, speed))
+    finally:
+        streamer.cancel()
+    return ws
+
+@routes.get('/recordings')
+async def recordings(request):
+    if not request_authenticated(request):
+        return not_authenticated()
+    return web.json_response({'recordings': list_recordings(lambda recording_id: url_for('interface', playback=recording_id))})
+
+# --- Binary Frame Fast Path ---
+# The same plain WebSocket endpoints as app.py, served by aiohttp directly.
+frame_socket_viewers = {}  # Viewer key -> {'ws', 'queue', 'pictures', 'open', 'layer', 'target', 'downgraded_at', 'awaiting_key'}
+frame_socket_ids = itertools.count(1)
+
+def has_socketio_viewers():
+    return any(key not in frame_socket_viewers for key in viewer_monitor_watches)
+
+async def relay_to_frame_sockets(meta, message):
+    monitor_index, layer = meta.get('monitor'), meta.get('layer')
+    picture = (meta.get('seq'), layer)
+    for key, viewer in list(frame_socket_viewers.items()):
+        if monitor_index is not None and monitor_index not in viewer_monitor_watches.get(key, ()):
+            continue
+        if not starts_picture(meta):
+            # The rest of an admitted picture always follows its first slice, so it is never torn
+            if viewer['open'].get(monitor_index) == picture:
+                viewer['queue'].put_nowait((meta, message))
+                if ends_picture(meta):
+                    del viewer['open'][monitor_index]
+            continue
+        # Anything still open was abandoned by the PC mid-picture
+        viewer['open'].pop(monitor_index, None)
+        if layer is not None and viewer['layer'] != layer:
+            # Same layer rules as the Socket.IO path: switch only on a keyframe of the target layer
+            if viewer['target'] != layer or not is_keyframe(meta):
+                continue
+            viewer['layer'] = layer
+        if meta.get('codec') and viewer['awaiting_key']:
+            if not meta.get('key'):
+                continue
+            viewer['awaiting_key'] = False
+        if viewer['pictures'] >= FRAME_SOCKET_QUEUE_FRAMES:
+            if layer is not None:
+                viewer['target'] = min(layer + 1, meta.get('layers', 1) - 1)
+                viewer['downgraded_at'] = time.time()
+            elif meta.get('codec'):
+                # A skipped video packet breaks the decode chain until the next keyframe
+                viewer['awaiting_key'] = True
+                await forward_to_client('request_keyframe', {'monitor': monitor_index})
+            continue
+        viewer['pictures'] += 1
+        viewer['queue'].put_nowait((meta, message))
+        if not ends_picture(meta):
+            viewer['open'][monitor_index] = picture
+        if layer and viewer['pictures'] <= 1 and time.time() - viewer['downgraded_at'] > SIMULCAST_UPGRADE_DELAY:
+            viewer['target'] = layer - 1
+    if layer is not None:
+        await update_wanted_layers()
+
+async def frame_socket_sender(viewer):
+    while True:
+        meta, message = await viewer['queue'].get()
+        if starts_picture(meta):
+            viewer['pictures'] -= 1
+        await viewer['ws'].send_bytes(message)
+
+@routes.get(FRAME_SOCKET_PC_PATH)
+async def frame_socket_pc(request):
+    if request.headers.get('X-Access-Token') != ACCESS_PASSWORD:
+        return web.Response(status=403, text='Forbidden')
+    ws = web.WebSocketResponse(max_msg_size=MAX_MESSAGE_SIZE)
+    await ws.prepare(request)
+    logger.info("Remote PC connected to the binary frame fast path.")
+    async for message in ws:
+        if message.type != WSMsgType.BINARY or len(message.data) < 4:
+            continue
+        meta, payload_offset = unpack_frame_header(message.data)
+        await relay_to_frame_sockets(meta, message.data)
+        note_frame_relayed(meta)
+        if session_recorder:
+            await session_recorder.record_frame(meta, memoryview(message.data)[payload_offset:])
+        if has_socketio_viewers():
+            await broadcast_frame(message.data[payload_offset:], meta, frame_sockets=False)
+    logger.warning("Remote PC left the binary frame fast path.")
+    return ws
+
+@routes.get(FRAME_SOCKET_VIEW_PATH)
+async def frame_socket_view(request):
+    if not request_authenticated(request):
+        return web.Response(status=403, text='Forbidden')
+    ws = web.WebSocketResponse(max_msg_size=MAX_MESSAGE_SIZE)
+    await ws.prepare(request)
+    viewer_key = f"ws:{next(frame_socket_ids)}"
+    viewer = {'ws': ws, 'queue': asyncio.Queue(), 'pictures': 0, 'open': {}, 'layer': 0, 'target': 0, 'downgraded_at': 0, 'awaiting_key': True}
+    frame_socket_viewers[viewer_key] = viewer
+    sender = asyncio.create_task(frame_socket_sender(viewer))
+    try:
+        async for message in ws:
+            if message.type == WSMsgType.TEXT:
+                watch = parse_watch_message(message.data)
+                if watch is None:
+                    continue
+                monitors, owner = watch
+                await set_viewer_monitors(viewer_key, monitors, owner=owner)
+    finally:
+        sender.cancel()
+        frame_socket_viewers.pop(viewer_key, None)
+        await remove_viewer(viewer_key)
+    return ws
+
+# --- Metrics ---
+input_latency_counts = [0] * (len(INPUT_LATENCY_BUCKETS_MS) + 1)
+
+def observe_input_latency(latency_ms):
+    input_latency_counts[bisect.bisect_left(INPUT_LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+@sio.on('input_latency_report')
+async def handle_input_latency_report(sid, data):
+    if sid not in authenticated_sids:
+        return
+    for latency_ms in data.get('samples', [])[:200]:
+        if isinstance(latency_ms, (int, float)) and latency_ms >= 0:
+            observe_input_latency(latency_ms)
+
+latest_capture_stats = {}  # Last capture pipeline timing report from the PC
+
+@sio.on('capture_stats')
+async def handle_capture_stats(sid, data):
+    if await safe_redis_get(CLIENT_REDIS_KEY) != sid:
+        return
+    latest_capture_stats.clear()
+    latest_capture_stats.update(data, received_at=time.time())
+    await sio.emit('capture_stats', data, skip_sid=sid)
+
+@routes.get('/metrics')
+async def metrics(request):
+    if not request_authenticated(request):
+        return not_authenticated()
+    return web.json_response({
+        'input_latency_ms': {
+            'buckets': INPUT_LATENCY_BUCKETS_MS + ['+Inf'],
+            'counts': input_latency_counts,
+            'total': sum(input_latency_counts)
+        },
+        'capture_pipeline': latest_capture_stats,
+        'log_records_dropped': DroppingQueueHandler.dropped,
+        'session_recording': {'id': session_recorder.id, 'records_dropped': session_recorder.dropped} if session_recorder else None
+    })
+
+# --- AI-Related Events ---
+@sio.on('toggle_ai_mode')
+async def handle_toggle_ai_mode(sid, data):
+    if sid not in authenticated_sids:
+        return
+    ai_enabled = data.get('enabled', False)
+    await safe_redis_set(AI_ENABLED_KEY, str(ai_enabled))
+    await forward_to_client('ai_mode_changed', {'enabled': ai_enabled})
+    logger.info(f"AI mode {'enabled' if ai_enabled else 'disabled'}")
+
+@sio.on('ai_screenshot_request')
+async def handle_ai_screenshot_request(sid, data):
+    """Handle screenshot from client for AI analysis"""
+    if await safe_redis_get(CLIENT_REDIS_KEY) != sid:
+        return
+    await sio.emit('ai_analysis_started', skip_sid=sid)
+    screenshot_data = data.get('screenshot')
+    if not screenshot_data:
+        await sio.emit('ai_analysis_error', skip_sid=sid)
+        return
+    sio.start_background_task(process_ai_screenshot, screenshot_data)
+
+async def process_ai_screenshot(screenshot_base64):
+    """Process screenshot with Claude AI on the server's own event loop"""
+    try:
+        ai_response = await analyze_screenshot_with_claude(screenshot_base64)
+        if not ai_response:
+            await sio.emit('ai_analysis_error', {'message': 'AI analysis failed'})
+            logger.error("AI analysis failed")
+            return
+        answer, answer_type, full_response = parse_ai_answer(ai_response)
+        if not answer:
+            await sio.emit('ai_analysis_complete', {'answer': None})
+            logger.info("AI could not extract answer from screenshot")
+            return
+        # Store answer in Redis for client access; expires after 5 minutes
+        await safe_redis_set(AI_ANSWER_KEY, json.dumps({'answer': answer, 'type': answer_type, 'full_response': full_response}), ex=300)
+        await sio.emit('ai_analysis_complete', {'answer': answer, 'answer_type': answer_type, 'full_response': full_response})
+        await forward_to_client('ai_answer_ready', {'answer': answer, 'type': answer_type})
+        logger.info(f"AI Analysis complete: {answer} (type: {answer_type})")
+    except Exception as e:
+        logger.error(f"Error in AI screenshot processing: {e}")
+        try:
+            await sio.emit('ai_analysis_error', {'message': str(e)})
+        except Exception as emit_error:
+            logger.error(f"Error emitting error message: {emit_error}")
+
+async def forward_to_client(event, data, bulk=False):
+    namespace = '/'
+    client_pc_sid = None
+    if bulk:
+        client_pc_sid = await safe_redis_get(CLIENT_BULK_REDIS_KEY)
+        namespace = BULK_NAMESPACE if client_pc_sid else '/'
+    client_pc_sid = client_pc_sid or await safe_redis_get(CLIENT_REDIS_KEY)
+    if client_pc_sid:
+        try:
+            await sio.emit(event, data, to=client_pc_sid, namespace=namespace)
+            return True
+        except Exception as e:
+            log_sampled(('forward', event), logging.ERROR, "Error forwarding %s to client %s: %s", event, client_pc_sid, e)
+            return False
+    return False
+
+# --- Input Coalescing ---
+# Same one-tick batching as app.py.
+pending_input = {'commands': [], 'input_ids': [], 'origins': set(), 'scheduled': False}
+
+async def flush_pending_input():
+    await sio.sleep(INPUT_COALESCE_INTERVAL)
+    commands, input_ids, origins = pending_input['commands'], pending_input['input_ids'], pending_input['origins']
+    pending_input.update(commands=[], input_ids=[], origins=set(), scheduled=False)
+    batch = coalesce_moves(commands)
+    record_session_event(RECORD_INPUT, {'batch': batch, 'input_ids': input_ids})
+    if not await forward_to_client('command', {'batch': batch, 'input_ids': input_ids}):
+        for sid in origins:
+            await sio.emit('command_error', {'message': 'Remote PC not connected.'}, to=sid)
+
+@sio.on('control_command')
+async def handle_control_command(sid, data):
+    if sid not in authenticated_sids:
+        return
+    batch = data.get('batch')
+    commands = batch if isinstance(batch, list) else [data]
+    pending_input['commands'].extend(c for c in commands if isinstance(c, dict))
+    pending_input['origins'].add(sid)
+    if data.get('input_id'):
+        pending_input['input_ids'].append(str(data['input_id']))
+    if not pending_input['scheduled']:
+        pending_input['scheduled'] = True
+        sio.start_background_task(flush_pending_input)
+
+@sio.on('request_keyframe')
+async def handle_request_keyframe(sid, data=None):
+    if sid not in authenticated_sids:
+        return
+    await forward_to_client('request_keyframe', {'monitor': (data or {}).get('monitor')})
+
+@sio.on('set_roi')
+async def handle_set_roi(sid, data):
+    if sid not in authenticated_sids:
+        return
+    await set_viewer_roi(sid, data.get('monitor'), data.get('roi'))
+
+@sio.on('video_unsupported')
+async def handle_video_unsupported(sid, data):
+    if sid not in authenticated_sids:
+        return
+    log_sampled('video_unsupported', logging.WARNING, "Viewer cannot decode %s, switching remote PC back to JPEG", data.get('codec'))
+    await forward_to_client('receive_settings_update', {'codec': 'jpeg'})
+
+@sio.on('set_injection_text')
+async def handle_set_injection_text(sid, data):
+    if sid not in authenticated_sids:
+        return
+    if await forward_to_client('receive_injection_text', {'text': data.get('text_to_inject', '')}):
+        await sio.emit('text_injection_set_ack', {'status': 'success'}, to=sid)
+    else:
+        await sio.emit('text_injection_set_ack', {'status': 'error', 'message': 'Remote PC not connected.'}, to=sid)
+
+@sio.on('update_client_settings')
+async def handle_update_settings(sid, data):
+    if sid not in authenticated_sids:
+        return
+    log_sampled('settings', logging.INFO, "Forwarding settings update to client: %s", data)
+    await forward_to_client('receive_settings_update', data)
+
+@sio.on('clipboard_from_browser')
+@sio.on('clipboard_from_browser', namespace=BULK_NAMESPACE)  # Chunked images and long text
+async def handle_clipboard_from_browser(sid, data):
+    if sid not in authenticated_sids or not isinstance(data, dict):
+        return
+    record_clipboard_event('to_pc', data)
+    await forward_to_client('set_clipboard', data, bulk=True)
+
+@sio.on('clipboard_from_client')
+async def handle_clipboard_from_client(sid, data):
+    if await safe_redis_get(CLIENT_REDIS_KEY) == sid:
+        record_clipboard_event('from_pc', data)
+        await send_clipboard_to_viewers(data)
+
+@sio.on('file_chunk')
+async def handle_file_chunk(sid, data):
+    if sid not in authenticated_sids:
+        return
+    if await forward_to_client('receive_file_chunk', data, bulk=True):
+        return {'status': 'ok'}
+    return {'status': 'error', 'message': 'Client not connected'}
+
+@sio.on('file_upload_complete')
+async def handle_file_upload_complete(sid, data):
+    if sid not in authenticated_sids:
+        return
+    await forward_to_client('file_transfer_complete', data, bulk=True)
+
+@sio.on('http_transfer_failed')
+async def handle_http_transfer_failed(sid, data):
+    if await safe_redis_get(CLIENT_REDIS_KEY) != sid:
+        return
+    entry = http_transfers.get(data.get('id'))
+    if entry:
+        logger.warning(f"Remote PC could not serve transfer {data.get('id')}: {data.get('message')}")
+        try:
+            await asyncio.wait_for(entry['queue'].put(IOError(data.get('message', 'Transfer failed'))), 1)
+        except asyncio.TimeoutError:
+            pass
+
+# --- Streaming HTTP File Transfer ---
+# Same bounded chunk relay as app.py, on asyncio queues and streamed aiohttp bodies.
+http_transfers = {}
+
+def create_http_transfer(name):
+    transfer_id = secrets.token_urlsafe(16)
+    http_transfers[transfer_id] = {
+        'name': name,
+        'size': None,
+        'queue': asyncio.Queue(maxsize=HTTP_TRANSFER_QUEUE_CHUNKS),
+        'finished': asyncio.Event()
+    }
+    return transfer_id
+
+def check_pc_token(request):
+    return request.headers.get('X-Access-Token') == ACCESS_PASSWORD
+
+async def relay_request_body(request, entry):
+    """Push the request body into a transfer queue, waiting while the reader is behind"""
+    relayed = 0
+    async for chunk in request.content.iter_chunked(HTTP_TRANSFER_CHUNK_SIZE):
+        await asyncio.wait_for(entry['queue'].put(chunk), HTTP_TRANSFER_TIMEOUT)
+        relayed += len(chunk)
+    await asyncio.wait_for(entry['queue'].put(None), HTTP_TRANSFER_TIMEOUT)
+    try:
+        await asyncio.wait_for(entry['finished'].wait(), HTTP_TRANSFER_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    return relayed
+
+async def stream_transfer_queue(request, entry, first_chunk=None):
+    """Stream a transfer queue as the response body until the end-of-stream marker (None) or an error marker"""
+    response = web.StreamResponse(headers=attachment_headers(entry))
+    response.content_type = 'application/octet-stream'
+    if entry['size'] is not None:
+        response.content_length = entry['size']
+    await response.prepare(request)
+    try:
+        chunk = first_chunk if first_chunk is not None else await asyncio.wait_for(entry['queue'].get(), HTTP_TRANSFER_TIMEOUT)
+        while chunk is not None and not isinstance(chunk, Exception):
+            await response.write(chunk)
+            chunk = await asyncio.wait_for(entry['queue'].get(), HTTP_TRANSFER_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Transfer of {entry['name']} stalled, closing stream")
+    finally:
+        entry['finished'].set()
+    await response.write_eof()
+    return response
+
+def attachment_headers(entry):
+    return {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(entry['name'])}"}
+
+@routes.put('/transfer/upload')
+async def transfer_upload(request):
+    """Browser -> PC: stream the request body to the PC as it pulls it"""
+    if not request_authenticated(request):
+        return not_authenticated()
+    name = os.path.basename(request.query.get('name', '').replace('\\', '/'))
+    if not name:
+        return web.json_response({'status': 'error', 'message': 'Missing file name'}, status=400)
+    transfer_id = create_http_transfer(name)
+    entry = http_transfers[transfer_id]
+    entry['size'] = request.content_length
+    try:
+        if not await forward_to_client('http_transfer_offer', {'id': transfer_id, 'name': name, 'size': entry['size']}):
+            return web.json_response({'status': 'error', 'message': 'Remote PC not connected.'}, status=503)
+        relayed = await relay_request_body(request, entry)
+        logger.info(f"Streamed upload {name} to remote PC ({relayed} bytes)")
+        return web.json_response({'status': 'ok', 'size': relayed})
+    except asyncio.TimeoutError:
+        logger.warning(f"Upload of {name} timed out waiting for the remote PC")
+        return web.json_response({'status': 'error', 'message': 'Remote PC stopped receiving.'}, status=504)
+    finally:
+        http_transfers.pop(transfer_id, None)
+
+@routes.get('/transfer/pull/{transfer_id}')
+async def transfer_pull(request):
+    """PC side of an upload: receives the bytes the browser is sending"""
+    if not check_pc_token(request):
+        return web.Response(status=401, text="Unauthorized")
+    entry = http_transfers.get(request.match_info['transfer_id'])
+    if not entry:
+        return web.Response(status=404, text="Unknown transfer")
+    return await stream_transfer_queue(request, entry)
+
+@routes.get('/transfer/download')
+async def transfer_download(request):
+    """PC -> Browser: ask the PC to push a file and stream it back as it arrives"""
+    if not request_authenticated(request):
+        raise web.HTTPFound(url_for('index'))
+    path = request.query.get('path', '')
+    name = os.path.basename(path.replace('\\', '/'))
+    if not name:
+        return web.Response(status=400, text="Missing file path")
+    transfer_id = create_http_transfer(name)
+    entry = http_transfers[transfer_id]
+    if not await forward_to_client('http_transfer_request', {'id': transfer_id, 'path': path}):
+        http_transfers.pop(transfer_id, None)
+        return web.Response(status=503, text="Remote PC not connected.")
+    try:
+        first_chunk = await asyncio.wait_for(entry['queue'].get(), HTTP_TRANSFER_TIMEOUT)
+    except asyncio.TimeoutError:
+        http_transfers.pop(transfer_id, None)
+        return web.Response(status=504, text="Remote PC did not respond.")
+    if isinstance(first_chunk, Exception):
+        http_transfers.pop(transfer_id, None)
+        return web.Response(status=404, text=f"Remote PC could not read file: {first_chunk}")
+    if first_chunk is None:
+        entry['finished'].set()
+        return web.Response(body=b'', content_type='application/octet-stream', headers=attachment_headers(entry))
+    # The push request drops the entry once the streamed body below has drained it
+    return await stream_transfer_queue(request, entry, first_chunk)
+
+@routes.post('/transfer/push/{transfer_id}')
+async def transfer_push(request):
+    """PC side of a download: sends the bytes the browser is waiting for"""
+    if not check_pc_token(request):
+        return web.Response(status=401, text="Unauthorized")
+    transfer_id = request.match_info['transfer_id']
+    entry = http_transfers.get(transfer_id)
+    if not entry:
+        return web.Response(status=404, text="Unknown transfer")
+    entry['size'] = request.content_length
+    try:
+        relayed = await relay_request_body(request, entry)
+        logger.info(f"Streamed download {entry['name']} to browser ({relayed} bytes)")
+        return web.json_response({'status': 'ok', 'size': relayed})
+    except asyncio.TimeoutError:
+        logger.warning(f"Download of {entry['name']} timed out waiting for the browser")
+        return web.json_response({'status': 'error', 'message': 'Browser stopped receiving.'}, status=504)
+    finally:
+        http_transfers.pop(transfer_id, None)
+
+async def mark_response_prepared(request, response):
+    request['response_prepared'] = True
+
+@web.middleware
+async def handle_exception(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        if request.get('response_prepared'):
+            # WebSockets and streamed transfers have already sent their headers; let aiohttp log it and close the connection
+            raise
+        logger.error(f"Unhandled exception: {e}")
+        return web.Response(status=500, text="Internal Server Error")
+
+# --- Startup ---
+async def on_startup(app):
+    try:
+        await redis_client.ping()
+        logger.info("Successfully connected to Redis at startup.")
+    except Exception as e:
+        logger.critical(f"FATAL: Could not connect to Redis at startup: {e}")
+        raise SystemExit(1)
+    app['health_check'] = asyncio.create_task(redis_health_check())
+
+async def on_cleanup(app):
+    app['health_check'].cancel()
+    await stop_session_recording()
+    await redis_client.close()
+
+app.middlewares.append(handle_exception)
+app.on_response_prepare.append(mark_response_prepared)
+app.add_routes(routes)
+app.on_startup.append(on_startup)
+app.on_cleanup.append(on_cleanup)
+build_viewer_assets()
+
+if __name__ == '__main__':
+    logger.info("--- 🤖 AI-Enhanced Remote Server Starting (asyncio) ---")
+    port = int(os.environ.get('PORT', 5000))
+    host = '0.0.0.0'
+    logger.info(f"Listening on http://{host}:{port}")
+    logger.info(f"Using Redis at {REDIS_URL}")
+    logger.info(f"🔐 Login password: {ACCESS_PASSWORD}")
+
+    if ANTHROPIC_API_KEY:
+        logger.info("✅ Claude AI integration enabled")
+    else:
+        logger.warning("⚠️  ANTHROPIC_API_KEY not set - AI features will be disabled")
+
+    web.run_app(app, host=host, port=port, print=None)
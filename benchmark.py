@@ -0,0 +1,241 @@
+"""Headless benchmark for the client capture hot path (convert, diff, encode).
+
+Generates deterministic synthetic desktops and runs them through the same steps as
+screen_capture_loop: Image.frombytes on raw RGB, a change check against the previous
+frame, and JPEG encoding. Needs only numpy and Pillow, so it runs on any Linux box.
+
+    python benchmark.py                              # run and print results
+    python benchmark.py --save-baseline base.json    # record a baseline
+    python benchmark.py --baseline base.json         # compare, exit 1 on regression
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageChops
+
+# --- Configuration ---
+DEFAULT_RESOLUTIONS = ['1280x720', '1920x1080', '2560x1440']
+DEFAULT_FRAMES = 30             # Frames per workload/strategy/resolution case
+DEFAULT_REPEATS = 3             # Runs per case; the fastest is kept to filter out scheduler noise
+FPS_REGRESSION_TOLERANCE = 0.15   # Fraction of baseline frames/s that may be lost before flagging
+BYTES_REGRESSION_TOLERANCE = 0.05  # Fraction of baseline bytes/frame that may be gained before flagging
+FRAME_DIFFERENCE_THRESHOLD = 0  # Same default as the client
+GLYPH_WIDTH, GLYPH_HEIGHT = 8, 16
+
+# --- Synthetic Desktops ---
+def make_glyphs(rng, count=96):
+    """Random 8x16 bitmaps standing in for font glyphs"""
+    return rng.random((count, GLYPH_HEIGHT, GLYPH_WIDTH)) < 0.35
+
+def draw_text_row(canvas, glyphs, rng, x, y, width, color=(220, 220, 220)):
+    for gx in range(x, x + width - GLYPH_WIDTH, GLYPH_WIDTH):
+        if rng.random() < 0.15:
+            continue  # Word gap
+        glyph = glyphs[rng.integers(len(glyphs))]
+        canvas[y:y + GLYPH_HEIGHT, gx:gx + GLYPH_WIDTH][glyph] = color
+
+def make_desktop(width, height, seed):
+    """A desktop with a wallpaper gradient, a taskbar and a few text-filled windows"""
+    rng = np.random.default_rng(seed)
+    glyphs = make_glyphs(rng)
+    desktop = np.zeros((height, width, 3), dtype=np.uint8)
+    desktop[..., 0] = np.linspace(20, 60, width, dtype=np.uint8)[None, :]
+    desktop[..., 1] = np.linspace(40, 90, height, dtype=np.uint8)[:, None]
+    desktop[..., 2] = 120
+    desktop[-40:] = (30, 30, 30)
+    for _ in range(3):
+        w, h = int(width * rng.uniform(0.3, 0.6)), int(height * rng.uniform(0.3, 0.6))
+        x, y = int(rng.integers(0, width - w)), int(rng.integers(0, height - 40 - h))
+        desktop[y:y + h, x:x + w] = (250, 250, 250)
+        desktop[y:y + 24, x:x + w] = (60, 90, 160)
+        for row in range(y + 32, y + h - GLYPH_HEIGHT, GLYPH_HEIGHT + 4):
+            draw_text_row(desktop, glyphs, rng, x + 8, row, w - 16, color=(20, 20, 20))
+    return desktop
+
+def static_screen(width, height, frames):
+    desktop = make_desktop(width, height, seed=1)
+    for _ in range(frames):
+        yield desktop
+
+def typing_terminal(width, height, frames):
+    """A terminal window where one character appears per frame"""
+    rng = np.random.default_rng(2)
+    glyphs = make_glyphs(rng)
+    desktop = make_desktop(width, height, seed=2)
+    left, top, columns = width // 8, height // 8, (width * 3 // 4) // GLYPH_WIDTH
+    desktop[top:top + height // 2, left:left + columns * GLYPH_WIDTH] = (12, 12, 12)
+    for index in range(frames):
+        row, column = divmod(index, columns)
+        x, y = left + column * GLYPH_WIDTH, top + (row % 8) * GLYPH_HEIGHT
+        desktop[y:y + GLYPH_HEIGHT, x:x + GLYPH_WIDTH][glyphs[rng.integers(len(glyphs))]] = (80, 250, 80)
+        yield desktop
+
+def scrolling_text(width, height, frames):
+    """A document scrolling up by one text line per frame"""
+    rng = np.random.default_rng(3)
+    glyphs = make_glyphs(rng)
+    desktop = make_desktop(width, height, seed=3)
+    left, top, right, bottom = width // 10, 60, width * 9 // 10, height - 60
+    page = np.full((bottom - top, right - left, 3), 255, dtype=np.uint8)
+    for y in range(0, page.shape[0] - GLYPH_HEIGHT, GLYPH_HEIGHT):
+        draw_text_row(page, glyphs, rng, 8, y, page.shape[1] - 16, color=(0, 0, 0))
+    for _ in range(frames):
+        page = np.roll(page, -GLYPH_HEIGHT, axis=0)
+        page[-GLYPH_HEIGHT:] = 255
+        draw_text_row(page, glyphs, rng, 8, page.shape[0] - GLYPH_HEIGHT, page.shape[1] - 16, color=(0, 0, 0))
+        desktop[top:bottom, left:right] = page
+        yield desktop
+
+def video_region(width, height, frames):
+    """A static desktop with a moving-picture region about a quarter of the screen"""
+    rng = np.random.default_rng(4)
+    desktop = make_desktop(width, height, seed=4)
+    w, h = width // 2, height // 2
+    x, y = width // 4, height // 4
+    yy, xx = np.mgrid[0:h, 0:w]
+    for index in range(frames):
+        # Smooth moving gradients plus grain compress like real video, unlike pure noise
+        desktop[y:y + h, x:x + w, 0] = ((xx + index * 7) % 256).astype(np.uint8)
+        desktop[y:y + h, x:x + w, 1] = ((yy + index * 5) % 256).astype(np.uint8)
+        desktop[y:y + h, x:x + w, 2] = rng.integers(0, 40, (h, w), dtype=np.uint8) + 100
+        yield desktop
+
+def window_switches(width, height, frames):
+    """Alternating between completely different full-screen applications"""
+    desktops = [make_desktop(width, height, seed=seed) for seed in (5, 6, 7)]
+    for index in range(frames):
+        yield desktops[index % len(desktops)]
+
+WORKLOADS = {
+    'static': static_screen,
+    'typing': typing_terminal,
+    'scrolling': scrolling_text,
+    'video': video_region,
+    'window_switch': window_switches,
+}
+
+# --- Strategies ---
+def diff_chops_mean(current, previous):
+    """What the client does today: full difference image, then its mean"""
+    return np.mean(np.array(ImageChops.difference(current, previous))) > FRAME_DIFFERENCE_THRESHOLD
+
+def diff_bytes_equal(current, previous):
+    """Exact comparison of the raw pixel buffers"""
+    return current.tobytes() != previous.tobytes()
+
+def encode_jpeg(quality, scale=1.0):
+    def encode(image):
+        if scale != 1.0:
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        return buffer.tell()
+    return encode
+
+STRATEGIES = {
+    'chops-mean+jpeg75': (diff_chops_mean, encode_jpeg(75)),
+    'bytes-equal+jpeg75': (diff_bytes_equal, encode_jpeg(75)),
+    'chops-mean+jpeg40-half': (diff_chops_mean, encode_jpeg(40, scale=0.5)),
+}
+
+# --- Runner ---
+def run_case(workload, strategy, width, height, frames, repeats=DEFAULT_REPEATS):
+    # Raw frames are produced up front so generating them is not part of the measurement
+    raw_frames = [frame.tobytes() for frame in WORKLOADS[workload](width, height, frames)]
+    STRATEGIES[strategy][1](Image.frombytes("RGB", (width, height), raw_frames[0]))  # Warm up the encoder
+    runs = [measure(raw_frames, strategy, width, height) for _ in range(max(1, repeats))]
+    result = max(runs, key=lambda run: run['fps'])
+    # Memory is traced in a separate pass because tracemalloc slows allocation-heavy code down
+    tracemalloc.start()
+    measure(raw_frames, strategy, width, height)
+    # tracemalloc sees Python and numpy allocations; Pillow's internal buffers are not included
+    result['peak_traced_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+    return result
+
+def measure(raw_frames, strategy, width, height):
+    diff, encode = STRATEGIES[strategy]
+    stage_ms = {'convert': 0.0, 'diff': 0.0, 'encode': 0.0}
+    sent_frames = sent_bytes = 0
+    previous = None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for raw in raw_frames:
+        stage_start = time.perf_counter()
+        current = Image.frombytes("RGB", (width, height), raw)
+        stage_ms['convert'] += (time.perf_counter() - stage_start) * 1000
+        stage_start = time.perf_counter()
+        changed = previous is None or diff(current, previous)
+        stage_ms['diff'] += (time.perf_counter() - stage_start) * 1000
+        if changed:
+            stage_start = time.perf_counter()
+            sent_bytes += encode(current)
+            stage_ms['encode'] += (time.perf_counter() - stage_start) * 1000
+            sent_frames += 1
+        previous = current
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    return {
+        'fps': round(len(raw_frames) / wall, 2),
+        'cpu_ms_per_frame': round(cpu * 1000 / len(raw_frames), 3),
+        'bytes_per_sent_frame': sent_bytes // sent_frames if sent_frames else 0,
+        'sent_frames': sent_frames,
+        'stage_ms_per_frame': {stage: round(ms / len(raw_frames), 3) for stage, ms in stage_ms.items()},
+    }
+
+def compare_to_baseline(results, baseline):
+    """Return human-readable regressions of results against a saved baseline"""
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        if result['fps'] < before['fps'] * (1 - FPS_REGRESSION_TOLERANCE):
+            regressions.append(f"{key}: {result['fps']} fps vs baseline {before['fps']}")
+        if result['bytes_per_sent_frame'] > before['bytes_per_sent_frame'] * (1 + BYTES_REGRESSION_TOLERANCE):
+            regressions.append(f"{key}: {result['bytes_per_sent_frame']} bytes/frame vs baseline {before['bytes_per_sent_frame']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS, help="WIDTHxHEIGHT values")
+    parser.add_argument('--workloads', nargs='+', default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES)
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--baseline', help="JSON results to compare against; exits 1 on regression")
+    parser.add_argument('--save-baseline', help="Write these results as JSON for later comparison")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':<48} {'fps':>8} {'cpu ms':>8} {'conv':>7} {'diff':>7} {'enc':>7} {'KB/frame':>9} {'sent':>5} {'peak KB':>8}")
+    for resolution in args.resolutions:
+        width, height = (int(value) for value in resolution.lower().split('x'))
+        for workload in args.workloads:
+            for strategy in args.strategies:
+                key = f"{resolution}/{workload}/{strategy}"
+                result = run_case(workload, strategy, width, height, args.frames, args.repeats)
+                results[key] = result
+                stages = result['stage_ms_per_frame']
+                print(f"{key:<48} {result['fps']:>8.1f} {result['cpu_ms_per_frame']:>8.2f} {stages['convert']:>7.2f} {stages['diff']:>7.2f} {stages['encode']:>7.2f} "
+                      f"{result['bytes_per_sent_frame'] / 1024:>9.1f} {result['sent_frames']:>5} {result['peak_traced_memory_kb']:>8}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f))
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -4,15 +4,52 @@ import os
 import io
 import threading
 import logging
+import logging.handlers
+import queue
+import atexit
 import platform
 import sys
+import ctypes
+import ctypes.util
+import select
 import mss
 import keyboard
 import numpy as np
 import pyperclip
 import base64
+import hashlib
+import json
 import re
-from PIL import Image, ImageChops
+import random
+import struct
+import zlib
+import bisect
+import csv
+from collections import deque
+import shutil
+import subprocess
+import urllib.request
+from fractions import Fraction
+from PIL import Image, ImageChops, ImageGrab
+
+# Optional video encoding support (PyAV bundles libx264/libvpx)
+try:
+    import av
+    VIDEO_AVAILABLE = True
+except ImportError:
+    VIDEO_AVAILABLE = False
+
+# Optional libjpeg-turbo JPEG encoding (pip install PyTurboJPEG; needs the libturbojpeg library)
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_BGRA, TJSAMP_444, TJSAMP_422, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+# Optional binary frame fast path (websocket-client, also used by python-socketio's websocket transport)
+try:
+    import websocket
+except ImportError:
+    websocket = None
 
 if platform.system() == "Windows":
     import ctypes
@@ -21,17 +58,39 @@ if platform.system() == "Windows":
     KEYEVENTF_KEYUP, KEYEVENTF_UNICODE = 0x0002, 0x0004
     MOUSEEVENTF_MOVE, MOUSEEVENTF_ABSOLUTE, MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP, MOUSEEVENTF_RIGHTDOWN, MOUSEEVENTF_RIGHTUP, MOUSEEVENTF_WHEEL = 0x0001, 0x8000, 0x0002, 0x0004, 0x0008, 0x0010, 0x0800
     WHEEL_DELTA, SM_CXSCREEN, SM_CYSCREEN = 120, 0, 1
+    MOUSEEVENTF_VIRTUALDESK, SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN = 0x4000, 76, 77, 78, 79
     ULONG_PTR = ctypes.POINTER(wintypes.ULONG)
     class MOUSEINPUT(ctypes.Structure): _fields_ = (("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD), ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ULONG_PTR))
     class KEYBDINPUT(ctypes.Structure): _fields_ = (("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ULONG_PTR))
     class _INPUT_UNION(ctypes.Union): _fields_ = (("mi", MOUSEINPUT), ("ki", KEYBDINPUT))
     class INPUT(ctypes.Structure): _fields_ = (("type", wintypes.DWORD), ("union", _INPUT_UNION))
     SendInput, GetSystemMetrics = ctypes.windll.user32.SendInput, ctypes.windll.user32.GetSystemMetrics
+    GetClipboardSequenceNumber = ctypes.windll.user32.GetClipboardSequenceNumber
+    CF_DIB, GMEM_MOVEABLE = 8, 0x0002
+    ctypes.windll.kernel32.GlobalAlloc.restype = ctypes.windll.kernel32.GlobalLock.restype = ctypes.c_void_p
+    ctypes.windll.kernel32.GlobalLock.argtypes = ctypes.windll.kernel32.GlobalUnlock.argtypes = (ctypes.c_void_p,)
+    ctypes.windll.user32.SetClipboardData.argtypes = (wintypes.UINT, ctypes.c_void_p)
+    def set_clipboard_dib(dib):
+        # The clipboard owns the memory once SetClipboardData succeeds
+        handle = ctypes.windll.kernel32.GlobalAlloc(GMEM_MOVEABLE, len(dib))
+        ctypes.memmove(ctypes.windll.kernel32.GlobalLock(handle), dib, len(dib))
+        ctypes.windll.kernel32.GlobalUnlock(handle)
+        if not ctypes.windll.user32.OpenClipboard(None):
+            raise OSError("the clipboard is in use by another application")
+        try:
+            ctypes.windll.user32.EmptyClipboard()
+            if not ctypes.windll.user32.SetClipboardData(CF_DIB, handle):
+                raise ctypes.WinError()
+        finally:
+            ctypes.windll.user32.CloseClipboard()
     def _create_input(input_type, input_union): inp = INPUT(); inp.type, inp.union = wintypes.DWORD(input_type), input_union; return inp
     def _send_inputs(inputs): return SendInput(len(inputs), (INPUT * len(inputs))(*inputs), ctypes.sizeof(INPUT))
     def press_key_ctypes(vk_code): _send_inputs([_create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=KEYBDINPUT(wVk=vk_code)))])
     def release_key_ctypes(vk_code): _send_inputs([_create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=KEYBDINPUT(wVk=vk_code, dwFlags=KEYEVENTF_KEYUP)))])
-    def move_mouse_ctypes(x, y): _send_inputs([_create_input(INPUT_MOUSE, _INPUT_UNION(mi=MOUSEINPUT(dx=int(x*65535/GetSystemMetrics(SM_CXSCREEN)), dy=int(y*65535/GetSystemMetrics(SM_CYSCREEN)), dwFlags=MOUSEEVENTF_MOVE|MOUSEEVENTF_ABSOLUTE)))])
+    def move_mouse_ctypes(x, y):
+        # x, y are desktop coordinates; normalise against the virtual screen so every monitor is reachable
+        vx, vy, vw, vh = (GetSystemMetrics(m) for m in (SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN))
+        _send_inputs([_create_input(INPUT_MOUSE, _INPUT_UNION(mi=MOUSEINPUT(dx=int((x-vx)*65535/max(vw-1, 1)), dy=int((y-vy)*65535/max(vh-1, 1)), dwFlags=MOUSEEVENTF_MOVE|MOUSEEVENTF_ABSOLUTE|MOUSEEVENTF_VIRTUALDESK)))])
     def click_mouse_ctypes(button='left'): down, up = (MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP) if button=='left' else (MOUSEEVENTF_RIGHTDOWN, MOUSEEVENTF_RIGHTUP); _send_inputs([_create_input(INPUT_MOUSE, _INPUT_UNION(mi=MOUSEINPUT(dwFlags=d))) for d in [down, up]])
     def scroll_mouse_ctypes(amount): _send_inputs([_create_input(INPUT_MOUSE, _INPUT_UNION(mi=MOUSEINPUT(mouseData=int(amount * -WHEEL_DELTA), dwFlags=MOUSEEVENTF_WHEEL)))])
     CTYPES_VK_MAP = {'backspace': 8, 'tab': 9, 'enter': 13, 'shift': 16, 'ctrl': 17, 'alt': 18, 'capslock': 20, 'esc': 27, 'space': 32, 'pageup': 33, 'pagedown': 34, 'end': 35, 'home': 36, 'left': 37, 'up': 38, 'right': 39, 'down': 40, 'insert': 45, 'delete': 46, '0': 48, '1': 49, '2': 50, '3': 51, '4': 52, '5': 53, '6': 54, '7': 55, '8': 56, '9': 57, 'a': 65, 'b': 66, 'c': 67, 'd': 68, 'e': 69, 'f': 70, 'g': 71, 'h': 72, 'i': 73, 'j': 74, 'k': 75, 'l': 76, 'm': 77, 'n': 78, 'o': 79, 'p': 80, 'q': 81, 'r': 82, 's': 83, 't': 84, 'u': 85, 'v': 86, 'w': 87, 'x': 88, 'y': 89, 'z': 90, 'win': 91, 'f1': 112, 'f2': 113, 'f3': 114, 'f4': 115, 'f5': 116, 'f6': 117, 'f7': 118, 'f8': 119, 'f9': 120, 'f10': 121, 'f11': 122, 'f12': 123}
@@ -42,26 +101,152 @@ else:
     def move_mouse_ctypes(x, y): pass
     def click_mouse_ctypes(button='left'): pass
     def scroll_mouse_ctypes(amount): pass
+    GetClipboardSequenceNumber = None
+    set_clipboard_dib = None
     CTYPES_VK_MAP = {}
 
+# Log records go through a bounded queue to a background writer thread, so a slow console never
+# stalls capture or input; when the queue is full, new records are dropped and counted.
+# Hot paths (frames, input, chunks, settings) log through log_sampled() to stay rate-limited.
+LOG_JSON = os.environ.get('LOG_JSON') == '1'  # Emit one JSON object per line instead of plain text
+LOG_QUEUE_SIZE = 10000  # Records buffered for the writer before new ones are dropped
+LOG_SAMPLE_INTERVAL = 5  # Seconds between repeats of the same rate-limited message
 log_format = '%(asctime)s - %(threadName)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-logging.basicConfig(level=logging.INFO, format=log_format, stream=sys.stdout)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'thread': record.threadName, 'where': f"{record.filename}:{record.lineno}", 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+log_writer = logging.StreamHandler(sys.stdout)
+log_writer.setFormatter(JsonLogFormatter() if LOG_JSON else logging.Formatter(log_format))
+log_queue_handler = DroppingQueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Only merges args (and tracebacks) before queueing
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler], force=True)
+log_listener = logging.handlers.QueueListener(log_queue, log_writer)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
+log_sample_state = {}  # Key -> (last logged at, repeats suppressed since)
+
+def log_sampled(key, level, message, *args):
+    """Log at most once per LOG_SAMPLE_INTERVAL for key, noting how many repeats were suppressed"""
+    now = time.monotonic()
+    last_logged, suppressed = log_sample_state.get(key, (None, 0))
+    if last_logged is not None and now - last_logged < LOG_SAMPLE_INTERVAL:
+        log_sample_state[key] = (last_logged, suppressed + 1)
+        return
+    log_sample_state[key] = (now, 0)
+    if suppressed:
+        message, args = message + " (%d similar suppressed)", args + (suppressed,)
+    logger.log(level, message, *args, stacklevel=2)
 
 # --- HARDCODED Configuration ---
 SERVER_URL = 'https://gggggggggggggggggggggggggggggggggggggggg-htmy.onrender.com'  # CHANGE THIS TO YOUR RENDER URL
 ACCESS_PASSWORD = 'mypassword123'  # Must match server password
-CAPTURE_MONITOR_INDEX = 3  # Monitor to capture (3 = primary)
+CAPTURE_MONITOR_INDEX = 3  # Monitor streamed by default and used for AI screenshots (3 = primary)
 CLIENT_TARGET_FPS = 5      # Screenshots per second
 JPEG_QUALITY = 75          # Screenshot quality (10-95)
+JPEG_ENCODER = 'auto'      # 'auto' times the available encoders at startup and keeps the fastest; or 'pillow', 'turbojpeg'
+JPEG_SUBSAMPLING = '4:2:0'  # Chroma subsampling: '4:2:0' (smallest), '4:2:2', or '4:4:4' (sharpest coloured text)
+JPEG_OPTIMIZE = False      # Optimised Huffman tables: a few percent smaller, slower to encode (Pillow only)
 FRAME_DIFFERENCE_THRESHOLD = 0  # Sensitivity for detecting screen changes
+STREAM_CODEC = 'jpeg'      # 'jpeg', or 'h264'/'vp8' for video mode (needs: pip install av)
+VIDEO_BITRATE = 2_000_000  # Target bits per second in video mode
+VIDEO_KEYFRAME_INTERVAL = 100  # Frames between keyframes in video mode
+ROI_JPEG_QUALITY = 90      # Quality of the region a viewer has zoomed into (captured at native resolution)
+ROI_BACKGROUND_FPS = 1     # Full-screen refreshes per second while a region is zoomed (0 pauses them)
+ROI_BACKGROUND_QUALITY = 40  # Full-screen quality while a region is zoomed
+ROI_MIN_SIZE = 32          # Smallest region edge in pixels
+SIMULCAST_LAYERS = [       # JPEG encodings of every full frame; the server picks one per viewer and asks only for layers in use
+    {'scale': 1.0, 'quality': None},  # Full resolution at the stream's quality setting
+    {'scale': 0.5, 'quality': 40},    # Half resolution, low quality for slow viewers
+]
+FRAME_SLICE_MIN_PIXELS = 2560 * 1440  # Frame layers this large are sent as horizontal slices that viewers paint as they arrive
+FRAME_SLICES = 8           # Slices per sliced layer, each an independently decodable JPEG
+HTTP_TRANSFER_CHUNK_SIZE = 64 * 1024  # Read/write block size for streamed file transfers
+HTTP_TRANSFER_TIMEOUT = 60  # Seconds of silence before a streamed transfer is abandoned
+INPUT_STAMP_MAX_AGE = 5  # Seconds an applied input waits for a changed frame before it is dropped
+CLIPBOARD_POLL_MIN_INTERVAL = 0.1  # Seconds between clipboard checks right after a change
+CLIPBOARD_POLL_MAX_INTERVAL = 0.7  # Idle polling backs off to this when the OS gives no change counter (plus the debounce, still within 1 s)
+CLIPBOARD_DEBOUNCE = 0.3           # Clipboard must be stable this long before it is sent
+CLIPBOARD_CHUNK_SIZE = 256 * 1024  # Larger clipboard payloads are split into chunks of this size
+CLIPBOARD_MAX_BYTES = 8 * 1024 * 1024  # Clipboard content above this size is not synced
+BULK_NAMESPACE = '/bulk'  # Second connection carrying frames and clipboard, kept apart from input/control
+MAX_FRAMES_IN_FLIGHT = 2  # Unacknowledged pictures allowed on the bulk lane before capture waits (a sliced frame is one picture)
+FRAME_ACK_TIMEOUT = 2     # Seconds to wait for a frame slot before assuming acks were lost
+FRAME_SOCKET_ENABLED = True  # Send frames over the server's raw binary WebSocket when websocket-client is installed
+FRAME_SOCKET_PATH = '/ws/frames/pc'
+CAPTURE_STATS_INTERVAL = 5   # Seconds between capture pipeline timing reports to the server
+CAPTURE_STATS_WINDOW = 300   # Recent frames per monitor used for the rolling percentiles
+CAPTURE_STATS_CSV = None     # Path of a CSV file to append per-frame stage timings to, or None
+RECONNECT_DELAY_MIN = 0.05   # Seconds; reconnect attempts back off exponentially from here, with full jitter
+RECONNECT_DELAY_MAX = 5      # Longest wait between reconnect attempts
+CAPTURE_SOURCE = 'mss'       # 'mss' grabs the screen, 'record' grabs and saves raw frames, 'replay' plays a recording back,
+                             # 'xdamage' grabs only what X11 reports as changed (Linux; falls back to 'mss' elsewhere)
+CAPTURE_RECORDING_PATH = 'capture.rdcap'  # File written by 'record' and read by 'replay'
+CAPTURE_REPLAY_SPEED = 1.0   # Replay pace relative to the recording (2.0 = twice as fast, 0 = every frame, no waiting)
+DAMAGE_IDLE_WAIT = 0.5       # Seconds an 'xdamage' capture thread sleeps waiting for changes before rechecking its state
+DAMAGE_MAX_RECTS = 8         # More damaged rectangles than this in one frame are merged into their bounding box
+DAMAGE_FULL_FRAME_RATIO = 0.4  # Damage covering more than this fraction of the monitor is sent as a full frame
+DAMAGE_ALIGN = 16            # Damaged rectangles are widened to this pixel grid so JPEG blocks line up at their edges
+CPU_BUDGET_PERCENT = 0       # CPU the client may use, in percent of one core (50 = half a core); 0 disables the governor
+CPU_BUDGET_INTERVAL = 2      # Seconds of process CPU time averaged per governor decision
+CPU_BUDGET_RELEASE = 0.6     # The governor eases off once usage falls below this fraction of the budget
+CPU_BUDGET_STEPS = [         # Throttle levels, mildest first: frame rate, resolution and JPEG quality multipliers/caps
+    {'fps': 1.0, 'scale': 1.0, 'quality': None},   # Unthrottled
+    {'fps': 0.5, 'scale': 1.0, 'quality': None},
+    {'fps': 0.5, 'scale': 0.75, 'quality': None},
+    {'fps': 0.25, 'scale': 0.5, 'quality': 50},
+]
 
-sio = socketio.Client(reconnection_attempts=100, reconnection_delay=5, logger=False, engineio_logger=False)
+# Reconnects are driven by main() and connect_bulk_lane() with jittered backoff, not by python-socketio
+sio = socketio.Client(reconnection=False, logger=False, engineio_logger=False)
+bulk_sio = socketio.Client(reconnection=False, logger=False, engineio_logger=False)
+bulk_lane_ready = False
+resume_token = None  # Issued by the server at registration; lets a reconnect resume the same session
+session_ready = threading.Event()  # Set while registered; capture and clipboard hold their state and wait while it is clear
+connection_lost = threading.Event()
+worker_threads_started = False
+available_monitors = []  # mss monitor definitions; index 0 is the combined virtual screen
+watched_monitor_indices = [CAPTURE_MONITOR_INDEX]  # Monitors viewers are watching; only these are captured
+viewers_watching = False  # Nothing is captured until the server reports a viewer
+monitor_streams = {}  # Monitor index -> capture stream state (stop/keyframe events, fps, quality, zoomed region)
+monitor_streams_lock = threading.Lock()
+monitor_rois = {}  # Monitor index -> zoomed region the server last asked for; kept for streams that start later
+monitor_layers = {}  # Monitor index -> SIMULCAST_LAYERS indices viewers receive; every layer is encoded until the server says
+frame_socket = None  # Binary fast-path connection for screen frames, None when unavailable
+CAPTURE_STAGES = ('grab', 'convert', 'diff', 'encode', 'send')
+capture_stats = {}  # Monitor index -> stage name (plus 'bytes') -> recent samples
+capture_stats_lock = threading.Lock()
+cpu_throttle_level = 0  # Index into CPU_BUDGET_STEPS chosen by the CPU governor
+cpu_usage_percent = None  # Process CPU use over the last governor interval, in percent of one core
+capture_stats_csv = None  # (file, csv writer) while CAPTURE_STATS_CSV is being written
+capture_recorder = None  # Shared CaptureRecorder while CAPTURE_SOURCE is 'record'
+capture_recorder_lock = threading.Lock()
+frames_in_flight = 0
+frame_flow = threading.Condition()
 is_registered = False
 all_threads_stop_event = threading.Event()
 selected_monitor_details = None
 text_to_inject_globally = ""
 current_file_handle = None
+last_clipboard_hash = None  # Hash of the clipboard content last sent or set by the server
+incoming_clipboard = None  # Chunked clipboard content from a viewer being reassembled: {'id', 'parts'}
+applied_input_stamps = []  # (input_id, applied_at) awaiting the next frame sent
+input_stamps_lock = threading.Lock()
 downloads_path = os.path.join(os.path.expanduser('~'), 'Downloads')
 
 # AI-related variables
@@ -72,6 +257,12 @@ ai_answer_type = None
 if not os.path.exists(downloads_path):
     os.makedirs(downloads_path)
 
+# Video mode: codec name -> (PyAV encoder, WebCodecs codec string, encoder options)
+VIDEO_CODECS = {
+    'h264': ('libx264', 'avc1.42E033', {'preset': 'ultrafast', 'tune': 'zerolatency', 'profile': 'baseline'}),
+    'vp8': ('libvpx', 'vp8', {'deadline': 'realtime', 'cpu-used': '8', 'lag-in-frames': '0'}),
+}
+
 KEY_MAP_JS_TO_CTYPES = {"Control": "ctrl", "Shift": "shift", "Alt": "alt", "Meta": "win", "ArrowUp": "up", "ArrowDown": "down", "ArrowLeft": "left", "ArrowRight": "right", "Enter": "enter", "Escape": "esc", "Backspace": "backspace", "Delete": "delete", "Tab": "tab", " ": "space", "F1": "f1", "F2": "f2", "F3": "f3", "F4": "f4", "F5": "f5", "F6": "f6", "F7": "f7", "F8": "f8", "F9": "f9", "F10": "f10", "F11": "f11", "F12": "f12"}
 
 def map_key_name(js_key):
@@ -80,7 +271,7 @@ def map_key_name(js_key):
 def capture_screenshot_for_ai():
     """Capture screenshot and send to server for AI analysis"""
     try:
-        with mss.mss() as sct:
+        with create_capture_source() as sct:
             if selected_monitor_details:
                 sct_img = sct.grab(selected_monitor_details)
                 screenshot = Image.frombytes("RGB", sct_img.size, sct_img.rgb)
@@ -172,65 +363,1117 @@ def auto_click_answer(answer):
         logger.warning(f"❌ Could not find coordinates for answer: {answer}")
         return False
 
-def screen_capture_loop():
-    global selected_monitor_details, CLIENT_TARGET_FPS, JPEG_QUALITY, FRAME_DIFFERENCE_THRESHOLD
-    logger.info(f"📸 CAPTURE_THREAD: Starting. FPS:{CLIENT_TARGET_FPS}, Quality:{JPEG_QUALITY}, Monitor:{CAPTURE_MONITOR_INDEX}")
+def record_applied_inputs(input_ids):
+    applied_at = time.time()
+    with input_stamps_lock:
+        applied_input_stamps.extend((input_id, applied_at) for input_id in input_ids)
+
+def take_applied_inputs(captured_at):
+    """Return IDs of inputs applied before this frame was grabbed, so the frame can be tagged with them"""
+    with input_stamps_lock:
+        if not applied_input_stamps:
+            return []
+        ready = [input_id for input_id, applied_at in applied_input_stamps
+                 if applied_at <= captured_at and captured_at - applied_at < INPUT_STAMP_MAX_AGE]
+        applied_input_stamps[:] = [stamp for stamp in applied_input_stamps if stamp[1] > captured_at]
+        return ready
+
+def on_frame_ack(*args):
+    global frames_in_flight
+    with frame_flow:
+        frames_in_flight = max(0, frames_in_flight - 1)
+        frame_flow.notify()
+
+def wait_for_frame_slot():
+    """Block until the bulk lane has room, so frames never pile up ahead of control traffic"""
+    global frames_in_flight
+    with frame_flow:
+        if not frame_flow.wait_for(lambda: frames_in_flight < MAX_FRAMES_IN_FLIGHT, FRAME_ACK_TIMEOUT):
+            log_sampled('frame_acks', logging.WARNING, "📸 CAPTURE_THREAD: Frame acks overdue, resetting bulk lane flow control")
+            frames_in_flight = 0
+
+def send_bulk(event, data, flow_controlled=False, starts_picture=True, ends_picture=True):
+    """Emit on the bulk lane when it is up, otherwise fall back to the control connection.
+    Flow control counts pictures: a picture's first message waits for a slot and the ack of its last frees it."""
+    global frames_in_flight
+    if not bulk_lane_ready:
+        sio.emit(event, data)
+        return
+    if flow_controlled:
+        if starts_picture:
+            wait_for_frame_slot()
+            with frame_flow:
+                frames_in_flight += 1
+        bulk_sio.emit(event, data, namespace=BULK_NAMESPACE, callback=on_frame_ack if ends_picture else None)
+    else:
+        bulk_sio.emit(event, data, namespace=BULK_NAMESPACE)
+
+def backoff_delays():
+    """Full-jitter exponential backoff: each delay is random up to RECONNECT_DELAY_MIN * 2^attempt, capped"""
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(RECONNECT_DELAY_MAX, RECONNECT_DELAY_MIN * 2 ** attempt))
+        attempt += 1
+
+def connect_bulk_lane():
+    """Connect the bulk lane, retrying with backoff for as long as the control connection is up"""
+    for delay in backoff_delays():
+        if bulk_sio.connected or not sio.connected or all_threads_stop_event.is_set():
+            return
+        try:
+            bulk_sio.connect(SERVER_URL, namespaces=[BULK_NAMESPACE], transports=['websocket'], wait_timeout=20)
+            return
+        except Exception as e:
+            log_sampled('bulk_connect', logging.WARNING, "⚠️  Bulk lane unavailable, frames will share the control connection: %s", e)
+        time.sleep(delay)
+
+def connect_frame_socket():
+    global frame_socket
+    if not FRAME_SOCKET_ENABLED or websocket is None or frame_socket is not None:
+        return
+    url = re.sub(r'^http', 'ws', SERVER_URL.rstrip('/')) + FRAME_SOCKET_PATH
+    try:
+        frame_socket = websocket.create_connection(url, header=[f"X-Access-Token: {ACCESS_PASSWORD}"], timeout=10, enable_multithread=True)
+        logger.info("⚡ Frame fast path connected.")
+    except Exception as e:
+        logger.warning(f"⚠️  Frame fast path unavailable, frames go over Socket.IO: {e}")
+
+def close_frame_socket():
+    global frame_socket
+    if frame_socket is not None:
+        try:
+            frame_socket.close()
+        except Exception:
+            pass
+        frame_socket = None
+
+def send_frame(payload, meta):
+    """Send one screen frame: [header length][JSON meta][payload] on the fast path, else the bulk lane"""
+    if frame_socket is not None:
+        header = json.dumps(meta, separators=(',', ':')).encode()
+        try:
+            # A blocking send gives natural backpressure, so no acknowledgements are needed here
+            frame_socket.send_binary(struct.pack('>I', len(header)) + header + payload)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️  Frame fast path failed, falling back to Socket.IO: {e}")
+            close_frame_socket()
+    slice_info = meta.get('slice')
+    send_bulk('screen_data_bytes', (payload, meta), flow_controlled=True, starts_picture=not slice_info or slice_info['index'] == 0,
+              ends_picture=not slice_info or slice_info['index'] == slice_info['count'] - 1)
+
+def create_video_encoder(codec_name, width, height):
+    encoder_name, _, options = VIDEO_CODECS[codec_name]
+    encoder = av.CodecContext.create(encoder_name, 'w')
+    # yuv420p needs even dimensions
+    encoder.width, encoder.height = width & ~1, height & ~1
+    encoder.pix_fmt = 'yuv420p'
+    encoder.bit_rate = VIDEO_BITRATE
+    encoder.gop_size = VIDEO_KEYFRAME_INTERVAL
+    encoder.time_base = Fraction(1, 1000)
+    encoder.options = options
+    return encoder
+
+def encode_video_frame(encoder, image, pts):
+    """Encode one captured frame, returning (packet bytes, is_keyframe) for each packet produced"""
+    frame = av.VideoFrame.from_image(image).reformat(width=encoder.width, height=encoder.height, format='yuv420p')
+    frame.pts = pts
+    return [(bytes(packet), packet.is_keyframe) for packet in encoder.encode(frame)]
+
+# --- JPEG Encoders ---
+# Every frame JPEG goes through jpeg_encoder, picked once at startup by select_jpeg_encoder(). Backends
+# encode a PIL image (encode) or raw BGRA straight from the grabber (encode_bgra). Full-resolution
+# layers go to encode_bgra when the backend takes BGRA natively (native_bgra), so libjpeg-turbo skips
+# a conversion; the capture loop still builds the RGB picture it compares frames on. With
+# JPEG_ENCODER = 'auto', each available backend encodes a synthetic desktop the way the capture loop
+# would (full-resolution layer plus scaled layers) a few times and the fastest one is kept.
+JPEG_SUBSAMPLING_MODES = ('4:4:4', '4:2:2', '4:2:0')  # Position is Pillow's subsampling number
+JPEG_BENCHMARK_SIZE = (1280, 720)
+JPEG_BENCHMARK_RUNS = 5
+
+class PillowJpegEncoder:
+    name = 'pillow'
+    supports_optimize = True
+    native_bgra = False  # encode_bgra converts to RGB first, so an RGB picture at hand is encoded directly
+
+    def encode(self, image, quality):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, subsampling=JPEG_SUBSAMPLING_MODES.index(JPEG_SUBSAMPLING), optimize=JPEG_OPTIMIZE)
+        return buffer.getvalue()
+
+    def encode_bgra(self, bgra, size, quality):
+        return self.encode(Image.frombuffer("RGB", size, bgra, 'raw', 'BGRX', 0, 1), quality)
+
+class TurboJpegEncoder:
+    name = 'turbojpeg'
+    supports_optimize = False  # The TurboJPEG API exposes no Huffman optimisation switch
+    native_bgra = True
+
+    def __init__(self):
+        self.turbo = TurboJPEG()
+        self.subsampling = {'4:4:4': TJSAMP_444, '4:2:2': TJSAMP_422, '4:2:0': TJSAMP_420}[JPEG_SUBSAMPLING]
+
+    def encode(self, image, quality):
+        return self.turbo.encode(np.asarray(image), quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=self.subsampling)
+
+    def encode_bgra(self, bgra, size, quality):
+        pixels = np.frombuffer(bgra, dtype=np.uint8).reshape(size[1], size[0], 4)
+        return self.turbo.encode(pixels, quality=quality, pixel_format=TJPF_BGRA, jpeg_subsample=self.subsampling)
+
+jpeg_encoder = PillowJpegEncoder()  # Replaced by select_jpeg_encoder() at startup
+
+def available_jpeg_encoders():
+    encoders = [PillowJpegEncoder()]
+    if TurboJPEG is not None:
+        try:
+            encoders.append(TurboJpegEncoder())
+        except Exception as e:
+            logger.warning(f"⚠️  libjpeg-turbo unavailable, JPEG encoding stays on Pillow: {e}")
+    if JPEG_OPTIMIZE:
+        encoders = [encoder for encoder in encoders if encoder.supports_optimize]
+    return encoders
+
+def synthetic_desktop_bgra(width, height):
+    """Gradient wallpaper with a window of text-like noise, the content encoders differ most on"""
+    rng = np.random.default_rng(0)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., 0] = np.linspace(40, 200, width, dtype=np.uint8)[None, :]
+    pixels[..., 1] = np.linspace(60, 160, height, dtype=np.uint8)[:, None]
+    pixels[..., 2:] = (120, 255)
+    window = pixels[height // 6:height * 5 // 6, width // 6:width * 5 // 6, :3]
+    window[:] = np.where(rng.random(window.shape[:2] + (1,)) < 0.2, 20, 245)
+    return pixels.tobytes()
+
+def select_jpeg_encoder():
+    global jpeg_encoder
+    encoders = available_jpeg_encoders()
+    if JPEG_ENCODER != 'auto':
+        chosen = next((encoder for encoder in encoders if encoder.name == JPEG_ENCODER), None)
+        if chosen is not None:
+            jpeg_encoder = chosen
+            logger.info(f"🖼️  JPEG encoder: {jpeg_encoder.name} (subsampling {JPEG_SUBSAMPLING})")
+            return
+        logger.warning(f"⚠️  JPEG_ENCODER {JPEG_ENCODER} is not available, picking the fastest available one")
+    bgra = synthetic_desktop_bgra(*JPEG_BENCHMARK_SIZE)
+    image = Image.frombuffer("RGB", JPEG_BENCHMARK_SIZE, bgra, 'raw', 'BGRX', 0, 1)
+    scaled_layers = [(image.resize((max(1, int(image.width * layer['scale'])), max(1, int(image.height * layer['scale']))), Image.BILINEAR),
+                      min(JPEG_QUALITY, layer['quality'] or JPEG_QUALITY)) for layer in SIMULCAST_LAYERS if layer['scale'] != 1.0]
+    timings = {}
+    for encoder in encoders:
+        best = float('inf')
+        for _ in range(JPEG_BENCHMARK_RUNS):
+            start = time.perf_counter()
+            if encoder.native_bgra:
+                encoder.encode_bgra(bgra, JPEG_BENCHMARK_SIZE, JPEG_QUALITY)
+            else:
+                encoder.encode(image, JPEG_QUALITY)
+            for layer_image, quality in scaled_layers:
+                encoder.encode(layer_image, quality)
+            best = min(best, elapsed_ms(start))
+        timings[encoder.name] = best
+    jpeg_encoder = min(encoders, key=lambda encoder: timings[encoder.name])
+    measured = ', '.join(f"{name} {ms:.1f} ms" for name, ms in timings.items())
+    logger.info(f"🖼️  JPEG encoder: {jpeg_encoder.name} ({measured} per {JPEG_BENCHMARK_SIZE[0]}x{JPEG_BENCHMARK_SIZE[1]} frame and its layers, subsampling {JPEG_SUBSAMPLING})")
+
+def encode_captured(frame, quality):
+    """JPEG of a grabbed frame, straight from BGRA when the grabber provides it"""
+    bgra = getattr(frame, 'bgra', None)
+    if bgra is not None:
+        return jpeg_encoder.encode_bgra(bgra, frame.size, quality)
+    return jpeg_encoder.encode(Image.frombytes("RGB", frame.size, frame.rgb), quality)
+
+# --- Capture Sources ---
+# Every grab goes through create_capture_source(). Sources look like mss.mss(): a context manager with
+# a .monitors list and .grab(region) returning an object with .size and .rgb. A recording is a magic
+# line, a length-prefixed JSON header (the monitor layout), then one record per grab: a fixed header
+# (seconds since start, left, top, width, height, payload length) and the zlib-compressed raw RGB.
+CAPTURE_RECORDING_MAGIC = b'RDCAP1\n'
+CAPTURE_RECORD_HEADER = struct.Struct('<diiIII')
+
+class CapturedFrame:
+    """A grab as raw RGB, or as BGRA (converted to RGB only if something asks for .rgb)"""
+    def __init__(self, size, rgb=None, bgra=None):
+        self.size, self.bgra, self.rgb_bytes = size, bgra, rgb
+
+    @property
+    def rgb(self):
+        if self.rgb_bytes is None:
+            self.rgb_bytes = Image.frombuffer("RGB", self.size, self.bgra, 'raw', 'BGRX', 0, 1).tobytes()
+        return self.rgb_bytes
+
+class CaptureRecorder:
+    """Append-only recording file shared by every capture thread"""
+    def __init__(self, path, monitors):
+        self.file = open(path, 'wb')
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        header = json.dumps({'monitors': monitors, 'recorded_at': time.time()}).encode('utf-8')
+        self.file.write(CAPTURE_RECORDING_MAGIC + struct.pack('<I', len(header)) + header)
+        atexit.register(self.close)
+
+    def write(self, region, frame):
+        payload = zlib.compress(frame.rgb, 1)
+        record = CAPTURE_RECORD_HEADER.pack(time.monotonic() - self.started, region['left'], region['top'], frame.size[0], frame.size[1], len(payload))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(record + payload)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+class RecordingCaptureSource:
+    """Grabs from a live source and saves every frame to the shared recording"""
+    def __init__(self, source):
+        global capture_recorder
+        self.source = source
+        self.monitors = source.monitors
+        with capture_recorder_lock:
+            if capture_recorder is None:
+                capture_recorder = CaptureRecorder(CAPTURE_RECORDING_PATH, [dict(monitor) for monitor in self.monitors])
+                logger.info(f"⏺️ Recording captured frames to {CAPTURE_RECORDING_PATH}")
+        self.recorder = capture_recorder
+
+    def grab(self, region):
+        frame = self.source.grab(region)
+        self.recorder.write(region, frame)
+        return frame
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_capture_recording(path):
+    """Index a recording: (monitors, {(left, top, width, height): [(timestamp, offset, length), ...]})"""
+    frames = {}
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_RECORDING_MAGIC)) != CAPTURE_RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a capture recording")
+        header_length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        while True:
+            record = f.read(CAPTURE_RECORD_HEADER.size)
+            if len(record) < CAPTURE_RECORD_HEADER.size:
+                break  # End of file, or a record cut short when recording stopped
+            timestamp, left, top, width, height, length = CAPTURE_RECORD_HEADER.unpack(record)
+            offset = f.tell()
+            f.seek(length, os.SEEK_CUR)
+            if f.tell() > os.fstat(f.fileno()).st_size:
+                break
+            frames.setdefault((left, top, width, height), []).append((timestamp, offset, length))
+    return header['monitors'], frames
+
+class ReplayCaptureSource:
+    """Serves recorded frames instead of the screen, looping at the end of the recording"""
+    def __init__(self, path, speed):
+        self.monitors, self.frames = read_capture_recording(path)
+        self.timestamps = {rect: [frame[0] for frame in frames] for rect, frames in self.frames.items()}
+        self.file = open(path, 'rb')
+        self.speed = speed
+        self.started = None
+        self.cursors = {}  # Recorded rect -> next frame index when replaying without waiting
+
+    def find_recorded_rect(self, region):
+        left, top, width, height = region['left'], region['top'], region['width'], region['height']
+        if (left, top, width, height) in self.frames:
+            return (left, top, width, height)
+        # Zoomed regions are served by cropping the recorded frame that contains them
+        for rect in self.frames:
+            if rect[0] <= left and rect[1] <= top and left + width <= rect[0] + rect[2] and top + height <= rect[1] + rect[3]:
+                return rect
+        raise ValueError(f"No recorded frames cover {width}x{height} at ({left}, {top})")
+
+    def grab(self, region):
+        rect = self.find_recorded_rect(region)
+        frames = self.frames[rect]
+        if self.speed > 0:
+            if self.started is None:
+                self.started = time.monotonic()
+            first, duration = frames[0][0], frames[-1][0] - frames[0][0]
+            position = first + ((time.monotonic() - self.started) * self.speed) % duration if duration > 0 else first
+            index = max(bisect.bisect_right(self.timestamps[rect], position) - 1, 0)
+        else:
+            index = self.cursors.get(rect, 0) % len(frames)
+            self.cursors[rect] = index + 1
+        _, offset, length = frames[index]
+        self.file.seek(offset)
+        rgb = zlib.decompress(self.file.read(length))
+        if rect == (region['left'], region['top'], region['width'], region['height']):
+            return CapturedFrame((rect[2], rect[3]), rgb)
+        pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(rect[3], rect[2], 3)
+        x, y = region['left'] - rect[0], region['top'] - rect[1]
+        crop = pixels[y:y + region['height'], x:x + region['width']]
+        return CapturedFrame((region['width'], region['height']), crop.tobytes())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# --- X11 Damage Capture ---
+# With CAPTURE_SOURCE = 'xdamage', each capture thread opens its own X display, subscribes to DAMAGE
+# notifications on the root window and blocks on the connection until something is drawn, so an idle
+# desktop costs no grabs, diffs or encodes. Damaged rectangles are read through one MIT-SHM segment
+# the size of the screen (XShmGetImage, no copy through the X socket). Works under Xvfb, which has both
+# extensions; without them (Wayland, Windows, remote X) the source falls back to plain mss.
+X_ZPIXMAP = 2
+X_ALL_PLANES = 0xFFFFFFFFFFFFFFFF
+X_DAMAGE_REPORT_NON_EMPTY = 3  # One notification until the damage is subtracted, however much is drawn
+X_DAMAGE_NOTIFY = 0
+X_FIXES_SELECTION_NOTIFY = 0
+X_FIXES_SELECTION_EVENT_MASK = 0x7  # Owner set, owner window destroyed, owner client closed
+IPC_PRIVATE, IPC_CREAT, IPC_RMID = 0, 0o1000, 0
+x11 = None  # Loaded libraries, see load_x11()
+x11_errors = []
+
+class XImage(ctypes.Structure):
+    # Leading fields only; images are always handled through pointers returned by Xlib
+    _fields_ = [('width', ctypes.c_int), ('height', ctypes.c_int), ('xoffset', ctypes.c_int), ('format', ctypes.c_int), ('data', ctypes.c_void_p),
+                ('byte_order', ctypes.c_int), ('bitmap_unit', ctypes.c_int), ('bitmap_bit_order', ctypes.c_int), ('bitmap_pad', ctypes.c_int),
+                ('depth', ctypes.c_int), ('bytes_per_line', ctypes.c_int), ('bits_per_pixel', ctypes.c_int)]
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [('shmseg', ctypes.c_ulong), ('shmid', ctypes.c_int), ('shmaddr', ctypes.c_void_p), ('readOnly', ctypes.c_int)]
+
+class XRectangle(ctypes.Structure):
+    _fields_ = [('x', ctypes.c_short), ('y', ctypes.c_short), ('width', ctypes.c_ushort), ('height', ctypes.c_ushort)]
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+@X_ERROR_HANDLER
+def on_x11_error(display, event):
+    # Xlib's default handler exits the process; note the error and let the caller check its result instead
+    x11_errors.append(time.time())
+    return 0
+
+def load_x11():
+    """Load and declare the Xlib, XShm, DAMAGE and XFixes calls used here; raises OSError when any is missing"""
+    global x11
+    if x11 is not None:
+        return x11
+    libs = {}
+    for name in ('X11', 'Xext', 'Xdamage', 'Xfixes', 'c'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            raise OSError(f"lib{name} not found")
+        libs[name] = ctypes.CDLL(path)
+    c_display, c_xid, c_int, c_uint, c_int_p = ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(ctypes.c_int)
+    signatures = {
+        'X11': {'XOpenDisplay': ([ctypes.c_char_p], c_display), 'XCloseDisplay': ([c_display], c_int), 'XDefaultScreen': ([c_display], c_int),
+                'XRootWindow': ([c_display, c_int], c_xid), 'XDefaultVisual': ([c_display, c_int], ctypes.c_void_p), 'XDefaultDepth': ([c_display, c_int], c_int),
+                'XDisplayWidth': ([c_display, c_int], c_int), 'XDisplayHeight': ([c_display, c_int], c_int), 'XConnectionNumber': ([c_display], c_int),
+                'XPending': ([c_display], c_int), 'XNextEvent': ([c_display, ctypes.c_void_p], c_int), 'XSync': ([c_display, c_int], c_int),
+                'XFlush': ([c_display], c_int), 'XFree': ([ctypes.c_void_p], c_int), 'XSetErrorHandler': ([X_ERROR_HANDLER], ctypes.c_void_p),
+                'XInternAtom': ([c_display, ctypes.c_char_p, c_int], c_xid)},
+        'Xext': {'XShmQueryExtension': ([c_display], c_int), 'XShmAttach': ([c_display, ctypes.POINTER(XShmSegmentInfo)], c_int),
+                 'XShmDetach': ([c_display, ctypes.POINTER(XShmSegmentInfo)], c_int),
+                 'XShmCreateImage': ([c_display, ctypes.c_void_p, c_uint, c_int, ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo), c_uint, c_uint], ctypes.POINTER(XImage)),
+                 'XShmGetImage': ([c_display, c_xid, ctypes.POINTER(XImage), c_int, c_int, ctypes.c_ulong], c_int)},
+        'Xdamage': {'XDamageQueryExtension': ([c_display, c_int_p, c_int_p], c_int), 'XDamageQueryVersion': ([c_display, c_int_p, c_int_p], c_int),
+                    'XDamageCreate': ([c_display, c_xid, c_int], c_xid), 'XDamageDestroy': ([c_display, c_xid], None),
+                    'XDamageSubtract': ([c_display, c_xid, c_xid, c_xid], None)},
+        'Xfixes': {'XFixesQueryExtension': ([c_display, c_int_p, c_int_p], c_int), 'XFixesQueryVersion': ([c_display, c_int_p, c_int_p], c_int),
+                   'XFixesCreateRegion': ([c_display, ctypes.POINTER(XRectangle), c_int], c_xid), 'XFixesDestroyRegion': ([c_display, c_xid], None),
+                   'XFixesFetchRegion': ([c_display, c_xid, c_int_p], ctypes.POINTER(XRectangle)),
+                   'XFixesSelectSelectionInput': ([c_display, c_xid, c_xid, ctypes.c_ulong], None)},
+        'c': {'shmget': ([c_int, ctypes.c_size_t, c_int], c_int), 'shmat': ([c_int, ctypes.c_void_p, c_int], ctypes.c_void_p),
+              'shmdt': ([ctypes.c_void_p], c_int), 'shmctl': ([c_int, c_int, ctypes.c_void_p], c_int)},
+    }
+    for name, functions in signatures.items():
+        for function_name, (argtypes, restype) in functions.items():
+            function = getattr(libs[name], function_name)
+            function.argtypes, function.restype = argtypes, restype
+    libs['X11'].XSetErrorHandler(on_x11_error)
+    x11 = libs
+    return x11
+
+def align_rect(rect, monitor):
+    """Widen a monitor-relative rect to the DAMAGE_ALIGN grid, clipped to the monitor"""
+    x, y = rect['x'] // DAMAGE_ALIGN * DAMAGE_ALIGN, rect['y'] // DAMAGE_ALIGN * DAMAGE_ALIGN
+    right = min(-(-(rect['x'] + rect['width']) // DAMAGE_ALIGN) * DAMAGE_ALIGN, monitor['width'])
+    bottom = min(-(-(rect['y'] + rect['height']) // DAMAGE_ALIGN) * DAMAGE_ALIGN, monitor['height'])
+    return {'x': x, 'y': y, 'width': right - x, 'height': bottom - y}
+
+def bounding_rect(rects):
+    left, top = min(r['x'] for r in rects), min(r['y'] for r in rects)
+    right, bottom = max(r['x'] + r['width'] for r in rects), max(r['y'] + r['height'] for r in rects)
+    return {'x': left, 'y': top, 'width': right - left, 'height': bottom - top}
+
+class XDamageCaptureSource:
+    """mss-compatible source that also reports which parts of a monitor changed (wait_for_damage)"""
+    def __init__(self):
+        self.lib = load_x11()
+        self.display = None
+        self.damage = self.region = None
+        self.shm_info = self.image = None
+        self.pending = []  # Damaged desktop rects (left, top, width, height) not yet taken
+        self.fallback = mss.mss()  # Monitor layout, and grabs when MIT-SHM is unavailable
+        self.monitors = self.fallback.monitors
+        try:
+            self.open()
+        except Exception:
+            self.close()
+            raise
+
+    def open(self):
+        x, xext, xdamage, xfixes = (self.lib[name] for name in ('X11', 'Xext', 'Xdamage', 'Xfixes'))
+        self.display = x.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("cannot open X display")
+        screen = x.XDefaultScreen(self.display)
+        self.root = x.XRootWindow(self.display, screen)
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not xfixes.XFixesQueryExtension(self.display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            raise OSError("X server has no XFIXES extension")
+        major, minor = ctypes.c_int(5), ctypes.c_int(0)
+        xfixes.XFixesQueryVersion(self.display, ctypes.byref(major), ctypes.byref(minor))
+        if not xdamage.XDamageQueryExtension(self.display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            raise OSError("X server has no DAMAGE extension")
+        major, minor = ctypes.c_int(1), ctypes.c_int(1)
+        xdamage.XDamageQueryVersion(self.display, ctypes.byref(major), ctypes.byref(minor))
+        self.damage_event = event_base.value + X_DAMAGE_NOTIFY
+        self.damage = xdamage.XDamageCreate(self.display, self.root, X_DAMAGE_REPORT_NON_EMPTY)
+        self.region = xfixes.XFixesCreateRegion(self.display, None, 0)
+        self.event = (ctypes.c_long * 24)()  # Large enough for any XEvent
+        self.fd = x.XConnectionNumber(self.display)
+        if xext.XShmQueryExtension(self.display):
+            self.attach_shm(screen, x.XDisplayWidth(self.display, screen), x.XDisplayHeight(self.display, screen))
+        else:
+            logger.warning("📸 X server has no MIT-SHM; damaged regions are grabbed through mss")
+        x.XSync(self.display, False)
+
+    def attach_shm(self, screen, width, height):
+        x, xext, libc = self.lib['X11'], self.lib['Xext'], self.lib['c']
+        self.shm_info = XShmSegmentInfo()
+        image = xext.XShmCreateImage(self.display, x.XDefaultVisual(self.display, screen), x.XDefaultDepth(self.display, screen),
+                                     X_ZPIXMAP, None, ctypes.byref(self.shm_info), width, height)
+        if not image or image.contents.bits_per_pixel != 32:
+            if image:
+                x.XFree(image)
+            logger.warning("📸 Screen is not 32 bits per pixel; damaged regions are grabbed through mss")
+            self.shm_info = None
+            return
+        self.image = image
+        self.shm_info.shmid = libc.shmget(IPC_PRIVATE, image.contents.bytes_per_line * height, IPC_CREAT | 0o600)
+        self.shm_info.shmaddr = libc.shmat(self.shm_info.shmid, None, 0)
+        # Marked for removal now, so the segment goes away with the process however it exits
+        libc.shmctl(self.shm_info.shmid, IPC_RMID, None)
+        if self.shm_info.shmid < 0 or self.shm_info.shmaddr in (None, ctypes.c_void_p(-1).value):
+            raise OSError("cannot allocate shared memory for XShm")
+        self.image.contents.data = self.shm_info.shmaddr
+        errors = len(x11_errors)
+        xext.XShmAttach(self.display, ctypes.byref(self.shm_info))
+        x.XSync(self.display, False)
+        if len(x11_errors) > errors:
+            raise OSError("XShmAttach failed (X server on another host?)")
+
+    def grab(self, region):
+        if self.image is None:
+            return self.fallback.grab(region)
+        width, height = region['width'], region['height']
+        # One segment serves every rect: the image is resized in place and read back tightly packed
+        image = self.image.contents
+        image.width, image.height, image.bytes_per_line = width, height, width * 4
+        if not self.lib['Xext'].XShmGetImage(self.display, self.root, self.image, region['left'], region['top'], X_ALL_PLANES):
+            raise OSError(f"XShmGetImage failed for {width}x{height} at ({region['left']}, {region['top']})")
+        return CapturedFrame((width, height), bgra=ctypes.string_at(self.shm_info.shmaddr, width * height * 4))
+
+    def collect_damage(self):
+        x, xdamage, xfixes = self.lib['X11'], self.lib['Xdamage'], self.lib['Xfixes']
+        notified = False
+        while x.XPending(self.display):
+            x.XNextEvent(self.display, self.event)
+            notified = notified or ctypes.c_int.from_buffer(self.event).value == self.damage_event
+        if not notified:
+            return
+        # Move everything damaged so far into our region; this also re-arms the notification
+        xdamage.XDamageSubtract(self.display, self.damage, 0, self.region)
+        count = ctypes.c_int()
+        rects = xfixes.XFixesFetchRegion(self.display, self.region, ctypes.byref(count))
+        if rects:
+            self.pending.extend((rects[i].x, rects[i].y, rects[i].width, rects[i].height) for i in range(count.value))
+            x.XFree(rects)
+        x.XFlush(self.display)
+
+    def wait_for_damage(self, monitor, timeout):
+        """Monitor-relative rects changed since the last call, waiting up to timeout; [] when nothing changed"""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.collect_damage()
+            rects = self.take_damage(monitor)
+            remaining = deadline - time.monotonic()
+            if rects or remaining <= 0:
+                return rects
+            select.select([self.fd], [], [], remaining)
+
+    def take_damage(self, monitor):
+        rects = []
+        for left, top, width, height in self.pending:
+            x0, y0 = max(left, monitor['left']), max(top, monitor['top'])
+            x1, y1 = min(left + width, monitor['left'] + monitor['width']), min(top + height, monitor['top'] + monitor['height'])
+            if x1 > x0 and y1 > y0:
+                rects.append(align_rect({'x': x0 - monitor['left'], 'y': y0 - monitor['top'], 'width': x1 - x0, 'height': y1 - y0}, monitor))
+        self.pending = []
+        if len(rects) > DAMAGE_MAX_RECTS:
+            rects = [bounding_rect(rects)]
+        return rects
+
+    def discard_damage(self):
+        """Forget pending damage, e.g. right before a full frame is grabbed"""
+        self.collect_damage()
+        self.pending = []
+
+    def close(self):
+        x = self.lib['X11']
+        if self.display:
+            if self.image is not None:
+                self.lib['Xext'].XShmDetach(self.display, ctypes.byref(self.shm_info))
+                x.XSync(self.display, False)
+                self.lib['c'].shmdt(self.shm_info.shmaddr)
+                x.XFree(self.image)  # XShm images own no pixel memory, so XFree is their destroy
+                self.image = None
+            if self.damage:
+                self.lib['Xdamage'].XDamageDestroy(self.display, self.damage)
+            if self.region:
+                self.lib['Xfixes'].XFixesDestroyRegion(self.display, self.region)
+            x.XCloseDisplay(self.display)
+            self.display = None
+        self.fallback.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def create_capture_source():
+    """Open the configured capture source; each capture thread uses its own"""
+    if CAPTURE_SOURCE == 'replay':
+        return ReplayCaptureSource(CAPTURE_RECORDING_PATH, CAPTURE_REPLAY_SPEED)
+    if CAPTURE_SOURCE == 'record':
+        return RecordingCaptureSource(mss.mss())
+    if CAPTURE_SOURCE == 'xdamage':
+        try:
+            return XDamageCaptureSource()
+        except Exception as e:
+            log_sampled('xdamage', logging.WARNING, "📸 Damage-driven capture unavailable, polling with mss instead: %s", e)
+    return mss.mss()
+
+def discover_monitors():
+    global available_monitors, selected_monitor_details
+    with create_capture_source() as sct:
+        available_monitors = [dict(monitor) for monitor in sct.monitors]
+    if CAPTURE_MONITOR_INDEX < len(available_monitors):
+        selected_monitor_details = available_monitors[CAPTURE_MONITOR_INDEX]
+    else:
+        logger.error(f"❌ Monitor index {CAPTURE_MONITOR_INDEX} is invalid ({len(available_monitors) - 1} monitors found).")
+    return [{'index': index, 'left': m['left'], 'top': m['top'], 'width': m['width'], 'height': m['height']}
+            for index, m in enumerate(available_monitors) if index > 0]
+
+def start_monitor_stream(monitor_index):
+    stream = {'stop': threading.Event(), 'keyframe': threading.Event(), 'fps': CLIENT_TARGET_FPS, 'quality': JPEG_QUALITY, 'roi': monitor_rois.get(monitor_index), 'seq': 0}
+    monitor_streams[monitor_index] = stream
+    threading.Thread(target=screen_capture_loop, args=(monitor_index, stream), name=f"ScreenCaptureThread-{monitor_index}", daemon=True).start()
+
+def apply_watched_monitors():
+    """Run one capture thread per watched monitor; unwatched monitors are never grabbed, and nothing is with no viewers"""
+    with monitor_streams_lock:
+        wanted = set(watched_monitor_indices) if viewers_watching and not all_threads_stop_event.is_set() else set()
+        for monitor_index in list(monitor_streams):
+            if monitor_index not in wanted:
+                monitor_streams.pop(monitor_index)['stop'].set()
+        for monitor_index in sorted(wanted - set(monitor_streams)):
+            start_monitor_stream(monitor_index)
+
+def stop_monitor_streams():
+    with monitor_streams_lock:
+        for stream in monitor_streams.values():
+            stream['stop'].set()
+        monitor_streams.clear()
+
+def resync_streams(last_seq):
+    """After a resume, keep streaming deltas where the server saw our last frame; resend a keyframe where it did not"""
+    with monitor_streams_lock:
+        for monitor_index, stream in monitor_streams.items():
+            if stream['seq'] and last_seq.get(str(monitor_index)) != stream['seq']:
+                stream['keyframe'].set()
+
+def request_keyframes(monitor_index=None):
+    with monitor_streams_lock:
+        for index, stream in monitor_streams.items():
+            if monitor_index is None or index == monitor_index:
+                stream['keyframe'].set()
+
+def to_desktop_coords(data):
+    """Map viewer coordinates on a monitor's picture to desktop coordinates"""
+    monitor_index = data.get('monitor')
+    if monitor_index is None or not 0 <= monitor_index < len(available_monitors):
+        monitor_index = CAPTURE_MONITOR_INDEX
+    if monitor_index >= len(available_monitors):
+        return data['x'], data['y']
+    monitor = available_monitors[monitor_index]
+    return data['x'] + monitor['left'], data['y'] + monitor['top']
+
+def clamp_roi(roi, monitor):
+    """Fit a viewer's region into the monitor; None when there is no region or it covers the whole monitor"""
+    if not roi:
+        return None
+    width = min(max(int(roi.get('width', 0)), ROI_MIN_SIZE), monitor['width'])
+    height = min(max(int(roi.get('height', 0)), ROI_MIN_SIZE), monitor['height'])
+    x = min(max(int(roi.get('x', 0)), 0), monitor['width'] - width)
+    y = min(max(int(roi.get('y', 0)), 0), monitor['height'] - height)
+    if width == monitor['width'] and height == monitor['height']:
+        return None
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+def send_roi_frame(sct, monitor_definition, monitor_index, roi, last_roi, captured_at, stream):
+    """Grab only the zoomed region at native resolution and send it at high quality when it changed"""
+    region = {'left': monitor_definition['left'] + roi['x'], 'top': monitor_definition['top'] + roi['y'], 'width': roi['width'], 'height': roi['height']}
+    sct_img = sct.grab(region)
+    crop = Image.frombytes("RGB", sct_img.size, sct_img.rgb)
+    if last_roi is not None and last_roi[0] == roi and np.mean(np.array(ImageChops.difference(crop, last_roi[1]))) <= FRAME_DIFFERENCE_THRESHOLD:
+        return last_roi
+    payload = jpeg_encoder.encode(crop, ROI_JPEG_QUALITY)
+    stream['seq'] += 1
+    meta = {'monitor': monitor_index, 'roi': roi, 'captured_at': int(captured_at * 1000), 'seq': stream['seq']}
+    input_ids = take_applied_inputs(captured_at)
+    if input_ids:
+        meta['input_ids'] = input_ids
+    send_frame(payload, meta)
+    return roi, crop
+
+def frame_slice_bands(height):
+    """(top, bottom) rows of each slice, in whole 16-row JPEG blocks so slice edges fall on block edges"""
+    band = -(-height // FRAME_SLICES)
+    band = -(-band // 16) * 16
+    return [(top, min(top + band, height)) for top in range(0, height, band)]
+
+def send_layer_frame(image, quality, meta, timings, bgra=None):
+    """Encode and send one full-frame layer, large ones slice by slice; returns bytes sent.
+    bgra is the grabber's buffer of the same picture, for encoders that take it natively."""
+    bands = frame_slice_bands(image.height) if image.width * image.height >= FRAME_SLICE_MIN_PIXELS else [(0, image.height)]
+    scale = meta['height'] / image.height
+    input_ids = meta.pop('input_ids', None)
+    if bgra is not None and len(bgra) != image.width * image.height * 4:
+        bgra = None  # Padded rows; encode the RGB picture instead
+    frame_bytes = 0
+    for index, (top, bottom) in enumerate(bands):
+        stage_start = time.perf_counter()
+        if bgra is not None:
+            # Rows are contiguous, so a slice is a plain byte range of the buffer
+            stride = image.width * 4
+            payload = jpeg_encoder.encode_bgra(memoryview(bgra)[top * stride:bottom * stride], (image.width, bottom - top), quality)
+        else:
+            payload = jpeg_encoder.encode(image if len(bands) == 1 else image.crop((0, top, image.width, bottom)), quality)
+        timings['encode'] += elapsed_ms(stage_start)
+        slice_meta = dict(meta)
+        if len(bands) > 1:
+            # Slice position and height are in full-resolution rows, like meta.width/height
+            y = round(top * scale)
+            slice_meta['slice'] = {'index': index, 'count': len(bands), 'y': y, 'height': round(bottom * scale) - y}
+        if input_ids and index == len(bands) - 1:
+            slice_meta['input_ids'] = input_ids
+        stage_start = time.perf_counter()
+        send_frame(payload, slice_meta)
+        timings['send'] += elapsed_ms(stage_start)
+        frame_bytes += len(payload)
+    return frame_bytes
+
+def send_damaged_rects(sct, monitor_definition, monitor_index, rects, captured_at, stream):
+    """Grab and send only the damaged parts of a monitor as partial updates (meta.rect); returns (timings, bytes sent)"""
+    timings = {stage: 0.0 for stage in CAPTURE_STAGES}
+    frame_bytes = 0
+    stream['seq'] += 1
+    input_ids = take_applied_inputs(captured_at)
+    for i, rect in enumerate(rects):
+        stage_start = time.perf_counter()
+        sct_img = sct.grab({'left': monitor_definition['left'] + rect['x'], 'top': monitor_definition['top'] + rect['y'], 'width': rect['width'], 'height': rect['height']})
+        timings['grab'] += elapsed_ms(stage_start)
+        stage_start = time.perf_counter()
+        payload = encode_captured(sct_img, stream['quality'])
+        timings['encode'] += elapsed_ms(stage_start)
+        meta = {'monitor': monitor_index, 'rect': {'x': rect['x'], 'y': rect['y']}, 'captured_at': int(captured_at * 1000), 'seq': stream['seq']}
+        if input_ids and i == len(rects) - 1:
+            # Inputs count as displayed once the last rect of this update is painted
+            meta['input_ids'] = input_ids
+        stage_start = time.perf_counter()
+        send_frame(payload, meta)
+        timings['send'] += elapsed_ms(stage_start)
+        frame_bytes += len(payload)
+    return timings, frame_bytes
+
+def elapsed_ms(since):
+    return (time.perf_counter() - since) * 1000
+
+def record_capture_timing(monitor_index, timings, frame_bytes):
+    """Keep one capture iteration's stage timings (ms) and sent bytes for the rolling stats"""
+    with capture_stats_lock:
+        stats = capture_stats.setdefault(monitor_index, {name: deque(maxlen=CAPTURE_STATS_WINDOW) for name in CAPTURE_STAGES + ('bytes',)})
+        for stage, ms in timings.items():
+            stats[stage].append(ms)
+        if frame_bytes:
+            stats['bytes'].append(frame_bytes)
+        if capture_stats_csv is not None:
+            capture_stats_csv[1].writerow([f"{time.time():.3f}", monitor_index] + [f"{timings[stage]:.2f}" if stage in timings else '' for stage in CAPTURE_STAGES] + [frame_bytes])
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def capture_stats_report():
+    """Per monitor and stage: p50/p95/max over the window; bytes are per sent frame"""
+    report = {}
+    with capture_stats_lock:
+        for monitor_index, stats in capture_stats.items():
+            report[str(monitor_index)] = {name: {'p50': round(percentile(values, 0.5), 2), 'p95': round(percentile(values, 0.95), 2), 'max': round(values[-1], 2)}
+                                          for name, samples in stats.items() if samples for values in [sorted(samples)]}
+    return report
+
+def capture_stats_loop():
+    global capture_stats_csv
+    if CAPTURE_STATS_CSV:
+        new_file = not os.path.exists(CAPTURE_STATS_CSV)
+        csv_file = open(CAPTURE_STATS_CSV, 'a', newline='')
+        writer = csv.writer(csv_file)
+        if new_file:
+            writer.writerow(['time', 'monitor'] + [f"{stage}_ms" for stage in CAPTURE_STAGES] + ['bytes'])
+        capture_stats_csv = (csv_file, writer)
+    while not all_threads_stop_event.wait(CAPTURE_STATS_INTERVAL):
+        report = capture_stats_report()
+        if report and sio.connected:
+            try:
+                sio.emit('capture_stats', {'monitors': report, 'window': CAPTURE_STATS_WINDOW, 'cpu': cpu_governor_report()})
+            except Exception as e:
+                log_sampled('capture_stats', logging.WARNING, "📊 Could not send capture stats: %s", e)
+        if capture_stats_csv is not None:
+            capture_stats_csv[0].flush()
+    with capture_stats_lock:
+        if capture_stats_csv is not None:
+            capture_stats_csv[0].close()
+            capture_stats_csv = None
+
+# --- CPU Governor ---
+# Keeps the client within CPU_BUDGET_PERCENT of one core, independently of any network adaptation.
+# Process CPU time (all threads) is sampled every CPU_BUDGET_INTERVAL; over budget, the governor
+# moves one step down CPU_BUDGET_STEPS (lower frame rate, then resolution, then JPEG quality), and
+# steps back up once usage drops below CPU_BUDGET_RELEASE of the budget.
+def cpu_throttle():
+    return CPU_BUDGET_STEPS[cpu_throttle_level]
+
+def cpu_governor_loop():
+    global cpu_throttle_level, cpu_usage_percent
+    last_cpu, last_wall = time.process_time(), time.monotonic()
+    while not all_threads_stop_event.wait(CPU_BUDGET_INTERVAL):
+        cpu, wall = time.process_time(), time.monotonic()
+        cpu_usage_percent = (cpu - last_cpu) / max(wall - last_wall, 1e-6) * 100
+        last_cpu, last_wall = cpu, wall
+        level = cpu_throttle_level
+        if cpu_usage_percent > CPU_BUDGET_PERCENT and level < len(CPU_BUDGET_STEPS) - 1:
+            level += 1
+        elif cpu_usage_percent < CPU_BUDGET_PERCENT * CPU_BUDGET_RELEASE and level > 0:
+            level -= 1
+        if level == cpu_throttle_level:
+            if level and cpu_usage_percent > CPU_BUDGET_PERCENT:
+                log_sampled('cpu_governor', logging.WARNING, "🐢 CPU governor: %.0f%% of one core, over the %s%% budget at the strongest throttle", cpu_usage_percent, CPU_BUDGET_PERCENT)
+            continue
+        step = CPU_BUDGET_STEPS[level]
+        if level > cpu_throttle_level:
+            logger.warning(f"🐢 CPU governor: {cpu_usage_percent:.0f}% of one core exceeds the {CPU_BUDGET_PERCENT}% budget, throttling to level {level} (fps x{step['fps']}, scale x{step['scale']}, quality cap {step['quality'] or '-'})")
+        else:
+            logger.info(f"🐇 CPU governor: {cpu_usage_percent:.0f}% of one core, easing to level {level}" + (" (unthrottled)" if level == 0 else ""))
+        cpu_throttle_level = level
+
+def cpu_governor_report():
+    if not CPU_BUDGET_PERCENT or cpu_usage_percent is None:
+        return None
+    return {'percent': round(cpu_usage_percent, 1), 'budget': CPU_BUDGET_PERCENT, 'level': cpu_throttle_level, **cpu_throttle()}
+
+def screen_capture_loop(monitor_index, stream):
+    global FRAME_DIFFERENCE_THRESHOLD, STREAM_CODEC
+    logger.info(f"📸 CAPTURE_THREAD: Starting. FPS:{stream['fps']}, Quality:{stream['quality']}, Codec:{STREAM_CODEC}, Monitor:{monitor_index}")
     last_frame = None
-    with mss.mss() as sct:
+    last_roi = None
+    last_background_time = 0
+    video_encoder = None
+    video_encoder_codec = None
+    stream_start_time = time.time()
+    with create_capture_source() as sct:
         try:
-            monitor_definition = sct.monitors[CAPTURE_MONITOR_INDEX]
-            selected_monitor_details = monitor_definition
-            logger.info(f"📸 CAPTURE_THREAD: Capturing Monitor {CAPTURE_MONITOR_INDEX}: {monitor_definition}")
+            monitor_definition = sct.monitors[monitor_index]
+            logger.info(f"📸 CAPTURE_THREAD: Capturing Monitor {monitor_index}: {monitor_definition}")
         except IndexError:
-            logger.error(f"❌ CAPTURE_THREAD: Monitor index {CAPTURE_MONITOR_INDEX} is invalid. Exiting thread.")
+            logger.error(f"❌ CAPTURE_THREAD: Monitor index {monitor_index} is invalid. Exiting thread.")
             return
+        # Damage-driven sources say what changed, so there is nothing to poll or diff
+        damage_driven = hasattr(sct, 'wait_for_damage')
+        monitor_area = monitor_definition['width'] * monitor_definition['height']
 
-        while not all_threads_stop_event.is_set():
-            target_interval = 1.0 / CLIENT_TARGET_FPS
+        while not all_threads_stop_event.is_set() and not stream['stop'].is_set():
+            if not session_ready.wait(0.5):
+                continue  # Reconnecting: the grabber, encoder and last frame stay warm until the session resumes
+            throttle = cpu_throttle()
+            target_interval = 1.0 / (stream['fps'] * throttle['fps'])
             capture_start_time = time.time()
-            sct_img = sct.grab(monitor_definition)
-            current_frame = Image.frombytes("RGB", sct_img.size, sct_img.rgb)
-            send_frame = False
-            if last_frame is None:
-                send_frame = True
-            else:
-                diff = ImageChops.difference(current_frame, last_frame)
-                mean_diff = np.mean(np.array(diff))
-                if mean_diff > FRAME_DIFFERENCE_THRESHOLD:
-                    send_frame = True
-            if send_frame:
+            if stream['keyframe'].is_set():
+                stream['keyframe'].clear()
+                last_frame = None
+                last_roi = None
+                video_encoder = None
+            # While a viewer is zoomed in (JPEG mode), the region streams at full rate and quality
+            # and the rest of the screen only refreshes at ROI_BACKGROUND_FPS
+            roi = stream['roi'] if STREAM_CODEC == 'jpeg' else None
+            if roi:
                 try:
-                    buffer = io.BytesIO()
-                    current_frame.save(buffer, format="JPEG", quality=JPEG_QUALITY)
-                    sio.emit('screen_data_bytes', buffer.getvalue())
-                    last_frame = current_frame
+                    last_roi = send_roi_frame(sct, monitor_definition, monitor_index, roi, last_roi, capture_start_time, stream)
                 except Exception as e:
-                    logger.error(f"📸 CAPTURE_THREAD: Emit error: {e}")
+                    log_sampled('region_emit', logging.ERROR, "📸 CAPTURE_THREAD: Region emit error: %s", e)
+                    last_roi = None
                     time.sleep(1)
+            background_due = ROI_BACKGROUND_FPS > 0 and capture_start_time - last_background_time >= 1.0 / ROI_BACKGROUND_FPS
+            damaged = None
+            if damage_driven and not roi and last_frame is not None:
+                damaged = sct.wait_for_damage(monitor_definition, DAMAGE_IDLE_WAIT)
+                if not damaged:
+                    continue  # Nothing was drawn; the wait above was the idle sleep
+                capture_start_time = time.time()
+                if STREAM_CODEC == 'jpeg' and sum(r['width'] * r['height'] for r in damaged) <= monitor_area * DAMAGE_FULL_FRAME_RATIO:
+                    try:
+                        timings, frame_bytes = send_damaged_rects(sct, monitor_definition, monitor_index, damaged, capture_start_time, stream)
+                        record_capture_timing(monitor_index, timings, frame_bytes)
+                    except Exception as e:
+                        log_sampled('frame_emit', logging.ERROR, "📸 CAPTURE_THREAD: Emit error: %s", e)
+                        stream['keyframe'].set()
+                        time.sleep(1)
+                    sleep_duration = target_interval - (time.time() - capture_start_time)
+                    if sleep_duration > 0:
+                        time.sleep(sleep_duration)
+                    continue
+            if not roi or last_frame is None or background_due:
+                if damage_driven:
+                    # Whatever is drawn from here on is reported after this full grab
+                    sct.discard_damage()
+                stage_start = time.perf_counter()
+                sct_img = sct.grab(monitor_definition)
+                timings = {'grab': elapsed_ms(stage_start)}
+                stage_start = time.perf_counter()
+                current_frame = Image.frombytes("RGB", sct_img.size, sct_img.rgb)
+                timings['convert'] = elapsed_ms(stage_start)
+                last_background_time = capture_start_time
+                frame_changed = False
+                frame_bytes = 0
+                stage_start = time.perf_counter()
+                if last_frame is None or damaged:
+                    frame_changed = True
+                else:
+                    diff = ImageChops.difference(current_frame, last_frame)
+                    mean_diff = np.mean(np.array(diff))
+                    if mean_diff > FRAME_DIFFERENCE_THRESHOLD:
+                        frame_changed = True
+                timings['diff'] = elapsed_ms(stage_start)
+                if frame_changed:
+                    timings['encode'] = timings['send'] = 0.0
+                    video_packets = None
+                    stage_start = time.perf_counter()
+                    if STREAM_CODEC in VIDEO_CODECS:
+                        pts = int((capture_start_time - stream_start_time) * 1000)
+                        try:
+                            if video_encoder is None or video_encoder_codec != STREAM_CODEC:
+                                # A fresh encoder always starts with a keyframe
+                                video_encoder = create_video_encoder(STREAM_CODEC, *current_frame.size)
+                                video_encoder_codec = STREAM_CODEC
+                            video_packets = encode_video_frame(video_encoder, current_frame, pts)
+                        except Exception as e:
+                            logger.error(f"📸 CAPTURE_THREAD: {STREAM_CODEC} encoder failed, falling back to JPEG: {e}")
+                            STREAM_CODEC = 'jpeg'
+                            video_encoder = None
+                    timings['encode'] += elapsed_ms(stage_start)
+                    try:
+                        input_ids = take_applied_inputs(capture_start_time)
+                        # Every packet or layer of this frame carries the same sequence number; after a
+                        # reconnect the server reports the last one it relayed
+                        stream['seq'] += 1
+                        if video_packets is not None:
+                            for payload, is_keyframe in video_packets:
+                                meta = {'monitor': monitor_index, 'codec': VIDEO_CODECS[video_encoder_codec][1], 'key': is_keyframe, 'ts': pts, 'captured_at': int(capture_start_time * 1000), 'seq': stream['seq']}
+                                if input_ids:
+                                    meta['input_ids'], input_ids = input_ids, None
+                                stage_start = time.perf_counter()
+                                send_frame(payload, meta)
+                                timings['send'] += elapsed_ms(stage_start)
+                                frame_bytes += len(payload)
+                        else:
+                            base_quality = ROI_BACKGROUND_QUALITY if roi else stream['quality']
+                            base_quality = min(base_quality, throttle['quality'] or base_quality)
+                            wanted_layers = monitor_layers.get(monitor_index)
+                            for layer_index, layer in enumerate(SIMULCAST_LAYERS):
+                                if wanted_layers is not None and layer_index not in wanted_layers:
+                                    continue
+                                stage_start = time.perf_counter()
+                                layer_frame = current_frame
+                                # The CPU governor's resolution cut applies to every layer; viewers still paint at full size
+                                scale = layer['scale'] * throttle['scale']
+                                if scale != 1.0:
+                                    layer_frame = current_frame.resize((max(1, int(current_frame.width * scale)), max(1, int(current_frame.height * scale))), Image.BILINEAR)
+                                timings['encode'] += elapsed_ms(stage_start)
+                                # The capture time lets the viewer's jitter buffer pace presentation; width/height
+                                # are the full-resolution size, so every layer paints onto the same picture
+                                meta = {'monitor': monitor_index, 'captured_at': int(capture_start_time * 1000), 'layer': layer_index,
+                                        'layers': len(SIMULCAST_LAYERS), 'width': current_frame.width, 'height': current_frame.height, 'seq': stream['seq']}
+                                if input_ids:
+                                    meta['input_ids'] = input_ids
+                                frame_bytes += send_layer_frame(layer_frame, min(base_quality, layer['quality'] or base_quality), meta, timings,
+                                                                bgra=getattr(sct_img, 'bgra', None) if scale == 1.0 and jpeg_encoder.native_bgra else None)
+                        last_frame = current_frame
+                    except Exception as e:
+                        log_sampled('frame_emit', logging.ERROR, "📸 CAPTURE_THREAD: Emit error: %s", e)
+                        # Viewers may have missed a frame the next delta depends on
+                        stream['keyframe'].set()
+                        time.sleep(1)
+                record_capture_timing(monitor_index, timings, frame_bytes)
             elapsed = time.time() - capture_start_time
             sleep_duration = target_interval - elapsed
             if sleep_duration > 0:
                 time.sleep(sleep_duration)
-    logger.info("📸 CAPTURE_THREAD: Stopped.")
+    logger.info(f"📸 CAPTURE_THREAD: Monitor {monitor_index} stopped.")
+
+def read_clipboard():
+    """Return (mime, payload bytes) for the current clipboard, with images as PNG, or None when empty"""
+    if GetClipboardSequenceNumber is not None or clipboard_watcher is not None:
+        # Images are only read where a change counter (Windows, or XFixes events on X11) tells us the
+        # clipboard actually changed; ImageGrab needs xclip or wl-paste on Linux
+        try:
+            image = ImageGrab.grabclipboard()
+        except Exception:
+            image = None
+        if isinstance(image, Image.Image):
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", compress_level=6)
+            return 'image/png', buffer.getvalue()
+    try:
+        text = pyperclip.paste()
+    except pyperclip.PyperclipException:
+        return None
+    return ('text/plain', text.encode('utf-8')) if text else None
+
+def write_clipboard(mime, payload):
+    """Put text or an image on the local clipboard: a DIB on Windows, PNG through xclip on X11"""
+    if mime == 'text/plain':
+        pyperclip.copy(payload.decode('utf-8'))
+        return
+    if not mime.startswith('image/'):
+        raise ValueError(f"unsupported clipboard type {mime}")
+    image = Image.open(io.BytesIO(payload))
+    buffer = io.BytesIO()
+    if set_clipboard_dib is not None:
+        image.convert('RGB').save(buffer, format="BMP")
+        set_clipboard_dib(buffer.getvalue()[14:])  # A DIB is a BMP file without its 14-byte file header
+    elif os.environ.get('DISPLAY') and shutil.which('xclip'):
+        image.save(buffer, format="PNG")
+        subprocess.run(['xclip', '-selection', 'clipboard', '-t', 'image/png', '-i'], input=buffer.getvalue(), check=True, timeout=5)
+    else:
+        raise OSError("images can only be put on the clipboard on Windows or X11 with xclip")
+
+def clipboard_hash(content):
+    if content is None:
+        return None
+    mime, payload = content
+    return hashlib.sha1(mime.encode() + b'\0' + payload).hexdigest()
+
+class X11ClipboardWatcher:
+    """Counts XFixes ownership changes of the CLIPBOARD selection; every copy takes ownership, even within one application"""
+    def __init__(self):
+        lib = load_x11()['X11']
+        self.display = lib.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("cannot open the X display")
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not x11['Xfixes'].XFixesQueryExtension(self.display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            lib.XCloseDisplay(self.display)
+            raise OSError("the X server has no XFixes extension")
+        self.notify_event = event_base.value + X_FIXES_SELECTION_NOTIFY
+        root = lib.XRootWindow(self.display, lib.XDefaultScreen(self.display))
+        x11['Xfixes'].XFixesSelectSelectionInput(self.display, root, lib.XInternAtom(self.display, b'CLIPBOARD', 0), X_FIXES_SELECTION_EVENT_MASK)
+        lib.XFlush(self.display)
+        self.event = (ctypes.c_long * 24)()  # Large enough for any XEvent
+        self.changes = 0
+
+    def marker(self):
+        lib = x11['X11']
+        while lib.XPending(self.display):
+            lib.XNextEvent(self.display, self.event)
+            if ctypes.c_int.from_buffer(self.event).value == self.notify_event:
+                self.changes += 1
+        return self.changes
+
+clipboard_watcher = None  # X11ClipboardWatcher, created by the clipboard thread where X11 and XFixes are available
+
+def clipboard_change_marker():
+    """Cheap value that changes whenever the clipboard does: the OS counter on Windows, XFixes selection
+    events on X11, a content hash elsewhere"""
+    if GetClipboardSequenceNumber is not None:
+        return GetClipboardSequenceNumber()
+    if clipboard_watcher is not None:
+        return clipboard_watcher.marker()
+    return clipboard_hash(read_clipboard())
+
+def send_clipboard(content, content_hash):
+    mime, payload = content
+    if len(payload) > CLIPBOARD_MAX_BYTES:
+        logger.warning(f"📋 CLIPBOARD_THREAD: Skipping {mime} content of {len(payload)} bytes (limit {CLIPBOARD_MAX_BYTES})")
+        return
+    if mime == 'text/plain' and len(payload) <= CLIPBOARD_CHUNK_SIZE:
+        send_bulk('clipboard_from_client', {'text': payload.decode('utf-8')})
+        return
+    count = (len(payload) + CLIPBOARD_CHUNK_SIZE - 1) // CLIPBOARD_CHUNK_SIZE
+    for index in range(count):
+        chunk = payload[index * CLIPBOARD_CHUNK_SIZE:(index + 1) * CLIPBOARD_CHUNK_SIZE]
+        send_bulk('clipboard_from_client', {'id': content_hash, 'mime': mime, 'index': index, 'count': count, 'data': chunk})
 
 def clipboard_monitor_loop():
+    global last_clipboard_hash, clipboard_watcher
     logger.info("📋 CLIPBOARD_THREAD: Starting.")
-    recent_value = ""
-    try:
-        recent_value = pyperclip.paste()
-    except:
-        pass
-    while not all_threads_stop_event.is_set():
+    if GetClipboardSequenceNumber is None and os.environ.get('DISPLAY'):
         try:
-            current_value = pyperclip.paste()
-            if current_value != recent_value:
-                recent_value = current_value
-                sio.emit('clipboard_from_client', {'text': current_value})
-        except pyperclip.PyperclipException:
-            pass
+            clipboard_watcher = X11ClipboardWatcher()
+            logger.info("📋 CLIPBOARD_THREAD: Watching X11 clipboard ownership instead of hashing the clipboard.")
+        except OSError as e:
+            logger.info(f"📋 CLIPBOARD_THREAD: X11 clipboard events unavailable ({e}), polling the content.")
+    last_clipboard_hash = clipboard_hash(read_clipboard())
+    last_marker = clipboard_change_marker()
+    changed_at = None
+    interval = CLIPBOARD_POLL_MIN_INTERVAL
+    while not all_threads_stop_event.wait(interval):
+        try:
+            now = time.time()
+            marker = clipboard_change_marker()
+            if marker != last_marker:
+                # Restart the debounce window on every change so rapid copies only send the last one
+                last_marker, changed_at = marker, now
+                interval = CLIPBOARD_POLL_MIN_INTERVAL
+                continue
+            if changed_at is None:
+                if GetClipboardSequenceNumber is None and clipboard_watcher is None:
+                    interval = min(interval * 1.5, CLIPBOARD_POLL_MAX_INTERVAL)
+                continue
+            if now - changed_at < CLIPBOARD_DEBOUNCE or not session_ready.is_set():
+                continue
+            changed_at = None
+            content = read_clipboard()
+            content_hash = clipboard_hash(content)
+            if content is not None and content_hash != last_clipboard_hash:
+                last_clipboard_hash = content_hash
+                send_clipboard(content, content_hash)
         except Exception as e:
             logger.error(f"📋 CLIPBOARD_THREAD: Unhandled error: {e}")
-        time.sleep(1)
     logger.info("📋 CLIPBOARD_THREAD: Stopped.")
 
 def local_key_listener_loop():
@@ -281,47 +1524,93 @@ def local_key_listener_loop():
 @sio.event
 def connect():
     logger.info("🔗 Connected to server. Sending registration...")
-    sio.emit('register_client', {'token': ACCESS_PASSWORD})
+    sio.emit('register_client', {'token': ACCESS_PASSWORD, 'resume_token': resume_token})
 
 @sio.event
 def disconnect():
     global is_registered
-    logger.warning("❌ CLIENT: Disconnected from server. Stopping all tasks.")
+    logger.warning("❌ CLIENT: Disconnected from server. Capture stays warm while reconnecting.")
     is_registered = False
-    all_threads_stop_event.set()
+    session_ready.clear()
+    close_frame_socket()
+    connection_lost.set()
 
 @sio.on('registration_success')
-def on_registration_success():
-    global is_registered
+def on_registration_success(data=None):
+    global is_registered, resume_token, worker_threads_started
     if is_registered:
         return
+    data = data or {}
     is_registered = True
-    all_threads_stop_event.clear()
-    logger.info("✅ CLIENT: Successfully registered with server. Starting worker threads.")
-    threading.Thread(target=screen_capture_loop, name="ScreenCaptureThread", daemon=True).start()
-    threading.Thread(target=clipboard_monitor_loop, name="ClipboardThread", daemon=True).start()
-    threading.Thread(target=local_key_listener_loop, name="KeyListenerThread", daemon=True).start()
+    resume_token = data.get('resume_token')
+    threading.Thread(target=connect_bulk_lane, name="BulkLaneThread", daemon=True).start()
+    threading.Thread(target=connect_frame_socket, name="FrameSocketThread", daemon=True).start()
+    if data.get('resumed'):
+        # The server kept our session; viewers never saw us leave, so only resend what it did not receive
+        logger.info("✅ CLIENT: Session resumed, continuing the stream.")
+        resync_streams(data.get('last_seq') or {})
+    else:
+        logger.info("✅ CLIENT: Successfully registered with server. Starting worker threads.")
+        monitor_layers.clear()
+        sio.emit('monitor_list', {'monitors': discover_monitors(), 'default': CAPTURE_MONITOR_INDEX})
+        # Viewers of a new session start from nothing, so running streams must send full frames again
+        request_keyframes()
+        apply_watched_monitors()
+    if not worker_threads_started:
+        worker_threads_started = True
+        threading.Thread(target=capture_stats_loop, name="CaptureStatsThread", daemon=True).start()
+        if CPU_BUDGET_PERCENT:
+            threading.Thread(target=cpu_governor_loop, name="CpuGovernorThread", daemon=True).start()
+        threading.Thread(target=clipboard_monitor_loop, name="ClipboardThread", daemon=True).start()
+        threading.Thread(target=local_key_listener_loop, name="KeyListenerThread", daemon=True).start()
+    session_ready.set()
+
+@bulk_sio.on('connect', namespace=BULK_NAMESPACE)
+def on_bulk_connect():
+    bulk_sio.emit('register_bulk_client', {'token': ACCESS_PASSWORD}, namespace=BULK_NAMESPACE)
+
+@bulk_sio.on('bulk_registration_success', namespace=BULK_NAMESPACE)
+def on_bulk_registration_success():
+    global bulk_lane_ready, frames_in_flight
+    with frame_flow:
+        frames_in_flight = 0
+        frame_flow.notify_all()
+    bulk_lane_ready = True
+    logger.info("✅ CLIENT: Bulk lane registered. Frames and clipboard now bypass the control connection.")
+
+@bulk_sio.on('disconnect', namespace=BULK_NAMESPACE)
+def on_bulk_disconnect():
+    global bulk_lane_ready
+    bulk_lane_ready = False
+    logger.warning("⚠️  CLIENT: Bulk lane disconnected, falling back to the control connection.")
+    threading.Thread(target=connect_bulk_lane, name="BulkLaneThread", daemon=True).start()
 
 @sio.on('registration_fail')
 def on_registration_fail(data):
     logger.error(f"❌ CLIENT: Registration failed: {data.get('message')}. Shutting down.")
     logger.error(f"⚠️  Make sure password matches: '{ACCESS_PASSWORD}'")
+    all_threads_stop_event.set()
     sio.disconnect()
 
 @sio.on('command')
 def on_command(data):
     if not is_registered or platform.system() != "Windows":
         return
+    # The server delivers bursts as one ordered batch; older servers send single commands
+    for command in data.get('batch', [data]):
+        apply_command(command)
+    if data.get('input_ids'):
+        record_applied_inputs(data['input_ids'])
+
+def apply_command(data):
     action = data.get('action')
     try:
         if action == 'move':
-            x, y = data.get('x'), data.get('y')
-            if x is not None and y is not None:
-                move_mouse_ctypes(x, y)
+            if data.get('x') is not None and data.get('y') is not None:
+                move_mouse_ctypes(*to_desktop_coords(data))
         elif action == 'click':
-            x, y = data.get('x'), data.get('y')
-            if x is not None and y is not None:
-                move_mouse_ctypes(x, y)
+            if data.get('x') is not None and data.get('y') is not None:
+                move_mouse_ctypes(*to_desktop_coords(data))
                 time.sleep(0.01)
             click_mouse_ctypes(data.get('button', 'left'))
         elif action == 'scroll':
@@ -335,7 +1624,7 @@ def on_command(data):
             if key in CTYPES_VK_MAP:
                 release_key_ctypes(CTYPES_VK_MAP[key])
     except Exception as e:
-        logger.error(f"❌ CLIENT: Error processing command {data}: {e}")
+        log_sampled(('command', data.get('action')), logging.ERROR, "❌ CLIENT: Error processing command %s: %s", data, e)
 
 @sio.on('receive_injection_text')
 def on_receive_injection_text(data):
@@ -345,22 +1634,107 @@ def on_receive_injection_text(data):
 
 @sio.on('receive_settings_update')
 def on_settings_update(data):
-    global CLIENT_TARGET_FPS, JPEG_QUALITY
-    if 'fps' in data:
-        CLIENT_TARGET_FPS = data['fps']
-    if 'quality' in data:
-        JPEG_QUALITY = data['quality']
-    logger.info(f"⚙️  Settings updated: FPS={CLIENT_TARGET_FPS}, Quality={JPEG_QUALITY}")
+    global CLIENT_TARGET_FPS, JPEG_QUALITY, STREAM_CODEC, VIDEO_BITRATE
+    monitor_index = data.get('monitor')
+    # Rate and quality apply to one monitor's stream when it is named, otherwise to all of them
+    with monitor_streams_lock:
+        streams = [monitor_streams[monitor_index]] if monitor_index in monitor_streams else list(monitor_streams.values())
+        for stream in streams:
+            stream['fps'] = data.get('fps', stream['fps'])
+            stream['quality'] = data.get('quality', stream['quality'])
+    if monitor_index is None:
+        CLIENT_TARGET_FPS = data.get('fps', CLIENT_TARGET_FPS)
+        JPEG_QUALITY = data.get('quality', JPEG_QUALITY)
+    if 'bitrate' in data:
+        VIDEO_BITRATE = data['bitrate']
+        request_keyframes()
+    if 'codec' in data and data['codec'] != STREAM_CODEC:
+        if data['codec'] in VIDEO_CODECS and not VIDEO_AVAILABLE:
+            logger.warning(f"⚠️  {data['codec']} requested but PyAV is not installed (pip install av). Staying on {STREAM_CODEC}.")
+        elif data['codec'] in VIDEO_CODECS or data['codec'] == 'jpeg':
+            STREAM_CODEC = data['codec']
+            request_keyframes()
+    target = f"Monitor {monitor_index}" if monitor_index is not None else "All monitors"
+    log_sampled('settings', logging.INFO, "⚙️  Settings updated (%s): FPS=%s, Quality=%s, Codec=%s", target, data.get('fps', '-'), data.get('quality', '-'), STREAM_CODEC)
+
+@sio.on('request_keyframe')
+def on_request_keyframe(data=None):
+    request_keyframes((data or {}).get('monitor'))
+
+@sio.on('set_roi')
+def on_set_roi(data):
+    monitor_index = data.get('monitor')
+    if monitor_index is None:
+        monitor_index = CAPTURE_MONITOR_INDEX
+    if not 0 < monitor_index < len(available_monitors):
+        return
+    roi = clamp_roi(data.get('roi'), available_monitors[monitor_index])
+    with monitor_streams_lock:
+        monitor_rois[monitor_index] = roi
+        stream = monitor_streams.get(monitor_index)
+        if stream is not None:
+            stream['roi'] = roi
+    log_sampled('roi', logging.INFO, "🔍 Monitor %s region: %s", monitor_index, roi or 'full screen')
+
+@sio.on('set_wanted_layers')
+def on_set_wanted_layers(data):
+    monitor_index, layers = data.get('monitor'), set(data.get('layers') or range(len(SIMULCAST_LAYERS)))
+    monitor_layers[monitor_index] = layers
+    log_sampled('layers', logging.INFO, "🎚️ Monitor %s encoding layers: %s", monitor_index, sorted(layers))
+
+@sio.on('viewer_presence')
+def on_viewer_presence(data):
+    global viewers_watching
+    viewers_watching = bool(data.get('watching'))
+    # New capture threads start with a full frame (and a fresh video encoder), so resuming begins on a keyframe
+    logger.info("👀 Viewer connected, resuming capture." if viewers_watching else "💤 No viewers, capture paused.")
+    apply_watched_monitors()
+
+@sio.on('set_watched_monitors')
+def on_set_watched_monitors(data):
+    global watched_monitor_indices
+    indices = [index for index in data.get('monitors', []) if isinstance(index, int) and 0 <= index < len(available_monitors)]
+    watched_monitor_indices = indices or [CAPTURE_MONITOR_INDEX]
+    logger.info(f"📸 Watching monitors: {watched_monitor_indices}")
+    apply_watched_monitors()
 
 @sio.on('set_clipboard')
+@bulk_sio.on('set_clipboard', namespace=BULK_NAMESPACE)
 def on_set_clipboard(data):
+    global last_clipboard_hash, incoming_clipboard
     try:
-        pyperclip.copy(data.get('text', ''))
-        logger.info("📋 Clipboard updated by server")
+        if 'text' in data:
+            mime, payload = 'text/plain', data['text'].encode('utf-8')
+        else:
+            # Chunked content, in the same format send_clipboard() uses
+            count = data['count']
+            if count * CLIPBOARD_CHUNK_SIZE > CLIPBOARD_MAX_BYTES + CLIPBOARD_CHUNK_SIZE:
+                log_sampled('clipboard_size', logging.WARNING, "📋 Ignoring %s clipboard content of %s chunks (limit %s bytes)", data.get('mime'), count, CLIPBOARD_MAX_BYTES)
+                return
+            if incoming_clipboard is None or incoming_clipboard['id'] != data['id']:
+                incoming_clipboard = {'id': data['id'], 'parts': {}}
+            incoming_clipboard['parts'][data['index']] = data['data']
+            if len(incoming_clipboard['parts']) < count:
+                return
+            mime, payload = data['mime'], b''.join(incoming_clipboard['parts'][index] for index in range(count))
+            incoming_clipboard = None
+        if len(payload) > CLIPBOARD_MAX_BYTES:
+            logger.warning(f"📋 Ignoring {mime} clipboard content of {len(payload)} bytes (limit {CLIPBOARD_MAX_BYTES})")
+            return
+        # Remember what the server set so the monitor does not echo it straight back; images are
+        # re-encoded by the OS, so their hash is taken from what the clipboard holds afterwards
+        if mime == 'text/plain':
+            last_clipboard_hash = clipboard_hash((mime, payload))
+        write_clipboard(mime, payload)
+        if mime != 'text/plain':
+            last_clipboard_hash = clipboard_hash(read_clipboard())
+        logger.info(f"📋 Clipboard updated by server ({mime}, {len(payload)} bytes)")
     except Exception as e:
+        incoming_clipboard = None
         logger.error(f"❌ Failed to set clipboard: {e}")
 
 @sio.on('receive_file_chunk')
+@bulk_sio.on('receive_file_chunk', namespace=BULK_NAMESPACE)
 def on_receive_file_chunk(data):
     global current_file_handle
     try:
@@ -374,9 +1748,10 @@ def on_receive_file_chunk(data):
         if current_file_handle:
             current_file_handle.write(data['data'])
     except Exception as e:
-        logger.error(f"❌ Error writing file chunk for {data.get('name')}: {e}")
+        log_sampled('file_chunk', logging.ERROR, "❌ Error writing file chunk for %s: %s", data.get('name'), e)
 
 @sio.on('file_transfer_complete')
+@bulk_sio.on('file_transfer_complete', namespace=BULK_NAMESPACE)
 def on_file_transfer_complete(data):
     global current_file_handle
     if current_file_handle:
@@ -384,6 +1759,45 @@ def on_file_transfer_complete(data):
         current_file_handle = None
         logger.info(f"✅ File transfer complete: {data['name']} ({data['size']} bytes)")
 
+def http_transfer_pull(transfer_id, file_name):
+    """Stream an upload from the browser straight into the Downloads folder"""
+    file_path = os.path.join(downloads_path, os.path.basename(file_name))
+    request = urllib.request.Request(f"{SERVER_URL}/transfer/pull/{transfer_id}", headers={'X-Access-Token': ACCESS_PASSWORD})
+    try:
+        logger.info(f"📥 Receiving file over HTTP: {file_path}")
+        with urllib.request.urlopen(request, timeout=HTTP_TRANSFER_TIMEOUT) as response, open(file_path, 'wb') as f:
+            shutil.copyfileobj(response, f, HTTP_TRANSFER_CHUNK_SIZE)
+        logger.info(f"✅ File transfer complete: {file_name} ({os.path.getsize(file_path)} bytes)")
+    except Exception as e:
+        logger.error(f"❌ Streamed upload of {file_name} failed: {e}")
+
+def http_transfer_push(transfer_id, path):
+    """Stream a local file to the browser that requested it"""
+    try:
+        size = os.path.getsize(path)
+        f = open(path, 'rb')
+    except OSError as e:
+        logger.error(f"❌ Cannot send {path}: {e}")
+        sio.emit('http_transfer_failed', {'id': transfer_id, 'message': e.strerror or str(e)})
+        return
+    headers = {'X-Access-Token': ACCESS_PASSWORD, 'Content-Type': 'application/octet-stream', 'Content-Length': str(size)}
+    request = urllib.request.Request(f"{SERVER_URL}/transfer/push/{transfer_id}", data=f, headers=headers, method='POST')
+    try:
+        logger.info(f"📤 Sending file over HTTP: {path} ({size} bytes)")
+        with f, urllib.request.urlopen(request, timeout=HTTP_TRANSFER_TIMEOUT) as response:
+            response.read()
+        logger.info(f"✅ File sent: {path}")
+    except Exception as e:
+        logger.error(f"❌ Streamed download of {path} failed: {e}")
+
+@sio.on('http_transfer_offer')
+def on_http_transfer_offer(data):
+    threading.Thread(target=http_transfer_pull, args=(data['id'], data['name']), name="HttpTransferThread", daemon=True).start()
+
+@sio.on('http_transfer_request')
+def on_http_transfer_request(data):
+    threading.Thread(target=http_transfer_push, args=(data['id'], data['path']), name="HttpTransferThread", daemon=True).start()
+
 # --- AI-Related Event Handlers ---
 @sio.on('ai_mode_changed')
 def on_ai_mode_changed(data):
@@ -432,14 +1846,17 @@ def on_ai_answer_ready(data):
     ai_answer_type = answer_type
 
 def main():
+    global STREAM_CODEC
     threading.current_thread().name = "MainThread"
     print("=" * 60)
     print("🤖 AI-Enhanced Remote Control Client")
     print("=" * 60)
     logger.info(f"🔗 Server URL: {SERVER_URL}")
     logger.info(f"🔐 Password: {ACCESS_PASSWORD}")
-    logger.info(f"📸 Monitor: {CAPTURE_MONITOR_INDEX}")
-    logger.info(f"⚙️  FPS: {CLIENT_TARGET_FPS}, Quality: {JPEG_QUALITY}")
+    logger.info(f"📸 Default monitor: {CAPTURE_MONITOR_INDEX}")
+    logger.info(f"⚙️  FPS: {CLIENT_TARGET_FPS}, Quality: {JPEG_QUALITY}, Codec: {STREAM_CODEC}")
+    if CPU_BUDGET_PERCENT:
+        logger.info(f"🐢 CPU budget: {CPU_BUDGET_PERCENT}% of one core")
     print("=" * 60)
     print("⌨️  HOTKEYS:")
     print("   F2 = Type stored text (manual or AI answers)")
@@ -461,14 +1878,29 @@ def main():
     if platform.system() != "Windows":
         logger.warning("⚠️  Non-Windows OS - Mouse/Keyboard control unavailable")
     
+    if STREAM_CODEC in VIDEO_CODECS and not VIDEO_AVAILABLE:
+        logger.warning(f"⚠️  STREAM_CODEC is {STREAM_CODEC} but PyAV is not installed (pip install av). Using JPEG.")
+        STREAM_CODEC = 'jpeg'
+    select_jpeg_encoder()
+    
     try:
-        logger.info(f"🔗 Connecting to {SERVER_URL}...")
-        sio.connect(SERVER_URL, transports=['websocket'], wait_timeout=20)
-        logger.info("✅ Connected successfully!")
-        sio.wait()
-    except socketio.exceptions.ConnectionError as e:
-        logger.critical(f"❌ FATAL: Connection failed: {e}")
-        logger.critical("💡 Check your SERVER_URL and internet connection")
+        delays = backoff_delays()
+        while not all_threads_stop_event.is_set():
+            connection_lost.clear()
+            try:
+                logger.info(f"🔗 Connecting to {SERVER_URL}...")
+                sio.connect(SERVER_URL, transports=['websocket'], wait_timeout=20)
+                logger.info("✅ Connected successfully!")
+                delays = backoff_delays()
+                while not connection_lost.wait(1):
+                    pass
+            except socketio.exceptions.ConnectionError as e:
+                log_sampled('connect', logging.ERROR, "❌ Connection failed: %s (check your SERVER_URL and internet connection)", e)
+            if all_threads_stop_event.is_set():
+                break
+            delay = next(delays)
+            logger.info(f"🔄 Reconnecting in {delay * 1000:.0f} ms...")
+            time.sleep(delay)
     except KeyboardInterrupt:
         logger.info("🛑 Shutdown requested by user (Ctrl+C)")
     except Exception as e:
@@ -476,6 +1908,9 @@ def main():
     finally:
         logger.info("🛑 Initiating shutdown...")
         all_threads_stop_event.set()
+        stop_monitor_streams()
+        if bulk_sio.connected:
+            bulk_sio.disconnect()
         if sio.connected:
             sio.disconnect()
         logger.info("✅ Client shutdown complete")
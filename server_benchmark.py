@@ -0,0 +1,187 @@
+"""Side-by-side relay benchmark for the two server modes: app.py (Flask-SocketIO on eventlet)
+and async_app.py (python-socketio AsyncServer on aiohttp).
+
+Starts each server as a subprocess on a free port, connects a synthetic remote PC and a number
+of logged-in viewers with python-socketio clients, and relays fixed-size frames on the bulk lane
+the way the real client does (each frame waits for the previous one's acknowledgement). Reports
+delivered frames/s, PC-to-viewer latency percentiles and the server process's CPU time from
+/proc, so the modes compare as relay throughput per core. Needs Redis at REDIS_URL and the
+server requirements; Linux only because of /proc.
+
+    python server_benchmark.py                                 # both modes, default load
+    python server_benchmark.py --viewers 8 --fps 0             # unpaced: as fast as acks allow
+    python server_benchmark.py --modes asyncio --json out.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import socketio
+
+from server_common import ACCESS_PASSWORD, BULK_NAMESPACE
+
+# --- Configuration ---
+MODES = {'eventlet': 'app.py', 'asyncio': 'async_app.py'}
+DEFAULT_VIEWERS = 4
+DEFAULT_FPS = 60            # Frames/s the PC tries to send; 0 sends the next frame as soon as the last is acknowledged
+DEFAULT_FRAME_KB = 80       # Roughly a 1080p JPEG at the client's default quality
+DEFAULT_DURATION = 10       # Seconds of relaying per mode
+STARTUP_TIMEOUT = 30        # Seconds to wait for a server to answer HTTP
+DRAIN_TIME = 1              # Seconds to let in-flight frames arrive before counting
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Helpers ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc/<pid>/stat"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def wait_for_server(base_url, server):
+    deadline = time.time() + STARTUP_TIMEOUT
+    async with aiohttp.ClientSession() as http:
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with code {server.returncode}")
+            try:
+                async with http.get(base_url + '/') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start in time")
+
+async def login_cookie(base_url):
+    """Log in like a browser and return the Cookie header value for Socket.IO connections"""
+    async with aiohttp.ClientSession() as http:
+        async with http.post(base_url + '/', data={'password': ACCESS_PASSWORD}, allow_redirects=False) as response:
+            return '; '.join(f"{name}={morsel.value}" for name, morsel in response.cookies.items())
+
+# --- Synthetic Clients ---
+async def connect_viewer(base_url, cookie, stats):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on('screen_frame_bytes', namespace=BULK_NAMESPACE)
+    async def on_frame(data, meta=None):
+        stats['frames'] += 1
+        stats['bytes'] += len(data)
+        if meta and meta.get('sent_at'):
+            stats['latencies'].append((time.time() - meta['sent_at']) * 1000)
+        return True  # Acknowledges layered frames, like the viewer page
+
+    await client.connect(base_url, headers={'Cookie': cookie}, namespaces=['/', BULK_NAMESPACE], transports=['websocket'])
+    await client.emit('watch_monitors', {'monitors': [0]}, namespace=BULK_NAMESPACE)
+    return client
+
+async def connect_pc(base_url):
+    client = socketio.AsyncClient(reconnection=False)
+    registered, bulk_registered = asyncio.Event(), asyncio.Event()
+    client.on('registration_success', lambda data: registered.set())
+    client.on('bulk_registration_success', lambda *args: bulk_registered.set(), namespace=BULK_NAMESPACE)
+    await client.connect(base_url, namespaces=['/', BULK_NAMESPACE], transports=['websocket'])
+    await client.emit('register_client', {'token': ACCESS_PASSWORD})
+    await asyncio.wait_for(registered.wait(), 10)
+    await client.emit('monitor_list', {'monitors': [{'index': 0, 'width': 1920, 'height': 1080}], 'default': 0})
+    await client.emit('register_bulk_client', {'token': ACCESS_PASSWORD}, namespace=BULK_NAMESPACE)
+    await asyncio.wait_for(bulk_registered.wait(), 10)
+    return client
+
+async def send_frames(pc, payload, fps, duration):
+    sent = 0
+    interval = 1 / fps if fps else 0
+    started = time.time()
+    while time.time() - started < duration:
+        meta = {'monitor': 0, 'seq': sent, 'sent_at': time.time()}
+        await pc.call('screen_data_bytes', (payload, meta), namespace=BULK_NAMESPACE, timeout=10)
+        sent += 1
+        delay = started + sent * interval - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    return sent, time.time() - started
+
+# --- Benchmark ---
+async def run_mode(mode, viewers, fps, frame_kb, duration):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, MODES[mode])], cwd=SCRIPT_DIR,
+                              env=dict(os.environ, PORT=str(port)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    clients = []
+    try:
+        await wait_for_server(base_url, server)
+        cookie = await login_cookie(base_url)
+        viewer_stats = [{'frames': 0, 'bytes': 0, 'latencies': []} for _ in range(viewers)]
+        for stats in viewer_stats:
+            clients.append(await connect_viewer(base_url, cookie, stats))
+        pc = await connect_pc(base_url)
+        clients.append(pc)
+        await asyncio.sleep(0.5)  # Let watch_monitors and room joins settle
+
+        cpu_before = process_cpu_seconds(server.pid)
+        sent, elapsed = await send_frames(pc, os.urandom(frame_kb * 1024), fps, duration)
+        await asyncio.sleep(DRAIN_TIME)
+        cpu_seconds = process_cpu_seconds(server.pid) - cpu_before
+    finally:
+        for client in clients:
+            await client.disconnect()
+        server.terminate()
+        server.wait()
+
+    delivered = sum(stats['frames'] for stats in viewer_stats)
+    latencies = sorted(latency for stats in viewer_stats for latency in stats['latencies'])
+    return {
+        'sent_fps': sent / elapsed,
+        'delivered_fps': delivered / elapsed,
+        'delivered_ratio': delivered / (sent * viewers) if sent and viewers else 0,
+        'latency_ms': {'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99)},
+        'server_cpu_seconds': cpu_seconds,
+        'deliveries_per_cpu_second': delivered / cpu_seconds if cpu_seconds else None,
+    }
+
+def format_ms(value):
+    return f"{value:>7.1f}" if value is not None else f"{'-':>7}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--viewers', type=int, default=DEFAULT_VIEWERS)
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS)
+    parser.add_argument('--frame-kb', type=int, default=DEFAULT_FRAME_KB)
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION)
+    parser.add_argument('--json', help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'mode':<10} {'sent/s':>8} {'recv/s':>8} {'recv %':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'cpu s':>7} {'recv/cpu-s':>11}")
+    for mode in args.modes:
+        result = asyncio.run(run_mode(mode, args.viewers, args.fps, args.frame_kb, args.duration))
+        results[mode] = result
+        latency = result['latency_ms']
+        per_cpu = result['deliveries_per_cpu_second']
+        print(f"{mode:<10} {result['sent_fps']:>8.1f} {result['delivered_fps']:>8.1f} {result['delivered_ratio'] * 100:>6.1f}% "
+              f"{format_ms(latency['p50'])} {format_ms(latency['p95'])} {format_ms(latency['p99'])} "
+              f"{result['server_cpu_seconds']:>7.2f} {'-' if per_cpu is None else round(per_cpu):>11}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved results to {args.json}")
+
+if __name__ == '__main__':
+    main()
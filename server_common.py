@@ -0,0 +1,1031 @@
+"""Framework-independent pieces shared by the two server entry points: app.py (Flask-SocketIO on
+eventlet) and async_app.py (python-socketio's AsyncServer on aiohttp). Nothing here does network
+or Redis I/O at import time, so either server can import it before its own setup."""
+import os
+import sys
+import time
+import logging
+import logging.handlers
+import queue
+import atexit
+import asyncio
+import json
+import struct
+import bisect
+import math
+import gzip
+import hashlib
+import base64
+import re
+
+import aiohttp
+
+# Optional Brotli compression for viewer assets (gzip is always available)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- Logging Setup ---
+# Records go through a bounded queue to a background writer thread, so a slow stdout never
+# blocks the event loop (eventlet hub or asyncio); when the queue is full, new records are dropped and counted.
+# Hot paths (frames, input, chunks, settings) log through log_sampled() to stay rate-limited.
+LOG_JSON = os.environ.get('LOG_JSON') == '1'  # Emit one JSON object per line instead of plain text
+LOG_QUEUE_SIZE = 10000  # Records buffered for the writer before new ones are dropped
+LOG_SAMPLE_INTERVAL = 5  # Seconds between repeats of the same rate-limited message
+log_format = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'where': f"{record.filename}:{record.lineno}", 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+log_writer = logging.StreamHandler(sys.stdout)
+log_writer.setFormatter(JsonLogFormatter() if LOG_JSON else logging.Formatter(log_format))
+log_queue_handler = DroppingQueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Only merges args (and tracebacks) before queueing
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler], force=True)
+log_listener = logging.handlers.QueueListener(log_queue, log_writer)
+log_listener.start()
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
+log_sample_state = {}  # Key -> (last logged at, repeats suppressed since)
+
+def log_sampled(key, level, message, *args):
+    """Log at most once per LOG_SAMPLE_INTERVAL for key, noting how many repeats were suppressed"""
+    now = time.monotonic()
+    last_logged, suppressed = log_sample_state.get(key, (None, 0))
+    if last_logged is not None and now - last_logged < LOG_SAMPLE_INTERVAL:
+        log_sample_state[key] = (last_logged, suppressed + 1)
+        return
+    log_sample_state[key] = (now, 0)
+    if suppressed:
+        message, args = message + " (%d similar suppressed)", args + (suppressed,)
+    logger.log(level, message, *args, stacklevel=2)
+
+# --- HARDCODED Configuration ---
+SECRET_KEY = 'super_secret_flask_key_12345_hardcoded'
+ACCESS_PASSWORD = 'mypassword123'  # Change this to your desired password
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')  # Will use Render's Redis if available
+ANTHROPIC_API_KEY = 'sk-ant-REDACTED'  # Your API key
+
+# --- Redis Key Management ---
+CLIENT_REDIS_KEY = f"remote_client_sid:{ACCESS_PASSWORD}"
+CLIENT_BULK_REDIS_KEY = f"remote_client_bulk_sid:{ACCESS_PASSWORD}"
+MONITORS_KEY = f"remote_client_monitors:{ACCESS_PASSWORD}"
+AI_ENABLED_KEY = f"ai_enabled:{ACCESS_PASSWORD}"
+AI_ANSWER_KEY = f"ai_answer:{ACCESS_PASSWORD}"
+
+# --- Claude AI Configuration ---
+CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+
+SYSTEM_PROMPT = """You are an AI assistant that analyzes screenshots to help answer questions. 
+
+CRITICAL INSTRUCTIONS:
+1. Look at the screenshot carefully
+2. Identify any questions, problems, or tasks shown
+3. Provide ONLY the direct answer - no explanations, no reasoning, no additional text
+4. Format your response as: answer=[your answer here]
+5. If it's a multiple choice question, give the letter/option (e.g., answer=B)
+6. If it's a math problem, give the number (e.g., answer=42)
+7. If it's a short answer, give the exact answer (e.g., answer=photosynthesis)
+8. If it's an essay question or requires a long response, write the full response after the equals sign
+
+Examples:
+- For "What is 2+2?" respond: answer=4
+- For "Which is correct? A) Dog B) Cat" respond: answer=A
+- For "Explain photosynthesis" respond: answer=Photosynthesis is the process by which plants convert sunlight into energy...
+
+Be precise and direct. Only provide what is asked for."""
+
+# --- AI Helper Functions ---
+async def analyze_screenshot_with_claude(image_base64):
+    """Send screenshot to Claude API for analysis"""
+    if not ANTHROPIC_API_KEY:
+        logger.error("ANTHROPIC_API_KEY not set")
+        return None
+    
+    # Use hostname for HTTPS requests to avoid SSL issues
+    api_url = "https://api.anthropic.com/v1/messages"
+    headers = {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "content-type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+    
+    payload = {
+        "model": CLAUDE_MODEL,
+        "max_tokens": 2000,
+        "system": SYSTEM_PROMPT,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Please analyze this screenshot and provide the answer to any question or problem you see. Follow the format: answer=[your answer]"
+                    },
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": "image/jpeg",
+                            "data": image_base64
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+    
+    try:
+        # Create a longer timeout and better error handling
+        timeout = aiohttp.ClientTimeout(total=60, connect=30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(api_url, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    content = result.get('content', [])
+                    if content and len(content) > 0:
+                        return content[0].get('text', '')
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Claude API error {response.status}: {error_text}")
+                    return None
+    except asyncio.TimeoutError:
+        logger.error("Claude API request timed out")
+        return None
+    except Exception as e:
+        logger.error(f"Error calling Claude API: {e}")
+        return None
+
+def parse_ai_answer(ai_response):
+    """Parse AI response to extract answer and determine if it's clickable or essay"""
+    if not ai_response:
+        return None, None, None
+    
+    # Look for answer= pattern
+    if "answer=" in ai_response.lower():
+        answer_start = ai_response.lower().find("answer=") + 7
+        answer = ai_response[answer_start:].strip()
+        
+        # Determine if it's a clickable answer (single letter/number) or essay
+        if len(answer) <= 5 and (answer.isalnum() or answer in ['A', 'B', 'C', 'D', 'E', 'True', 'False']):
+            return answer, "clickable", ai_response
+        else:
+            return answer, "essay", ai_response
+    
+    return None, None, ai_response
+
+# --- Authentication ---
+def check_auth(password):
+    return password == ACCESS_PASSWORD
+
+# --- HTML Templates ---
+# Pages reference their CSS/JS as separate assets; see "Static Viewer Assets" for how they are built and served.
+UTILITY_CSS = r"""
+*, ::before, ::after { box-sizing: border-box; border-width: 0; border-style: solid; border-color: #e5e7eb; }
+html { line-height: 1.5; -webkit-text-size-adjust: 100%; font-family: Inter, ui-sans-serif, system-ui, -apple-system, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif; }
+body { margin: 0; line-height: inherit; }
+h1 { font-size: inherit; font-weight: inherit; margin: 0; }
+p { margin: 0; }
+a { color: inherit; text-decoration: inherit; }
+button, input, select, textarea { font-family: inherit; font-size: 100%; line-height: inherit; color: inherit; margin: 0; padding: 0; }
+button { background-color: transparent; background-image: none; cursor: pointer; }
+input::placeholder, textarea::placeholder { color: #9ca3af; }
+canvas { display: block; }
+.block { display: block; } .flex { display: flex; } .relative { position: relative; }
+.flex-col { flex-direction: column; } .flex-shrink-0 { flex-shrink: 0; }
+.items-center { align-items: center; } .self-center { align-self: center; }
+.justify-between { justify-content: space-between; } .justify-center { justify-content: center; } .justify-end { justify-content: flex-end; }
+.space-x-2 > :not([hidden]) ~ :not([hidden]) { margin-left: 0.5rem; } .space-x-4 > :not([hidden]) ~ :not([hidden]) { margin-left: 1rem; }
+.w-20 { width: 5rem; } .w-64 { width: 16rem; } .w-full { width: 100%; } .max-w-sm { max-width: 24rem; } .h-14 { height: 3.5rem; } .h-screen { height: 100vh; }
+.p-2 { padding: 0.5rem; } .p-3 { padding: 0.75rem; } .p-8 { padding: 2rem; }
+.px-1 { padding-left: 0.25rem; padding-right: 0.25rem; } .px-2 { padding-left: 0.5rem; padding-right: 0.5rem; } .px-4 { padding-left: 1rem; padding-right: 1rem; }
+.py-1 { padding-top: 0.25rem; padding-bottom: 0.25rem; } .py-2 { padding-top: 0.5rem; padding-bottom: 0.5rem; } .py-3 { padding-top: 0.75rem; padding-bottom: 0.75rem; }
+.mb-2 { margin-bottom: 0.5rem; } .mb-4 { margin-bottom: 1rem; } .mb-6 { margin-bottom: 1.5rem; } .mt-2 { margin-top: 0.5rem; } .mt-4 { margin-top: 1rem; }
+.ml-2 { margin-left: 0.5rem; } .mr-auto { margin-right: auto; }
+.border { border-width: 1px; } .border-gray-300 { border-color: #d1d5db; } .border-red-400 { border-color: #f87171; }
+.rounded { border-radius: 0.25rem; } .rounded-md { border-radius: 0.375rem; } .rounded-lg { border-radius: 0.5rem; }
+.shadow-md { box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1), 0 2px 4px -2px rgba(0, 0, 0, 0.1); }
+.bg-white { background-color: #fff; } .bg-gray-100 { background-color: #f3f4f6; } .bg-gray-200 { background-color: #e5e7eb; } .bg-gray-800 { background-color: #1f2937; }
+.bg-blue-600 { background-color: #2563eb; } .bg-red-100 { background-color: #fee2e2; } .bg-red-600 { background-color: #dc2626; }
+.text-xs { font-size: 0.75rem; line-height: 1rem; } .text-sm { font-size: 0.875rem; line-height: 1.25rem; } .text-lg { font-size: 1.125rem; line-height: 1.75rem; } .text-2xl { font-size: 1.5rem; line-height: 2rem; }
+.text-center { text-align: center; } .font-medium { font-weight: 500; } .font-semibold { font-weight: 600; }
+.text-white { color: #fff; } .text-gray-400 { color: #9ca3af; } .text-gray-600 { color: #4b5563; } .text-gray-700 { color: #374151; } .text-gray-800 { color: #1f2937; }
+.text-green-600 { color: #16a34a; } .text-red-700 { color: #b91c1c; }
+.underline { text-decoration-line: underline; }
+.cursor-pointer { cursor: pointer; }
+.transition { transition-property: color, background-color, border-color, text-decoration-color, fill, stroke, opacity, box-shadow, transform, filter; transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); transition-duration: 150ms; }
+.duration-200 { transition-duration: 200ms; } .ease-in-out { transition-timing-function: cubic-bezier(0.4, 0, 0.2, 1); }
+.hover\:bg-blue-700:hover { background-color: #1d4ed8; } .hover\:bg-red-700:hover { background-color: #b91c1c; }
+.focus\:outline-none:focus { outline: 2px solid transparent; outline-offset: 2px; } .focus\:border-transparent:focus { border-color: transparent; }
+.focus\:ring-2:focus { box-shadow: 0 0 0 2px var(--ring-color, #3b82f6); } .focus\:ring-blue-500:focus { --ring-color: #3b82f6; }
+@media (min-width: 640px) { .sm\:inline { display: inline; } }
+"""
+
+LOGIN_HTML = """
+<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Remote Control - Login</title><link rel="stylesheet" href="{{ assets.utility_css }}"></head><body class="bg-gray-100 flex items-center justify-center h-screen"><div class="bg-white p-8 rounded-lg shadow-md w-full max-w-sm"><h1 class="text-2xl font-semibold text-center text-gray-700 mb-6">Remote Access Login</h1>{% if error %}<div class="bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded relative mb-4" role="alert"><span class="block sm:inline">{{ error }}</span></div>{% endif %}<form method="POST" action="{{ url_for('index') }}"><div class="mb-4"><label for="password" class="block text-gray-700 text-sm font-medium mb-2">Password</label><input type="password" id="password" name="password" required class="w-full px-4 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent" placeholder="Enter access password"></div><button type="submit" class="w-full bg-blue-600 hover:bg-blue-700 text-white font-semibold py-2 px-4 rounded-md transition duration-200 ease-in-out">Login</button></form><div class="mt-4 text-center text-sm text-gray-600">Password: mypassword123</div></div></body></html>
+"""
+
+INTERFACE_CSS = """
+#main-content { display: flex; flex-direction: column; height: calc(100vh - 3.5rem); }
+#screen-view-area { flex-grow: 1; background-color: #000; overflow: hidden; position: relative; transition: height 0.3s ease-in-out; }
+#text-input-area { height: 0; overflow: hidden; background-color: #f9fafb; padding:0; transition: height 0.3s ease-in-out; }
+body.text-input-mode #screen-view-area { height: 50%; } body.text-input-mode #text-input-area { height: 50%; padding: 1rem; }
+#screen-view-area canvas { max-width: 100%; max-height: 100%; height: auto; width: auto; display: block; cursor: crosshair; object-fit: contain; }
+#screen-view-area.tiled { display: flex; flex-wrap: wrap; align-content: flex-start; gap: 2px; }
+#screen-view-area.tiled canvas { max-width: calc(50% - 1px); max-height: calc(50% - 1px); }
+.status-dot { height: 10px; width: 10px; border-radius: 50%; display: inline-block; margin-right: 5px; }
+.status-connected { background-color: #4ade80; } .status-disconnected { background-color: #f87171; } .status-connecting { background-color: #fbbf24; }
+.control-button { padding: 0.5rem 1rem; background-color: #2563eb; color: white; border: none; border-radius: 0.375rem; cursor: pointer; transition: background-color 0.2s; margin-right: 0.5rem; }
+.control-button:hover { background-color: #1d4ed8; } .control-button.active { background-color: #16a34a; } .control-button.active:hover { background-color: #15803d; }
+.ai-button { background-color: #7c3aed; } .ai-button:hover { background-color: #6d28d9; } .ai-button.active { background-color: #059669; }
+#injection-text { width: 100%; flex-grow: 1; padding: 0.75rem; border: 1px solid #d1d5db; border-radius: 0.375rem; font-family: monospace; resize: none; }
+input[type=range] { -webkit-appearance: none; background: transparent; cursor: pointer; }
+input[type=range]::-webkit-slider-runnable-track { height: 4px; background: #60a5fa; border-radius: 2px; }
+input[type=range]::-webkit-slider-thumb { -webkit-appearance: none; appearance: none; margin-top: -6px; background-color: #1d4ed8; height: 16px; width: 16px; border-radius: 50%; }
+#file-progress-container { position: fixed; bottom: 1rem; left: 50%; transform: translateX(-50%); background-color: rgba(0,0,0,0.7); color: white; padding: 0.5rem 1rem; border-radius: 8px; z-index: 100; display: none; }
+#file-progress-bar { width: 200px; height: 10px; background-color: #555; border-radius: 5px; overflow: hidden; }
+#file-progress { width: 0%; height: 100%; background-color: #4ade80; transition: width 0.2s; }
+#ai-status { position: fixed; top: 4rem; right: 1rem; background-color: rgba(0,0,0,0.8); color: white; padding: 0.5rem 1rem; border-radius: 8px; z-index: 100; display: none; }
+.ai-thinking { background-color: #7c3aed; animation: pulse 2s infinite; }
+@keyframes pulse { 0%, 100% { opacity: 1; } 50% { opacity: 0.5; } }
+#input-latency-histogram { position: fixed; top: 4rem; left: 1rem; background-color: rgba(0,0,0,0.8); color: white; padding: 0.5rem 1rem; border-radius: 8px; z-index: 100; display: none; font-family: monospace; font-size: 0.75rem; white-space: pre; }
+#playback-bar { position: fixed; bottom: 1rem; left: 50%; transform: translateX(-50%); background-color: rgba(0,0,0,0.8); color: white; padding: 0.25rem 0.75rem; border-radius: 8px; z-index: 100; display: none; align-items: center; gap: 0.75rem; font-size: 0.75rem; }
+#stream-stats { position: fixed; bottom: 1rem; right: 1rem; background-color: rgba(0,0,0,0.8); color: white; padding: 0.25rem 0.75rem; border-radius: 8px; z-index: 100; display: none; font-family: monospace; font-size: 0.75rem; white-space: pre; }
+.instructions { background-color: #eff6ff; border: 1px solid #3b82f6; border-radius: 0.5rem; padding: 0.75rem; margin: 0.5rem; font-size: 0.875rem; }
+"""
+
+INTERFACE_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>AI-Enhanced Remote Desktop</title>
+    <link rel="stylesheet" href="{{ assets.utility_css }}">
+    <link rel="stylesheet" href="{{ assets.interface_css }}">
+    <script defer src="{{ assets.socketio_js }}"{% if assets.socketio_sri %} integrity="{{ assets.socketio_sri }}" crossorigin="anonymous"{% endif %}></script>
+    <script defer src="{{ assets.interface_js }}"></script>
+</head>
+<body class="bg-gray-200 flex flex-col h-screen" tabindex="0">
+    <header class="bg-gray-800 text-white p-3 flex justify-between items-center shadow-md flex-shrink-0 h-14">
+        <h1 class="text-lg font-semibold">🤖 AI Remote Desktop</h1>
+        <div class="flex items-center space-x-4">
+            <span id="monitor-buttons" class="flex items-center"></span>
+            <div class="flex items-center space-x-2 text-xs">
+                <span title="Image Quality">Q:</span> <input type="range" id="quality-slider" min="10" max="95" value="75" class="w-20">
+                <span title="Frames Per Second">FPS:</span> <input type="range" id="fps-slider" min="1" max="30" value="5" class="w-20">
+                <select id="codec-select" class="text-gray-800 rounded px-1" title="Stream encoding"><option value="jpeg">JPEG</option><option value="h264">H.264</option><option value="vp8">VP8</option></select>
+            </div>
+            <button id="ai-toggle-button" class="control-button ai-button text-xs" title="Toggle AI Assistant (F4 to analyze screen)">🤖 AI Off</button>
+            <button id="upload-file-button" class="control-button text-xs">Upload File</button>
+            <input type="file" id="file-input" style="display: none;">
+            <button id="download-file-button" class="control-button text-xs">Download File</button>
+            <button id="toggle-text-mode-button" class="control-button text-xs">Text Input</button>
+            <button id="stats-toggle-button" class="control-button text-xs" title="Show stream stats">📊</button>
+            <div id="connection-status" class="flex items-center text-xs">
+                <span id="status-dot" class="status-dot status-connecting"></span>
+                <span id="status-text">Connecting...</span>
+                <span id="latency-text" class="ml-2 text-gray-400">(---ms)</span>
+                <span id="input-latency-text" class="ml-2 text-gray-400 cursor-pointer" title="Input-to-display latency (click for histogram)">input ---ms</span>
+            </div>
+            <a href="{{ url_for('logout') }}" class="bg-red-600 hover:bg-red-700 text-white text-xs font-medium py-1 px-2 rounded-md">Logout</a>
+        </div>
+    </header>
+    
+    <div class="instructions">
+        📖 <strong>Instructions:</strong> 
+        1️⃣ Click 🤖 AI button to enable AI assistant | 
+        2️⃣ On client: Press <strong>F4</strong> to analyze screenshot | 
+        3️⃣ AI auto-clicks answers or stores essays | 
+        4️⃣ Press <strong>F2</strong> to type stored text
+    </div>
+    
+    <main id="main-content" class="p-2">
+        <div id="screen-view-area"></div>
+        <div id="text-input-area" class="flex flex-col">
+            <textarea id="injection-text" placeholder="🤖 AI answers appear here automatically. Manual text also works. Press F2 on client to type this text."></textarea>
+            <div class="mt-2 flex justify-end">
+                <p id="injection-status" class="text-xs text-green-600 mr-auto self-center"></p>
+                <button id="send-injection-text-button" class="control-button text-sm">Save Text</button>
+            </div>
+        </div>
+    </main>
+    <div id="file-progress-container">
+        <span id="file-name-progress"></span>
+        <div id="file-progress-bar"><div id="file-progress"></div></div>
+        <span id="file-percent-progress">0%</span>
+    </div>
+    <div id="ai-status">🤖 AI is thinking...</div>
+    <div id="input-latency-histogram"></div>
+    <div id="stream-stats"></div>
+    <div id="playback-bar">
+        <span>⏺️ Playback</span>
+        <input type="range" id="playback-seek" min="0" max="0" value="0" step="1" class="w-64">
+        <span id="playback-time">0:00 / 0:00</span>
+        <span id="playback-event" class="text-gray-400"></span>
+        <a href="/interface" class="underline">Back to live</a>
+    </div>
+</body>
+</html>
+"""
+
+INTERFACE_JS = """
+document.addEventListener('DOMContentLoaded', () => {
+    const socket = io(window.location.origin, { path: '/socket.io/' });
+    // Screen frames and clipboard payloads arrive on a separate connection so they never delay input
+    const bulkSocket = io(window.location.origin + '/bulk', { path: '/socket.io/', forceNew: true });
+    const screenViewArea = document.getElementById('screen-view-area');
+    const monitorButtons = document.getElementById('monitor-buttons');
+    const statusDot = document.getElementById('status-dot');
+    const statusText = document.getElementById('status-text');
+    const latencyText = document.getElementById('latency-text');
+    const toggleTextModeButton = document.getElementById('toggle-text-mode-button');
+    const qualitySlider = document.getElementById('quality-slider');
+    const fpsSlider = document.getElementById('fps-slider');
+    const codecSelect = document.getElementById('codec-select');
+    const uploadButton = document.getElementById('upload-file-button');
+    const fileInput = document.getElementById('file-input');
+    const downloadButton = document.getElementById('download-file-button');
+    const aiToggleButton = document.getElementById('ai-toggle-button');
+    const aiStatus = document.getElementById('ai-status');
+    const injectionText = document.getElementById('injection-text');
+    const inputLatencyText = document.getElementById('input-latency-text');
+    const inputLatencyHistogram = document.getElementById('input-latency-histogram');
+    const statsToggleButton = document.getElementById('stats-toggle-button');
+    const streamStatsOverlay = document.getElementById('stream-stats');
+    // /interface?playback=<recording id> shows a recorded session instead of the live PC; nothing is sent to the PC
+    const playbackId = new URLSearchParams(window.location.search).get('playback');
+    
+    let aiEnabled = false;
+    
+    document.body.focus();
+    document.addEventListener('click', (e) => { if (document.getElementById('text-input-area').contains(e.target)) return; document.body.focus(); });
+    
+    function updateStatus(status, message) { statusText.textContent = message; statusDot.className = `status-dot ${status}`; }
+    function cleanupState() { renderers.forEach((renderer) => renderer.reset()); }
+    
+    function showAiStatus() {
+        aiStatus.style.display = 'block';
+        aiStatus.className = 'ai-thinking';
+    }
+    
+    function hideAiStatus() {
+        aiStatus.style.display = 'none';
+        aiStatus.className = '';
+    }
+    
+    // AI Toggle
+    aiToggleButton.addEventListener('click', () => {
+        aiEnabled = !aiEnabled;
+        aiToggleButton.textContent = aiEnabled ? '🤖 AI On' : '🤖 AI Off';
+        aiToggleButton.className = aiEnabled ? 'control-button ai-button text-xs active' : 'control-button ai-button text-xs';
+        socket.emit('toggle_ai_mode', { enabled: aiEnabled });
+    });
+    
+    socket.on('connect', () => { updateStatus('status-connecting', 'Server connected, waiting for PC...'); socket.emit('check_client_status'); });
+    socket.on('disconnect', () => { updateStatus('status-disconnected', 'Server disconnected'); cleanupState(); });
+    socket.on('connect_error', () => { updateStatus('status-disconnected', 'Connection Error'); cleanupState(); });
+    socket.on('client_connected', () => { updateStatus('status-connected', 'Remote PC Connected'); document.body.focus(); });
+    socket.on('client_disconnected', () => { updateStatus('status-disconnected', 'Remote PC Disconnected'); cleanupState(); });
+    socket.on('command_error', (data) => console.error(`Command Error: ${data.message}`));
+    
+    socket.on('ai_analysis_started', () => {
+        showAiStatus();
+    });
+    
+    socket.on('ai_analysis_complete', (data) => {
+        hideAiStatus();
+        if (data.answer) {
+            if (data.answer_type === 'essay') {
+                injectionText.value = data.answer;
+                document.body.classList.add('text-input-mode');
+                document.getElementById('injection-status').textContent = '🤖 AI essay answer loaded! Press F2 on client to type.';
+            } else {
+                document.getElementById('injection-status').textContent = `🤖 AI found answer: ${data.answer} (will auto-click)`;
+            }
+            socket.emit('set_injection_text', { text_to_inject: injectionText.value });
+        } else {
+            document.getElementById('injection-status').textContent = '🤖 AI could not find an answer in the screenshot.';
+        }
+        setTimeout(() => { document.getElementById('injection-status').textContent = ''; }, 5000);
+    });
+    
+    socket.on('ai_analysis_error', () => {
+        hideAiStatus();
+        document.getElementById('injection-status').textContent = '❌ AI analysis failed. Check API key.';
+        setTimeout(() => { document.getElementById('injection-status').textContent = ''; }, 3000);
+    });
+    
+    // Input-to-display latency: every flushed input batch gets an ID, the PC tags the first
+    // frame captured after applying it, and the delay is measured once that frame is decoded.
+    const INPUT_LATENCY_BUCKETS = [16, 33, 50, 75, 100, 150, 200, 300, 500, 1000];
+    const inputLatencyCounts = new Array(INPUT_LATENCY_BUCKETS.length + 1).fill(0);
+    const inputIdPrefix = Math.random().toString(36).slice(2, 8);
+    const inputSentAt = new Map();
+    let inputSeq = 0;
+    let recentInputLatencies = [];
+    let unreportedInputLatencies = [];
+    function nextInputId() { const inputId = `${inputIdPrefix}-${++inputSeq}`; inputSentAt.set(inputId, performance.now()); return inputId; }
+    function recordInputLatency(inputIds, displayedAt) { inputIds.forEach((inputId) => { const sentAt = inputSentAt.get(inputId); if (sentAt === undefined) return; inputSentAt.delete(inputId); const latency = Math.round(displayedAt - sentAt); let bucket = INPUT_LATENCY_BUCKETS.findIndex((bound) => latency <= bound); if (bucket === -1) bucket = INPUT_LATENCY_BUCKETS.length; inputLatencyCounts[bucket]++; recentInputLatencies.push(latency); unreportedInputLatencies.push(latency); }); if (recentInputLatencies.length > 100) recentInputLatencies = recentInputLatencies.slice(-100); renderInputLatency(); }
+    function renderInputLatency() { if (!recentInputLatencies.length) return; const sorted = [...recentInputLatencies].sort((a, b) => a - b); const p50 = sorted[Math.floor(sorted.length * 0.5)]; const p95 = sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * 0.95))]; inputLatencyText.textContent = `input ${p50}/${p95}ms`; const max = Math.max(...inputLatencyCounts); inputLatencyHistogram.textContent = 'Input-to-display latency\\n' + inputLatencyCounts.map((count, i) => { const label = i < INPUT_LATENCY_BUCKETS.length ? `<=${INPUT_LATENCY_BUCKETS[i]}ms` : `>${INPUT_LATENCY_BUCKETS[INPUT_LATENCY_BUCKETS.length - 1]}ms`; return `${label.padStart(8)} ${'#'.repeat(max ? Math.round((count / max) * 30) : 0)} ${count}`; }).join('\\n'); }
+    inputLatencyText.addEventListener('click', () => { inputLatencyHistogram.style.display = inputLatencyHistogram.style.display === 'block' ? 'none' : 'block'; });
+    setInterval(() => { const cutoff = performance.now() - 5000; inputSentAt.forEach((sentAt, inputId) => { if (sentAt < cutoff) inputSentAt.delete(inputId); }); if (unreportedInputLatencies.length) { socket.emit('input_latency_report', { samples: unreportedInputLatencies }); unreportedInputLatencies = []; } }, 5000);
+    
+    // Canvas renderer: JPEGs are decoded to ImageBitmaps in a worker, one at a time, and painted
+    // at most once per animation frame. A full frame supersedes anything still waiting to be
+    // decoded or painted; partial updates (meta.rect) are kept and drawn in order on top.
+    // Large frames arrive as horizontal slices (meta.slice), each its own JPEG, painted as they come;
+    // slices of a picture that a newer one has superseded are dropped before they are decoded.
+    // Every watched monitor gets its own renderer (canvas, decoder worker and video decoder).
+    // Frames are painted onto an offscreen picture of the whole monitor and the visible canvas shows
+    // the current view of it. Zooming (Ctrl+wheel, Ctrl+drag to pan) asks the PC to stream just that
+    // region at native resolution and high quality (meta.roi) while the rest refreshes slowly.
+    const FRAME_DECODER_SOURCE = "self.onmessage = (e) => { const { seq, bytes, meta } = e.data; createImageBitmap(new Blob([bytes], { type: 'image/jpeg' })).then((bitmap) => self.postMessage({ seq, bitmap, meta }, [bitmap])).catch(() => self.postMessage({ seq, bitmap: null, meta })); };";
+    const ROI_MAX_ZOOM = 8;
+    const renderers = new Map();
+    let frameSeq = 0;
+    
+    // Jitter buffer: frames carry their capture time (meta.captured_at). Transit time minus the
+    // smallest recent transit is the jitter a frame saw; presentation is delayed by the 95th
+    // percentile of that (capped), so frames are painted at the pace they were captured. Anything
+    // already overtaken by a newer due full frame is late and dropped instead of painted in a burst.
+    const JITTER_WINDOW = 120;
+    const JITTER_MAX_DELAY_MS = 100;
+    const streamStats = { presented: 0, bytes: 0, decodeMs: 0, decoded: 0, dropped: 0, bufferMs: 0, layer: null };
+    function isPartial(meta) { return !!(meta && (meta.rect || meta.roi || meta.slice)); }
+    
+    function createRenderer(monitorIndex) {
+        const canvas = document.createElement('canvas');
+        canvas.width = 1; canvas.height = 1;
+        canvas.title = (monitorIndex !== null ? `Monitor ${monitorIndex} - ` : '') + 'Ctrl+wheel to zoom, Ctrl+drag to pan';
+        screenViewArea.appendChild(canvas);
+        const context = canvas.getContext('2d');
+        const picture = document.createElement('canvas');
+        const pictureContext = picture.getContext('2d');
+        const renderer = { monitor: monitorIndex, canvas: canvas, width: null, height: null };
+        let decoderBusy = false;
+        let decodeBacklog = [];
+        let pendingDraws = [];
+        let droppedInputIds = [];
+        let drawScheduled = false;
+        let frameDecoder = null;
+        let decodeStartedAt = 0;
+        const jitter = { transits: [], minTransit: 0, target: 0 };
+        let view = null;
+        let lastRoi = null;
+        let panStart = null;
+        let roiTimer = null;
+        let pictureSeq = null;
+        try { frameDecoder = new Worker(URL.createObjectURL(new Blob([FRAME_DECODER_SOURCE], { type: 'text/javascript' }))); frameDecoder.onmessage = (e) => onFrameDecoded(e.data); } catch (err) { console.warn('Frame decoder worker unavailable, decoding on the main thread:', err); }
+        
+        function observeTransit(meta) { if (!meta || !meta.captured_at) return; jitter.transits.push(Date.now() - meta.captured_at); if (jitter.transits.length > JITTER_WINDOW) jitter.transits.shift(); jitter.minTransit = Math.min(...jitter.transits); const excess = jitter.transits.map((transit) => transit - jitter.minTransit).sort((a, b) => a - b); jitter.target = Math.min(JITTER_MAX_DELAY_MS, excess[Math.floor(excess.length * 0.95)]); streamStats.bufferMs = jitter.target; }
+        function dropFrames(frames) { streamStats.dropped += frames.length; frames.forEach((frame) => { if (frame.bitmap) frame.bitmap.close(); if (frame.meta && frame.meta.input_ids) droppedInputIds = droppedInputIds.concat(frame.meta.input_ids); }); }
+        function submitDecode(frame) { decoderBusy = true; decodeStartedAt = performance.now(); if (frameDecoder) { frameDecoder.postMessage(frame, frame.bytes instanceof ArrayBuffer ? [frame.bytes] : []); } else { createImageBitmap(new Blob([frame.bytes], { type: 'image/jpeg' })).then((bitmap) => onFrameDecoded({ seq: frame.seq, bitmap, meta: frame.meta })).catch(() => onFrameDecoded({ seq: frame.seq, bitmap: null, meta: frame.meta })); } }
+        function supersedeSlices(meta) { if (meta.slice && meta.slice.index !== 0 && pictureSeq !== null && meta.seq <= pictureSeq) return meta.seq === pictureSeq; pictureSeq = meta.seq; const stale = decodeBacklog.filter((frame) => frame.meta && frame.meta.slice && frame.meta.seq !== pictureSeq); if (stale.length) { dropFrames(stale); decodeBacklog = decodeBacklog.filter((frame) => !stale.includes(frame)); } return true; }
+        function enqueueFrame(bytes, meta) { const frame = { seq: ++frameSeq, bytes: bytes, meta: meta || null }; if (frame.meta && frame.meta.seq !== undefined && (frame.meta.slice || !isPartial(frame.meta)) && !supersedeSlices(frame.meta)) { dropFrames([frame]); return; } if (!isPartial(frame.meta)) { dropFrames(decodeBacklog); decodeBacklog = []; } decodeBacklog.push(frame); if (!decoderBusy) submitDecode(decodeBacklog.shift()); }
+        function onFrameDecoded({ seq, bitmap, meta }) { decoderBusy = false; streamStats.decodeMs += performance.now() - decodeStartedAt; streamStats.decoded++; if (decodeBacklog.length) submitDecode(decodeBacklog.shift()); if (bitmap) queueDraw({ seq, bitmap, meta }); }
+        function queueDraw(frame) { frame.dueAt = frame.meta && frame.meta.captured_at ? frame.meta.captured_at + jitter.minTransit + jitter.target : 0; pendingDraws.push(frame); scheduleDraw(); }
+        function scheduleDraw() { if (!drawScheduled) { drawScheduled = true; requestAnimationFrame(drawPendingFrames); } }
+        function drawPendingFrames() {
+            drawScheduled = false; const now = Date.now();
+            let due = 0; while (due < pendingDraws.length && pendingDraws[due].dueAt <= now) due++;
+            let draws = pendingDraws.slice(0, due); pendingDraws = pendingDraws.slice(due);
+            if (pendingDraws.length) scheduleDraw();
+            // Only the newest due full frame is worth painting; partial updates after it still apply in order
+            let lastFull = -1; draws.forEach((frame, i) => { if (!isPartial(frame.meta)) lastFull = i; });
+            if (lastFull > 0) { dropFrames(draws.slice(0, lastFull)); draws = draws.slice(lastFull); }
+            if (!draws.length) return;
+            let inputIds = droppedInputIds; droppedInputIds = [];
+            streamStats.presented += draws.length;
+            draws.forEach(({ bitmap, meta }) => {
+                if (meta && meta.roi) { pictureContext.drawImage(bitmap, meta.roi.x, meta.roi.y); if (lastRoi) lastRoi.bitmap.close(); lastRoi = { bitmap: bitmap, roi: meta.roi }; }
+                else if (meta && meta.rect) { pictureContext.drawImage(bitmap, meta.rect.x, meta.rect.y); bitmap.close(); }
+                else {
+                    // Simulcast layers may be scaled down; meta.width/height give the full-resolution size to paint at
+                    const width = (meta && meta.width) || bitmap.displayWidth || bitmap.width; const height = (meta && meta.height) || bitmap.displayHeight || bitmap.height;
+                    const slice = meta && meta.slice;
+                    if ((!slice || slice.index === 0) && (picture.width !== width || picture.height !== height)) { picture.width = width; picture.height = height; view = null; }
+                    pictureContext.drawImage(bitmap, 0, slice ? slice.y : 0, width, slice ? slice.height : height); bitmap.close(); renderer.width = width; renderer.height = height;
+                    // Keep the sharp zoomed region on top of the low-quality background refresh
+                    if (lastRoi && view) pictureContext.drawImage(lastRoi.bitmap, lastRoi.roi.x, lastRoi.roi.y);
+                }
+                if (meta && meta.input_ids) inputIds = inputIds.concat(meta.input_ids);
+            });
+            present();
+            if (inputIds.length) recordInputLatency(inputIds, performance.now());
+        }
+        function currentView() { return view || { x: 0, y: 0, w: renderer.width, h: renderer.height }; }
+        function present() { if (!renderer.width) return; const v = currentView(); if (canvas.width !== v.w || canvas.height !== v.h) { canvas.width = v.w; canvas.height = v.h; } context.drawImage(picture, v.x, v.y, v.w, v.h, 0, 0, v.w, v.h); }
+        function scheduleRoiUpdate() { if (playbackId) return; clearTimeout(roiTimer); roiTimer = setTimeout(() => socket.emit('set_roi', { monitor: monitorIndex, roi: view ? { x: view.x, y: view.y, width: view.w, height: view.h } : null }), 150); }
+        function setView(x, y, w, h) {
+            if (w >= renderer.width && h >= renderer.height) { view = null; } else { view = { x: Math.round(Math.min(Math.max(x, 0), renderer.width - w)), y: Math.round(Math.min(Math.max(y, 0), renderer.height - h)), w: w, h: h }; }
+            if (lastRoi && !view) { lastRoi.bitmap.close(); lastRoi = null; }
+            present(); scheduleRoiUpdate();
+        }
+        function zoomAt(event, factor) {
+            const v = currentView(); const rect = canvas.getBoundingClientRect(); const relX = (event.clientX - rect.left) / rect.width; const relY = (event.clientY - rect.top) / rect.height;
+            const zoom = Math.min(ROI_MAX_ZOOM, Math.max(1, (renderer.width / v.w) * factor)); const w = Math.round(renderer.width / zoom); const h = Math.round(renderer.height / zoom);
+            setView(v.x + relX * v.w - relX * w, v.y + relY * v.h - relY * h, w, h);
+        }
+        
+        // Video mode: packets carry meta.codec and must all be decoded in order (no skipping), so
+        // they go through a WebCodecs VideoDecoder whose output frames join the normal paint queue.
+        let videoDecoder = null;
+        let videoCodec = null;
+        let awaitingKeyframe = true;
+        const videoPacketMeta = new Map();
+        function resetVideoDecoder() { if (videoDecoder && videoDecoder.state !== 'closed') videoDecoder.close(); videoDecoder = null; videoCodec = null; awaitingKeyframe = true; videoPacketMeta.clear(); }
+        function decodeVideoPacket(bytes, meta) {
+            if (!('VideoDecoder' in window)) { if (videoCodec !== 'unsupported') { videoCodec = 'unsupported'; socket.emit('video_unsupported', { codec: meta.codec }); codecSelect.value = 'jpeg'; } return; }
+            if (!videoDecoder || videoCodec !== meta.codec) {
+                resetVideoDecoder();
+                videoCodec = meta.codec;
+                videoDecoder = new VideoDecoder({ output: (videoFrame) => { const packet = videoPacketMeta.get(videoFrame.timestamp) || {}; videoPacketMeta.delete(videoFrame.timestamp); if (packet.decodeStartedAt) { streamStats.decodeMs += performance.now() - packet.decodeStartedAt; streamStats.decoded++; } queueDraw({ seq: ++frameSeq, bitmap: videoFrame, meta: packet.meta || null }); }, error: (err) => { console.error('Video decode error:', err); resetVideoDecoder(); socket.emit('request_keyframe', { monitor: monitorIndex }); } });
+                VideoDecoder.isConfigSupported({ codec: meta.codec }).then((support) => { if (!support.supported) { socket.emit('video_unsupported', { codec: meta.codec }); codecSelect.value = 'jpeg'; } });
+                videoDecoder.configure({ codec: meta.codec, optimizeForLatency: true });
+            }
+            if (awaitingKeyframe && !meta.key) return;
+            awaitingKeyframe = false;
+            const timestamp = meta.ts * 1000;
+            videoPacketMeta.set(timestamp, { decodeStartedAt: performance.now(), meta: { input_ids: meta.input_ids, captured_at: meta.captured_at } });
+            videoDecoder.decode(new EncodedVideoChunk({ type: meta.key ? 'key' : 'delta', timestamp: timestamp, data: bytes }));
+        }
+        
+        renderer.enqueueFrame = (bytes, meta) => { streamStats.bytes += bytes.byteLength || 0; observeTransit(meta); if (meta && meta.codec) { decodeVideoPacket(bytes, meta); } else { if (videoDecoder) resetVideoDecoder(); enqueueFrame(bytes, meta); } };
+        // A zoomed region belongs to this viewer on the server; let it go when the renderer is reset or destroyed
+        renderer.reset = () => { if (view && !playbackId) socket.emit('set_roi', { monitor: monitorIndex, roi: null }); resetVideoDecoder(); jitter.transits = []; jitter.minTransit = 0; jitter.target = 0; decodeBacklog = []; dropFrames(pendingDraws); pendingDraws = []; droppedInputIds = []; pictureSeq = null; renderer.width = null; renderer.height = null; view = null; panStart = null; if (lastRoi) { lastRoi.bitmap.close(); lastRoi = null; } context.clearRect(0, 0, canvas.width, canvas.height); };
+        renderer.resendRoi = () => { if (view) scheduleRoiUpdate(); };
+        renderer.destroy = () => { renderer.reset(); clearTimeout(roiTimer); if (frameDecoder) frameDecoder.terminate(); canvas.remove(); };
+        
+        // Pointer input is in this monitor's picture coordinates (through the current zoom); the PC offsets it onto the desktop
+        function toRemoteCoords(event) { const rect = canvas.getBoundingClientRect(); const v = currentView(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; return { x: Math.round(v.x + (x / rect.width) * v.w), y: Math.round(v.y + (y / rect.height) * v.h), monitor: monitorIndex }; }
+        canvas.addEventListener('mousedown', (event) => { if (!event.ctrlKey || !view || event.button !== 0) return; event.preventDefault(); const rect = canvas.getBoundingClientRect(); panStart = { clientX: event.clientX, clientY: event.clientY, x: view.x, y: view.y, scale: view.w / rect.width }; });
+        window.addEventListener('mouseup', () => { panStart = null; });
+        canvas.addEventListener('mousemove', (event) => { if (!renderer.width) return; if (panStart) { setView(panStart.x - (event.clientX - panStart.clientX) * panStart.scale, panStart.y - (event.clientY - panStart.clientY) * panStart.scale, view.w, view.h); return; } queueMove(toRemoteCoords(event)); });
+        canvas.addEventListener('click', (event) => { if (!renderer.width || event.ctrlKey) return; queueCommand(Object.assign({ action: 'click', button: 'left' }, toRemoteCoords(event))); document.body.focus(); });
+        canvas.addEventListener('contextmenu', (event) => { event.preventDefault(); if (!renderer.width) return; queueCommand(Object.assign({ action: 'click', button: 'right' }, toRemoteCoords(event))); document.body.focus(); });
+        canvas.addEventListener('wheel', (event) => { event.preventDefault(); if (event.ctrlKey) { if (renderer.width) zoomAt(event, event.deltaY < 0 ? 1.25 : 0.8); return; } const dY = event.deltaY > 0 ? 1 : (event.deltaY < 0 ? -1 : 0); if (dY) queueCommand({ action: 'scroll', dy: dY }); });
+        return renderer;
+    }
+    
+    // Monitor selection: the viewer tells the server which monitors it shows, the server joins it to
+    // those monitors' rooms and the PC only captures monitors somebody is watching.
+    let monitorList = [];
+    let defaultMonitor = null;
+    let viewedMonitors = [];
+    function renderMonitorButtons() {
+        monitorButtons.innerHTML = '';
+        if (monitorList.length < 2) return;
+        const addButton = (label, indices, active) => { const button = document.createElement('button'); button.textContent = label; button.className = active ? 'control-button text-xs active' : 'control-button text-xs'; button.addEventListener('click', () => viewMonitors(indices)); monitorButtons.appendChild(button); };
+        monitorList.forEach((monitor) => addButton(`🖥️ ${monitor.index}`, [monitor.index], viewedMonitors.length === 1 && viewedMonitors[0] === monitor.index));
+        addButton('All', monitorList.map((monitor) => monitor.index), viewedMonitors.length === monitorList.length);
+    }
+    function viewMonitors(indices) {
+        viewedMonitors = indices;
+        renderers.forEach((renderer, monitorIndex) => { if (!indices.includes(monitorIndex)) { renderer.destroy(); renderers.delete(monitorIndex); } });
+        indices.forEach((monitorIndex) => { if (!renderers.has(monitorIndex)) renderers.set(monitorIndex, createRenderer(monitorIndex)); });
+        screenViewArea.classList.toggle('tiled', indices.length > 1);
+        sendWatchedMonitors();
+        renderMonitorButtons();
+    }
+    function rendererFor(meta) {
+        const monitorIndex = meta && meta.monitor !== undefined ? meta.monitor : null;
+        if (renderers.has(monitorIndex)) return renderers.get(monitorIndex);
+        // Frames without a monitor tag (older PCs) go to the first canvas; before the monitor list arrives, create one on demand
+        if (monitorIndex === null && renderers.size) return renderers.values().next().value;
+        if (renderers.size) return null;
+        const renderer = createRenderer(monitorIndex);
+        renderers.set(monitorIndex, renderer);
+        return renderer;
+    }
+    function applyMonitorList(data) { monitorList = data.monitors || []; defaultMonitor = data.default; if (!viewedMonitors.length || !viewedMonitors.every((index) => monitorList.some((monitor) => monitor.index === index))) { viewMonitors([defaultMonitor]); } else { renderMonitorButtons(); } }
+    socket.on('monitor_list', (data) => { if (!playbackId) applyMonitorList(data); });
+    // If the /bulk lane cannot connect, frames and clipboard come over the main connection until it does
+    let bulkFallback = false;
+    function frameLane() { return bulkFallback ? socket : bulkSocket; }
+    bulkSocket.on('connect', () => { if (bulkFallback) { bulkFallback = false; socket.emit('watch_monitors', { monitors: null }); socket.emit('use_fallback_lane', { enabled: false }); } sendWatchedMonitors(); });
+    bulkSocket.on('connect_error', () => { if (bulkFallback) return; console.warn('Bulk lane unavailable, receiving frames on the main connection'); bulkFallback = true; socket.emit('use_fallback_lane', { enabled: true }); sendWatchedMonitors(); });
+    socket.on('connect', () => { if (bulkFallback) socket.emit('use_fallback_lane', { enabled: true }); sendWatchedMonitors(); });
+    
+    // Binary fast path: frames arrive on a plain WebSocket as [4-byte header length][JSON meta][payload].
+    // While it is open the bulk lane stops carrying frames for this viewer; if it cannot open, the bulk lane stays in use.
+    let frameSocket = null;
+    function sendWatchedMonitors() {
+        if (playbackId) return;
+        // socket.id ties this lane to the main connection, which owns the viewer's zoomed regions
+        if (frameSocket) { frameSocket.send(JSON.stringify({ monitors: viewedMonitors, viewer: socket.id })); frameLane().emit('watch_monitors', { monitors: null }); }
+        else { frameLane().emit('watch_monitors', { monitors: viewedMonitors, viewer: socket.id }); }
+        renderers.forEach((renderer) => renderer.resendRoi());
+    }
+    function openFrameSocket() {
+        const ws = new WebSocket(`${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws/frames/view`);
+        ws.binaryType = 'arraybuffer';
+        ws.onopen = () => { frameSocket = ws; sendWatchedMonitors(); };
+        ws.onmessage = (e) => { if (typeof e.data === 'string') return; const headerLength = new DataView(e.data).getUint32(0); const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(e.data, 4, headerLength))); handleFrame(e.data.slice(4 + headerLength), meta); };
+        ws.onclose = () => { if (frameSocket !== ws) return; frameSocket = null; sendWatchedMonitors(); setTimeout(openFrameSocket, 2000); };
+    }
+    // Playback: the server streams recorded frames at the recorded pace in the same framing, plus
+    // JSON messages for session info, position, input and clipboard events. Seeking restarts from the nearest keyframe.
+    const playbackBar = document.getElementById('playback-bar');
+    const playbackSeek = document.getElementById('playback-seek');
+    const playbackTime = document.getElementById('playback-time');
+    const playbackEvent = document.getElementById('playback-event');
+    let playbackDuration = 0;
+    function formatTime(seconds) { const s = Math.floor(seconds); return `${Math.floor(s / 60)}:${String(s % 60).padStart(2, '0')}`; }
+    function showPlaybackPosition(t) { if (document.activeElement !== playbackSeek) playbackSeek.value = Math.floor(t); playbackTime.textContent = `${formatTime(t)} / ${formatTime(playbackDuration)}`; }
+    function openPlaybackSocket() {
+        const params = new URLSearchParams(window.location.search);
+        const ws = new WebSocket(`${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws/frames/playback?id=${encodeURIComponent(playbackId)}&t=${params.get('t') || 0}&speed=${params.get('speed') || 1}`);
+        ws.binaryType = 'arraybuffer';
+        playbackBar.style.display = 'flex';
+        ws.onmessage = (e) => {
+            if (typeof e.data !== 'string') { const headerLength = new DataView(e.data).getUint32(0); const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(e.data, 4, headerLength))); delete meta.captured_at; handleFrame(e.data.slice(4 + headerLength), meta); return; }
+            const message = JSON.parse(e.data);
+            if (message.type === 'info') { playbackDuration = message.duration; playbackSeek.max = Math.ceil(message.duration); updateStatus('status-connected', `Recording ${message.id}`); if (message.monitors.length) applyMonitorList(message); showPlaybackPosition(0); }
+            else if (message.type === 'position') showPlaybackPosition(message.t);
+            else if (message.type === 'input') playbackEvent.textContent = `${formatTime(message.t)} input: ${(message.event.batch || []).map((command) => command.action).join(', ')}`;
+            else if (message.type === 'clipboard') playbackEvent.textContent = `${formatTime(message.t)} clipboard ${message.event.direction === 'to_pc' ? 'to PC' : 'from PC'}`;
+            else if (message.type === 'end') playbackEvent.textContent = 'End of recording';
+            else if (message.type === 'error') updateStatus('status-disconnected', message.message);
+        };
+        playbackSeek.addEventListener('change', () => { cleanupState(); playbackEvent.textContent = ''; ws.send(JSON.stringify({ seek: parseInt(playbackSeek.value, 10) })); showPlaybackPosition(parseInt(playbackSeek.value, 10)); });
+    }
+    if (playbackId) openPlaybackSocket(); else openFrameSocket();
+    
+    // Stream stats overlay, refreshed once a second
+    statsToggleButton.addEventListener('click', () => { const visible = streamStatsOverlay.style.display === 'block'; streamStatsOverlay.style.display = visible ? 'none' : 'block'; statsToggleButton.classList.toggle('active', !visible); });
+    // The PC reports p50/p95 per capture stage (grab, convert, diff, encode, send) and bytes per frame
+    let captureStatsText = '';
+    socket.on('capture_stats', (data) => { captureStatsText = Object.entries(data.monitors || {}).map(([monitorIndex, stages]) => `PC monitor ${monitorIndex}: ` + ['grab', 'convert', 'diff', 'encode', 'send'].filter((stage) => stages[stage]).map((stage) => `${stage} ${stages[stage].p50}/${stages[stage].p95}`).join(' ') + ' ms' + (stages.bytes ? ` | ${Math.round(stages.bytes.p50 / 1024)} KB/frame` : '')).join('\\n') + (data.cpu ? `\\nPC CPU ${data.cpu.percent}% of ${data.cpu.budget}% budget` + (data.cpu.level ? ` | throttled: fps x${data.cpu.fps}, scale x${data.cpu.scale}` + (data.cpu.quality ? `, quality ${data.cpu.quality}` : '') : '') : ''); });
+    setInterval(() => { if (streamStatsOverlay.style.display === 'block') { streamStatsOverlay.textContent = `${streamStats.presented} fps | ${Math.round(streamStats.bytes * 8 / 1000)} kbps | decode ${streamStats.decoded ? (streamStats.decodeMs / streamStats.decoded).toFixed(1) : '-'} ms | buffer ${Math.round(streamStats.bufferMs)} ms | dropped ${streamStats.dropped}` + (streamStats.layer !== null ? ` | layer ${streamStats.layer}` : '') + (captureStatsText ? '\\n' + captureStatsText : ''); } Object.assign(streamStats, { presented: 0, bytes: 0, decodeMs: 0, decoded: 0, dropped: 0 }); }, 1000);
+    
+    // Layered (simulcast) frames ask for an acknowledgement; the server uses it to measure this viewer's delivery rate
+    function handleFrame(imageDataBytes, meta) { if (meta && meta.layer !== undefined) streamStats.layer = meta.layer; const renderer = rendererFor(meta); if (renderer) renderer.enqueueFrame(imageDataBytes, meta); }
+    function onScreenFrameBytes(...args) { const ack = typeof args[args.length - 1] === 'function' ? args.pop() : null; const [imageDataBytes, meta] = args; if (ack) ack(); handleFrame(imageDataBytes, meta); }
+    bulkSocket.on('screen_frame_bytes', onScreenFrameBytes);
+    socket.on('screen_frame_bytes', onScreenFrameBytes);
+    
+    setInterval(() => { const start = Date.now(); socket.emit('ping_from_browser', () => { const latency = Date.now() - start; latencyText.textContent = `(${latency}ms)`; }); }, 2000);
+    
+    // Input is queued and flushed once per animation frame: mouse moves collapse to the
+    // latest position, everything else goes out in order as a single batch.
+    let pendingCommands = [];
+    let pendingMove = null;
+    let flushScheduled = false;
+    function flushCommands() { flushScheduled = false; if (pendingMove) { pendingCommands.push(pendingMove); pendingMove = null; } if (!pendingCommands.length || playbackId) { pendingCommands = []; return; } socket.emit('control_command', { batch: pendingCommands, input_id: nextInputId(), sent_at: Date.now() }); pendingCommands = []; }
+    function scheduleFlush() { if (flushScheduled) return; flushScheduled = true; requestAnimationFrame(flushCommands); }
+    function queueCommand(command) { if (pendingMove) { pendingCommands.push(pendingMove); pendingMove = null; } pendingCommands.push(command); scheduleFlush(); }
+    function queueMove(pos) { if (pendingMove && pendingMove.monitor !== pos.monitor) pendingCommands.push(pendingMove); pendingMove = Object.assign({ action: 'move' }, pos); scheduleFlush(); }
+    
+    document.body.addEventListener('keydown', (event) => { if (document.activeElement.tagName === 'TEXTAREA') return; const keysToPrevent = ['Tab', 'Enter', 'Escape', 'Backspace', 'Delete', 'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', ' ']; if (keysToPrevent.includes(event.key) || (event.key.length === 1 && !event.ctrlKey && !event.altKey && !event.metaKey)) { event.preventDefault(); } queueCommand({ action: 'keydown', key: event.key, code: event.code }); });
+    document.body.addEventListener('keyup', (event) => { if (document.activeElement.tagName === 'TEXTAREA') return; queueCommand({ action: 'keyup', key: event.key, code: event.code }); });
+    
+    toggleTextModeButton.addEventListener('click', () => { document.body.classList.toggle('text-input-mode'); });
+    document.getElementById('send-injection-text-button').addEventListener('click', () => { const text = document.getElementById('injection-text').value; socket.emit('set_injection_text', { text_to_inject: text }); });
+    
+    socket.on('text_injection_set_ack', (data) => { const statusEl = document.getElementById('injection-status'); statusEl.textContent = data.status === 'success' ? 'Text saved for client!' : `Error: ${data.message || 'Failed to save.'}`; setTimeout(() => { statusEl.textContent = ''; }, 3000); });
+    
+    function sendSettingsUpdate() { const settings = { quality: parseInt(qualitySlider.value, 10), fps: parseInt(fpsSlider.value, 10), codec: codecSelect.value }; if (viewedMonitors.length === 1) settings.monitor = viewedMonitors[0]; socket.emit('update_client_settings', settings); }
+    qualitySlider.addEventListener('change', sendSettingsUpdate);
+    fpsSlider.addEventListener('change', sendSettingsUpdate);
+    codecSelect.addEventListener('change', sendSettingsUpdate);
+    
+    // Large text and images arrive in chunks keyed by content hash and are written once complete
+    let clipboardTransfer = null;
+    function writeBrowserClipboard(mime, blob) { if (!navigator.clipboard) return; const write = mime.startsWith('text/') ? blob.text().then((text) => navigator.clipboard.writeText(text)) : navigator.clipboard.write([new ClipboardItem({ [mime]: blob })]); write.catch(err => console.error('Failed to write to browser clipboard:', err)); }
+    function onBrowserClipboardUpdate(data) { if (data.text !== undefined) { if (navigator.clipboard && data.text) { navigator.clipboard.writeText(data.text).catch(err => console.error('Failed to write to browser clipboard:', err)); } return; } if (!clipboardTransfer || clipboardTransfer.id !== data.id) { clipboardTransfer = { id: data.id, parts: new Array(data.count), received: 0 }; } if (!clipboardTransfer.parts[data.index]) { clipboardTransfer.parts[data.index] = data.data; clipboardTransfer.received++; } if (clipboardTransfer.received === data.count) { const blob = new Blob(clipboardTransfer.parts, { type: data.mime }); clipboardTransfer = null; writeBrowserClipboard(data.mime, blob); } }
+    bulkSocket.on('update_browser_clipboard', onBrowserClipboardUpdate);
+    socket.on('update_browser_clipboard', onBrowserClipboardUpdate);
+    const CLIPBOARD_CHUNK_SIZE = 256 * 1024;  // Same chunking and size limit as the PC client uses the other way
+    const CLIPBOARD_MAX_BYTES = 8 * 1024 * 1024;
+    function sendBrowserClipboard(mime, blob) {
+        if (blob.size > CLIPBOARD_MAX_BYTES) { console.warn(`Not sending ${mime} clipboard content of ${blob.size} bytes (limit ${CLIPBOARD_MAX_BYTES})`); return; }
+        const id = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+        const count = Math.max(1, Math.ceil(blob.size / CLIPBOARD_CHUNK_SIZE));
+        blob.arrayBuffer().then((buffer) => { for (let index = 0; index < count; index++) frameLane().emit('clipboard_from_browser', { id, mime, index, count, data: buffer.slice(index * CLIPBOARD_CHUNK_SIZE, (index + 1) * CLIPBOARD_CHUNK_SIZE) }); });
+    }
+    document.addEventListener('paste', (event) => {
+        if (document.activeElement !== document.body) return;
+        const image = Array.from(event.clipboardData.items).find((item) => item.kind === 'file' && item.type.startsWith('image/'));
+        if (image) { sendBrowserClipboard(image.type, image.getAsFile()); return; }
+        const text = event.clipboardData.getData('text');
+        if (!text) return;
+        const blob = new Blob([text], { type: 'text/plain' });
+        // Short text keeps the single-message form; anything longer is chunked like images
+        if (blob.size <= CLIPBOARD_CHUNK_SIZE) socket.emit('clipboard_from_browser', { text: text }); else sendBrowserClipboard('text/plain', blob);
+    });
+    
+    uploadButton.addEventListener('click', () => fileInput.click());
+    fileInput.addEventListener('change', (event) => { const file = event.target.files[0]; if (file) uploadFile(file); fileInput.value = ''; });
+    
+    function uploadFile(file) { const progressContainer = document.getElementById('file-progress-container'); const progressText = document.getElementById('file-name-progress'); const progressBar = document.getElementById('file-progress'); const progressPercent = document.getElementById('file-percent-progress'); progressText.textContent = `Uploading: ${file.name}`; progressContainer.style.display = 'block'; const xhr = new XMLHttpRequest(); xhr.open('PUT', `/transfer/upload?name=${encodeURIComponent(file.name)}`); xhr.upload.onprogress = (e) => { if (!e.lengthComputable) return; const percentComplete = Math.round((e.loaded / e.total) * 100); progressBar.style.width = `${percentComplete}%`; progressPercent.textContent = `${percentComplete}%`; }; xhr.onload = () => { if (xhr.status !== 200) { console.error('File upload failed:', xhr.responseText); progressContainer.style.display = 'none'; return; } setTimeout(() => { progressContainer.style.display = 'none'; }, 2000); }; xhr.onerror = () => { console.error('File upload failed: network error'); progressContainer.style.display = 'none'; }; xhr.send(file); }
+    
+    downloadButton.addEventListener('click', () => { const path = prompt('Full path of the file on the remote PC:'); if (path) window.location.href = `/transfer/download?path=${encodeURIComponent(path)}`; });
+});
+"""
+
+# --- Static Viewer Assets ---
+# Pages, CSS and JS are rendered, minified and compressed once per process instead of per request.
+# Assets get content-hashed URLs and are cached for a year; pages are revalidated through their ETag.
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PAGE_CACHE_CONTROL = 'private, no-cache'
+SOCKETIO_CLIENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor', 'socket.io.min.js')  # Upstream Socket.IO 4.7.5 build, committed
+SOCKETIO_CLIENT_URL = "https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.5/socket.io.min.js"  # Only used when the vendored copy is missing or altered
+# Base64 SHA-384 of the vendored bundle (its Subresource Integrity value without the 'sha384-' prefix).
+# The bundle is served as a hashed asset only when it matches; the environment variable overrides the
+# pin for a different bundle placed at SOCKETIO_CLIENT_PATH.
+SOCKETIO_CLIENT_SHA384 = os.environ.get('SOCKETIO_CLIENT_SHA384') or '2huaZvOR9iDzHqslqwpR87isEmrfxqyWOF7hr7BY6KG0+hVKLoEXMPUJw3ynWuhO'
+
+def minify_js(source):
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    return re.sub(r'\s*([{};,>])\s*', r'\1', re.sub(r'\s+', ' ', source)).strip()
+
+def minify_html(source):
+    return re.sub(r'>\s*\n\s*<', '><', source).strip()
+
+def compressed_entry(data, mimetype):
+    variants = {'identity': data, 'gzip': gzip.compress(data, compresslevel=9)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {'variants': variants, 'mimetype': mimetype, 'digest': hashlib.sha256(data).hexdigest()[:16]}
+
+def sha384_digest(data):
+    return base64.b64encode(hashlib.sha384(data).digest()).decode('ascii')
+
+def load_socketio_client():
+    """Return the vendored Socket.IO browser bundle, or None when it is missing or does not match SOCKETIO_CLIENT_SHA384"""
+    try:
+        with open(SOCKETIO_CLIENT_PATH, 'rb') as f:
+            bundle = f.read()
+    except OSError as e:
+        logger.error(f"Socket.IO client bundle unavailable ({e}); viewers will load it from {SOCKETIO_CLIENT_URL}")
+        return None
+    if sha384_digest(bundle) != SOCKETIO_CLIENT_SHA384:
+        logger.error(f"{SOCKETIO_CLIENT_PATH} does not match SOCKETIO_CLIENT_SHA384; viewers will load the bundle from {SOCKETIO_CLIENT_URL}")
+        return None
+    return bundle
+
+def build_viewer_bundle(render_page, asset_url):
+    """Render, minify, hash and compress the viewer; returns (pages, static assets by filename).
+    render_page(template, **context) renders a Jinja page template; asset_url(filename) is an asset's URL."""
+    static_assets = {}
+
+    def register_asset(name, extension, data, mimetype):
+        entry = compressed_entry(data, mimetype)
+        filename = f"{name}.{entry['digest']}.{extension}"
+        static_assets[filename] = entry
+        return asset_url(filename)
+
+    socketio_client = load_socketio_client()
+    assets = {
+        'utility_css': register_asset('utility', 'css', minify_css(UTILITY_CSS).encode('utf-8'), 'text/css'),
+        'interface_css': register_asset('interface', 'css', minify_css(INTERFACE_CSS).encode('utf-8'), 'text/css'),
+        'interface_js': register_asset('interface', 'js', minify_js(INTERFACE_JS).encode('utf-8'), 'application/javascript'),
+        'socketio_js': register_asset('socket.io', 'js', socketio_client, 'application/javascript') if socketio_client else SOCKETIO_CLIENT_URL,
+        'socketio_sri': None if socketio_client else f"sha384-{SOCKETIO_CLIENT_SHA384}"
+    }
+    pages = {
+        'login': render_page(LOGIN_HTML, assets=assets),
+        'login_error': render_page(LOGIN_HTML, assets=assets, error="Invalid password"),
+        'interface': render_page(INTERFACE_HTML, assets=assets)
+    }
+    pages = {name: compressed_entry(minify_html(html).encode('utf-8'), 'text/html') for name, html in pages.items()}
+    logger.info(f"Built viewer assets: {', '.join(sorted(static_assets))}")
+    return pages, static_assets
+
+# --- Relay Settings ---
+# Shared by both servers so the eventlet and asyncio modes relay, throttle and time out identically.
+BULK_NAMESPACE = '/bulk'
+VIEWERS_ROOM = 'viewers'
+RESUME_GRACE = 20  # Seconds a dropped PC session is held for a resume before viewers see it disconnect
+SIMULCAST_MAX_IN_FLIGHT = 2  # Unacknowledged pictures a viewer may have before pictures are skipped for it
+SIMULCAST_UPGRADE_DELAY = 5  # Seconds after a downgrade before a viewer may move back up
+SIMULCAST_RATE_WINDOW = 2  # Seconds of acknowledged frames a viewer's delivery rate is measured over
+SIMULCAST_KEEPUP_RATIO = 0.9  # A viewer tries the better layer once its delivery rate covers this fraction of its own layer's bitrate
+FRAME_SOCKET_PC_PATH = '/ws/frames/pc'
+FRAME_SOCKET_VIEW_PATH = '/ws/frames/view'
+FRAME_SOCKET_PLAYBACK_PATH = '/ws/frames/playback'  # Recorded sessions, see Session Recording
+FRAME_SOCKET_QUEUE_FRAMES = 2  # Pictures queued per fast-path viewer before pictures are skipped for it (a sliced frame is one picture)
+INPUT_LATENCY_BUCKETS_MS = [16, 33, 50, 75, 100, 150, 200, 300, 500, 1000]
+INPUT_COALESCE_INTERVAL = 0.008  # Seconds
+HTTP_TRANSFER_CHUNK_SIZE = 64 * 1024
+HTTP_TRANSFER_QUEUE_CHUNKS = 16
+HTTP_TRANSFER_TIMEOUT = 30  # Seconds to wait on the other side before giving up
+
+def monitor_room(monitor_index):
+    return f"monitor-{monitor_index}"
+
+def ewma(previous, sample, alpha=0.2):
+    return sample if previous is None else previous + alpha * (sample - previous)
+
+def pack_frame(data, meta):
+    header = json.dumps(meta or {}, separators=(',', ':')).encode()
+    return struct.pack('>I', len(header)) + header + data
+
+def unpack_frame_header(message):
+    """Return (meta, payload offset) of a frame in the fast-path framing"""
+    header_length = struct.unpack_from('>I', message)[0]
+    return json.loads(bytes(message[4:4 + header_length])), 4 + header_length
+
+def coalesce_moves(commands):
+    """Collapse consecutive mouse moves so only the latest position is kept"""
+    coalesced = []
+    for command in commands:
+        if coalesced and command.get('action') == 'move' and coalesced[-1].get('action') == 'move':
+            coalesced[-1] = command
+        else:
+            coalesced.append(command)
+    return coalesced
+
+def clipboard_record(direction, data):
+    """(meta, payload) for recording a clipboard event: text stays in the meta, chunk bytes become the payload"""
+    meta = {key: value for key, value in data.items() if key != 'data'}
+    payload = data.get('data')
+    return dict(meta, direction=direction), payload if isinstance(payload, bytes) else b''
+
+def parse_json_object(text):
+    """The JSON object in a fast-path WebSocket text message, or None for anything else"""
+    try:
+        message = json.loads(text)
+    except (ValueError, TypeError):
+        return None
+    return message if isinstance(message, dict) else None
+
+def parse_watch_message(text):
+    """(monitors, owner) from a fast-path viewer's watch message, or None when it is malformed"""
+    watch = parse_json_object(text)
+    if watch is None:
+        return None
+    monitors, owner = watch.get('monitors') or [], watch.get('viewer')
+    if not isinstance(monitors, list) or (owner is not None and not isinstance(owner, str)):
+        return None
+    return monitors, owner
+
+# --- Session Recording Format ---
+# With SESSION_RECORDING_DIR set, each remote PC session is written to <id>.rec as an append-only
+# stream of records: [1-byte kind][8-byte seconds since start][4-byte body length][body], where the
+# body uses the fast-path framing ([4-byte header length][JSON meta][payload]). Frames are stored
+# as relayed (simulcast layer 0 only); input batches and clipboard events are stored as meta only,
+# plus the clipboard bytes. <id>.idx holds (seconds, offset, monitor) for keyframes, at most one per
+# monitor per SESSION_INDEX_INTERVAL, so playback seeks without scanning; <id>.json is the header.
+SESSION_RECORDING_DIR = os.environ.get('SESSION_RECORDING_DIR')  # Directory for session recordings; unset disables recording
+SESSION_RECORDING_QUEUE = 512  # Records buffered for the writer before new ones are dropped
+SESSION_INDEX_INTERVAL = 1  # Seconds between index entries for the same monitor
+SESSION_KEYFRAME_INTERVAL = 10  # Seconds of video deltas before the recorder asks the PC for a keyframe
+RECORD_FRAME, RECORD_INPUT, RECORD_CLIPBOARD = b'F', b'I', b'C'
+RECORD_HEADER = struct.Struct('>cdI')
+INDEX_ENTRY = struct.Struct('>dQi')
+INDEX_NO_MONITOR = -1  # Index entry for frames without a monitor tag
+RECORDING_ID_PATTERN = re.compile(r'^[\w-]+$')
+
+def new_recording_id():
+    return time.strftime('%Y%m%d-%H%M%S') + '-' + os.urandom(3).hex()
+
+def recording_path(recording_id, extension):
+    return os.path.join(SESSION_RECORDING_DIR, f"{recording_id}.{extension}")
+
+def is_keyframe(meta):
+    """Full frames (not ROI or partial updates) that a viewer can start from; a sliced frame starts at its first slice"""
+    if meta.get('roi') or meta.get('rect') or (meta.get('slice') or {}).get('index'):
+        return False
+    return not meta.get('codec') or bool(meta.get('key'))
+
+def starts_picture(meta):
+    """Frame budgets count pictures: a sliced frame's first slice admits the whole picture"""
+    return not (meta.get('slice') or {}).get('index')
+
+def ends_picture(meta):
+    slice_info = meta.get('slice')
+    return not slice_info or slice_info['index'] == slice_info['count'] - 1
+
+def write_recording_header(header):
+    with open(recording_path(header['id'], 'json'), 'w') as f:
+        json.dump(header, f)
+
+def write_recording_batch(data_file, index_file, last_indexed, batch):
+    """Append (kind, seconds, meta, payload) records and their index entries; runs off the event loop"""
+    for kind, timestamp, meta, payload in batch:
+        header = json.dumps(meta, separators=(',', ':')).encode()
+        offset = data_file.tell()
+        data_file.write(RECORD_HEADER.pack(kind, timestamp, 4 + len(header) + len(payload)))
+        data_file.write(struct.pack('>I', len(header)) + header)
+        data_file.write(payload)
+        if kind == RECORD_FRAME and is_keyframe(meta):
+            monitor_index = meta.get('monitor')
+            if timestamp - last_indexed.get(monitor_index, float('-inf')) >= SESSION_INDEX_INTERVAL:
+                last_indexed[monitor_index] = timestamp
+                index_file.write(INDEX_ENTRY.pack(timestamp, offset, INDEX_NO_MONITOR if monitor_index is None else monitor_index))
+    data_file.flush()
+    index_file.flush()
+
+def read_record(f):
+    """Next (kind, seconds, body) from a recording, or None at the end (or a record still being written)"""
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    kind, timestamp, length = RECORD_HEADER.unpack(header)
+    body = f.read(length)
+    if len(body) < length:
+        return None
+    return kind, timestamp, body
+
+def read_recording_header(recording_id):
+    with open(recording_path(recording_id, 'json')) as f:
+        return json.load(f)
+
+def read_recording_index(recording_id):
+    """Monitor -> ([seconds], [offsets]) of its indexed keyframes, in recording order"""
+    with open(recording_path(recording_id, 'idx'), 'rb') as f:
+        data = f.read()
+    index = {}
+    for timestamp, offset, monitor_index in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+        timestamps, offsets = index.setdefault(None if monitor_index == INDEX_NO_MONITOR else monitor_index, ([], []))
+        timestamps.append(timestamp)
+        offsets.append(offset)
+    return index
+
+def recording_duration(header, index):
+    if header.get('ended_at'):
+        return header['ended_at'] - header['started_at']
+    return max((timestamps[-1] for timestamps, _ in index.values()), default=0)
+
+def seek_offset(index, position):
+    """Offset to read from so every monitor starts at its last keyframe at or before position"""
+    offsets = []
+    for timestamps, monitor_offsets in index.values():
+        i = bisect.bisect_right(timestamps, position) - 1
+        if i >= 0:
+            offsets.append(monitor_offsets[i])
+    return min(offsets, default=0)
+
+def playback_event(kind, timestamp, body):
+    """JSON message sent to a playback viewer for a recorded input or clipboard event"""
+    meta, _ = unpack_frame_header(body)
+    return json.dumps({'type': 'input' if kind == RECORD_INPUT else 'clipboard', 't': timestamp, 'event': meta})
+
+def playback_info(recording_id, header, index):
+    monitors = header.get('monitors') or {}
+    return json.dumps({'type': 'info', 'id': recording_id, 'duration': recording_duration(header, index),
+                       'monitors': monitors.get('monitors', []), 'default': monitors.get('default')})
+
+def parse_finite(value, default):
+    """value as a finite float, or default when it is missing, not a number, NaN or infinite"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if math.isfinite(number) else default
+
+def parse_playback_params(params):
+    """(recording id, start seconds, speed) from playback query parameters, or None for an unknown recording"""
+    recording_id = params.get('id', '')
+    if not SESSION_RECORDING_DIR or not RECORDING_ID_PATTERN.match(recording_id) or not os.path.exists(recording_path(recording_id, 'rec')):
+        return None
+    return recording_id, max(parse_finite(params.get('t'), 0.0), 0.0), max(parse_finite(params.get('speed'), 1.0), 0.1)
+
+def parse_seek_command(text):
+    """Seconds to seek to from a playback viewer's command, or None for anything that is not a valid seek"""
+    command = parse_json_object(text)
+    if command is None or 'seek' not in command:
+        return None
+    position = parse_finite(command['seek'], None)
+    return None if position is None else max(position, 0.0)
+
+def list_recordings(play_url):
+    """Newest first; play_url(recording_id) is the viewer URL that replays a recording"""
+    if not SESSION_RECORDING_DIR or not os.path.isdir(SESSION_RECORDING_DIR):
+        return []
+    listed = []
+    for name in sorted(os.listdir(SESSION_RECORDING_DIR), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        recording_id = name[:-len('.json')]
+        try:
+            header = read_recording_header(recording_id)
+            duration = recording_duration(header, read_recording_index(recording_id))
+            size = os.path.getsize(recording_path(recording_id, 'rec'))
+        except (OSError, ValueError):
+            continue
+        listed.append({'id': recording_id, 'started_at': header['started_at'], 'live': not header.get('ended_at'),
+                       'duration': round(duration, 1), 'bytes': size, 'play': play_url(recording_id)})
+    return listed